@@ -0,0 +1,320 @@
+import asyncio
+import pickle
+
+from concurrent.futures import ThreadPoolExecutor
+
+from hypercorn.asyncio import serve as hypercorn_serve
+from hypercorn.config import Config
+from quart import Blueprint, Quart, Response, abort, jsonify, request
+
+import endpoints
+import metrics
+import profiler
+import wire
+
+from async_transport import AsyncPeerTransport
+from endpoints import node
+from node import RELAYED_TO_HEADER
+
+###########################################################
+################## INITIALIZATIONS ########################
+###########################################################
+
+
+# Max number of node operations (validation, mining, ...) that run at the
+# same time off the event loop.
+NODE_WORKERS = 64
+# The threads that run the blocking operations of the node.
+executor = ThreadPoolExecutor(NODE_WORKERS)
+# Define a Blueprint for the async api endpoints.
+async_rest_api = Blueprint('async_rest_api', __name__)
+
+
+async def run(func, *args):
+    '''Runs a blocking method of the node off the event loop.'''
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, func, *args)
+
+
+async def read_payload():
+    '''Decodes the body of a request, which is in the binary wire format or
+        in pickle format depending on its content type.'''
+    data = await request.get_data()
+    try:
+        return await run(node.decode, data, request.content_type)
+    except ValueError as e:
+        abort(400, description=str(e))
+
+
+###########################################################
+################## API/API COMMUNICATION ##################
+###########################################################
+
+
+@async_rest_api.route('/get_block', methods=['POST'])
+async def get_block():
+    '''Async version of endpoints.get_block.'''
+    new_block = await read_payload()
+    message, status = await run(node.receive_block, new_block)
+    return jsonify(message), status
+
+
+@async_rest_api.route('/validate_transaction', methods=['POST'])
+async def validate_transaction():
+    '''Async version of endpoints.validate_transaction.'''
+    new_transaction = await read_payload()
+    message, status = await run(endpoints.check_transaction, new_transaction)
+    return jsonify(message), status
+
+
+@async_rest_api.route('/get_transaction', methods=['POST'])
+async def get_transaction():
+    '''Async version of endpoints.get_transaction.'''
+    new_transaction = await read_payload()
+    await run(node.add_transaction_to_block, new_transaction)
+    return jsonify({'message': "OK"}), 200
+
+
+@async_rest_api.route('/gossip_transaction', methods=['POST'])
+async def gossip_transaction():
+    '''Async version of endpoints.gossip_transaction.'''
+    new_transaction = await read_payload()
+    relayed_to = endpoints.parse_relayed_to(
+        request.headers.get(RELAYED_TO_HEADER, ''))
+    message, status = await run(
+        node.receive_gossip, new_transaction, relayed_to)
+    return jsonify(message), status
+
+
+@async_rest_api.route('/register_node', methods=['POST'])
+async def register_node():
+    '''Async version of endpoints.register_node.'''
+    form = await request.form
+    return jsonify({'id': await run(endpoints.register, form)})
+
+
+@async_rest_api.route('/get_ring', methods=['POST'])
+async def get_ring():
+    '''Async version of endpoints.get_ring.'''
+    if request.is_json:
+        ring = await request.get_json()
+    else:
+        ring = pickle.loads(await request.get_data())
+    await run(endpoints.set_ring, ring)
+    return jsonify({'message': "OK", 'height': len(node.chain.blocks)})
+
+
+@async_rest_api.route('/get_chain', methods=['POST'])
+async def get_chain():
+    '''Async version of endpoints.get_chain.'''
+    chain = await read_payload()
+    message, status = await run(endpoints.set_chain, chain)
+    return jsonify(message), status
+
+
+@async_rest_api.route('/send_chain', methods=['GET'])
+async def send_chain():
+    '''Async version of endpoints.send_chain.'''
+    if wire.CONTENT_TYPE in request.headers.get('Accept', ''):
+        data = await run(wire.encode, node.chain, node.keys)
+        return Response(data, content_type=wire.CONTENT_TYPE)
+    return await run(pickle.dumps, node.chain)
+
+
+@async_rest_api.route('/stream_chain', methods=['GET'])
+async def stream_chain():
+    '''Async version of endpoints.stream_chain.'''
+    start, end, binary = endpoints.stream_options(request.args, request.headers)
+    height = len(node.chain.blocks)
+    frames = node.stream_chain(start, end, binary)
+
+    async def stream():
+        # Each block is encoded off the event loop.
+        while True:
+            data = await run(next, frames, None)
+            if data is None:
+                return
+            yield data
+
+    return Response(stream(),
+                    content_type=(wire.STREAM_CONTENT_TYPE if binary
+                                  else wire.PICKLE_STREAM_CONTENT_TYPE),
+                    headers={'X-Chain-Height': str(height)})
+
+
+@async_rest_api.route('/get_headers', methods=['POST'])
+async def get_headers():
+    '''Async version of endpoints.get_headers.'''
+    locator = await request.get_json(silent=True) or {}
+    return jsonify(await run(node.find_headers, locator.get('locator', [])))
+
+
+@async_rest_api.route('/get_blocks', methods=['POST'])
+async def get_blocks():
+    '''Async version of endpoints.get_blocks.'''
+    hashes = (await request.get_json(silent=True) or {}).get('hashes', [])
+    chain = endpoints.blocks_to_chain(await run(node.find_blocks, hashes))
+    if wire.CONTENT_TYPE in request.headers.get('Accept', ''):
+        data = await run(wire.encode, chain, node.keys)
+        return Response(data, content_type=wire.CONTENT_TYPE)
+    return await run(pickle.dumps, chain)
+
+
+##############################################################
+################## CLIENT/API COMMUNICATION ##################
+##############################################################
+
+
+@async_rest_api.route('/api/create_transaction', methods=['POST'])
+async def create_transaction():
+    '''Async version of endpoints.create_transaction.'''
+    form = await request.form
+    message, status = await run(endpoints.send_transaction, form)
+    return jsonify(message), status
+
+
+@async_rest_api.route('/api/get_balance', methods=['GET'])
+async def get_balance():
+    '''Async version of endpoints.get_balance.'''
+    return jsonify({'message': 'Current balance: ', 'balance': node.get_balance()})
+
+
+@async_rest_api.route('/api/get_balances', methods=['GET'])
+async def get_balances():
+    '''Async version of endpoints.get_balances.'''
+    return jsonify({'balances': node.ledger.get_ring_balances()})
+
+
+@async_rest_api.route('/api/get_transactions', methods=['GET'])
+async def get_transactions():
+    '''Async version of endpoints.get_transactions.'''
+    return pickle.dumps([tr.to_list() for tr in node.chain.blocks[-1].transactions])
+
+
+@async_rest_api.route('/api/get_my_transactions', methods=['GET'])
+async def get_my_transactions():
+    '''Async version of endpoints.get_my_transactions.'''
+    return pickle.dumps([tr.to_list() for tr in node.get_wallet_transactions()])
+
+
+@async_rest_api.route('/api/get_merkle_proof', methods=['GET'])
+async def get_merkle_proof():
+    '''Async version of endpoints.get_merkle_proof.'''
+    message, status = await run(
+        endpoints.find_merkle_proof, request.args.get('transaction_id', ''))
+    return jsonify(message), status
+
+
+@async_rest_api.route('/api/get_id', methods=['GET'])
+async def get_id():
+    '''Async version of endpoints.get_id.'''
+    return jsonify({'message': node.id})
+
+
+@async_rest_api.route('/api/get_metrics', methods=['GET'])
+async def get_metrics():
+    '''Async version of endpoints.get_metrics.'''
+    return jsonify(endpoints.get_metrics_info())
+
+
+@async_rest_api.route('/metrics', methods=['GET'])
+async def get_prometheus_metrics():
+    '''Async version of endpoints.get_prometheus_metrics.'''
+    return Response(metrics.REGISTRY.expose(), content_type=metrics.CONTENT_TYPE)
+
+
+##############################################################
+########################### ADMIN ############################
+##############################################################
+
+
+@async_rest_api.before_request
+async def restrict_admin():
+    '''Async version of endpoints.restrict_admin.'''
+    if request.path.startswith('/admin/') and request.remote_addr not in endpoints.ADMIN_ADDRESSES:
+        abort(403, description='The admin endpoints are only available from the host of the node.')
+
+
+@async_rest_api.route('/admin/profiler/start', methods=['POST'])
+async def start_profiler():
+    '''Async version of endpoints.start_profiler.'''
+    message, status = endpoints.start_profiler_with(await request.form)
+    return jsonify(message), status
+
+
+@async_rest_api.route('/admin/profiler/stop', methods=['POST'])
+async def stop_profiler():
+    '''Async version of endpoints.stop_profiler.'''
+    # Waits for the sampling thread to exit.
+    message, status = await run(endpoints.stop_profiler_info)
+    return jsonify(message), status
+
+
+@async_rest_api.route('/admin/profiler', methods=['GET'])
+async def get_profile():
+    '''Async version of endpoints.get_profile.'''
+    return Response(await run(profiler.PROFILER.export), content_type='text/plain',
+                    headers=endpoints.download_headers('profile-%s.folded' % node.id))
+
+
+@async_rest_api.route('/admin/trace/start', methods=['POST'])
+async def start_trace():
+    '''Async version of endpoints.start_trace.'''
+    profiler.TRACER.start()
+    return jsonify({'message': 'Tracing started.'})
+
+
+@async_rest_api.route('/admin/trace/stop', methods=['POST'])
+async def stop_trace():
+    '''Async version of endpoints.stop_trace.'''
+    profiler.TRACER.stop()
+    return jsonify({'message': 'Tracing stopped.', 'spans': len(profiler.TRACER.spans)})
+
+
+@async_rest_api.route('/admin/trace', methods=['GET'])
+async def get_trace():
+    '''Async version of endpoints.get_trace.'''
+    return Response(await run(endpoints.export_trace), content_type='application/json',
+                    headers=endpoints.download_headers('trace-%s.json' % node.id))
+
+
+##############################################################
+########################## SERVER ############################
+##############################################################
+
+
+def create_app():
+    '''Creates the ASGI application of the node.
+
+        The requests to the other nodes are sent by the event loop of the
+        application, through an AsyncPeerTransport.
+    '''
+
+    app = Quart(__name__)
+    app.register_blueprint(async_rest_api)
+
+    @app.before_serving
+    async def start_transport():
+        sync_transport = node.transport
+        node.transport = AsyncPeerTransport(
+            asyncio.get_running_loop(), timeout=sync_transport.timeout,
+            retries=sync_transport.retries)
+
+    @app.after_serving
+    async def stop_transport():
+        await node.transport.close()
+
+    @app.after_request
+    async def allow_origins(response):
+        # Same as the default behaviour of flask_cors.
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    return app
+
+
+def serve(host, port):
+    '''Runs the ASGI application of the node in the given address.'''
+    config = Config()
+    config.bind = [host + ':' + str(port)]
+    asyncio.run(hypercorn_serve(create_app(), config))
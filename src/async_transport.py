@@ -0,0 +1,127 @@
+import asyncio
+import json
+import time
+
+import aiohttp
+import requests
+
+from transport import PeerTransport, TIMEOUT, RETRIES, request_metrics
+
+# Default max number of requests to the peers that are in flight at the
+# same time.
+MAX_REQUESTS = 1000
+
+
+class AsyncResponse:
+    """
+    A response of a peer.
+
+    It has the attributes of requests.Response that the node uses.
+
+    Attributes:
+        status_code (int): the status code of the response.
+        content (bytes): the body of the response.
+        headers (dict): the headers of the response.
+    """
+
+    def __init__(self, status_code, content, headers):
+        """Inits an AsyncResponse."""
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    def json(self):
+        """Returns the body of the response decoded from json."""
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        """Raises an HTTPError if the status code is an error."""
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(
+                str(self.status_code) + ' error response', response=self)
+
+
+class AsyncPeerTransport(PeerTransport):
+    """
+    A transport layer between a node and its peers built on asyncio.
+
+    The requests are sent concurrently by the event loop of the server
+    through a single aiohttp session, instead of a thread per request.
+    The methods of PeerTransport can be called from any thread except the
+    thread of the event loop, so the node uses this transport unchanged.
+    Errors are raised as the corresponding exceptions of requests.
+    Streams (see open_stream) are read by the calling thread through the
+    sessions of PeerTransport.
+
+    Attributes:
+        loop (AbstractEventLoop): the event loop that sends the requests.
+        client (ClientSession): the aiohttp session (created on first use).
+    """
+
+    def __init__(self, loop, max_requests=MAX_REQUESTS, timeout=TIMEOUT,
+                 retries=RETRIES):
+        """Inits an AsyncPeerTransport.
+
+        The threads of PeerTransport are started only when requests are
+        submitted to them, so the transport doesn't start any.
+        """
+        super().__init__(max_requests, timeout, retries)
+        self.loop = loop
+        self.client = None
+
+    async def send(self, method, peer, endpoint, data=None, headers=None,
+                   json=None):
+        """Sends a request to a peer (in the event loop).
+
+        Only connection errors are retried, not timeouts of requests that
+        the peer may have already processed.
+        """
+
+        if self.client is None:
+            self.client = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_workers))
+
+        address = self.address(peer)
+        timeout, retries = self.get_peer_options(address)
+        latency, failures = request_metrics(endpoint, address)
+        start_time = time.perf_counter()
+        for attempt in range(retries + 1):
+            try:
+                async with self.client.request(
+                        method, address + endpoint, data=data,
+                        headers=headers, json=json,
+                        timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as response:
+                    content = await response.read()
+                    latency.observe(time.perf_counter() - start_time)
+                    return AsyncResponse(
+                        response.status, content, response.headers)
+            except asyncio.TimeoutError as e:
+                failures.inc()
+                raise requests.exceptions.Timeout(str(e))
+            except aiohttp.ClientConnectionError as e:
+                if attempt == retries:
+                    failures.inc()
+                    raise requests.exceptions.ConnectionError(str(e))
+            except aiohttp.ClientError as e:
+                failures.inc()
+                raise requests.exceptions.RequestException(str(e))
+
+    async def close(self):
+        """Closes the aiohttp session."""
+        if self.client:
+            await self.client.close()
+            self.client = None
+
+    def submit(self, method, peer, endpoint, **kwargs):
+        """Sends a request to a peer in the background.
+
+        Returns:
+            a Future with the response.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.send(method, peer, endpoint, **kwargs), self.loop)
+
+    def request(self, method, peer, endpoint, **kwargs):
+        """Sends a request to a peer and waits for the response."""
+        return self.submit(method, peer, endpoint, **kwargs).result()
@@ -3,6 +3,10 @@ from time import time
 from Crypto.Hash import SHA256
 import pickle
 
+import merkle
+
+from difficulty import get_work
+
 
 class Block:
     """
@@ -12,9 +16,12 @@ class Block:
         index (int): the sequence number of the block.
         timestamp (float): timestamp of the creation of the block.
         transactions (list): list of all the transactions in the block.
+        target (int): the hash of the block must be lower than the target.
         nonce (int): the solution of proof-of-work.
         previous_hash (hash object): hash of the previous block in the blockchain.
         current_hash (hash object): hash of the block.
+        merkle_cache (tuple): the transaction ids of the block and their
+                              Merkle root, as computed the last time.
     """
 
     def __init__(self, index, previous_hash):
@@ -22,9 +29,11 @@ class Block:
         self.index = index
         self.timestamp = time()
         self.transactions = []
+        self.target = None
         self.nonce = None
         self.previous_hash = previous_hash
         self.current_hash = None
+        self.merkle_cache = None
 
     def __str__(self):
         """Returns a string representation of a Block object"""
@@ -38,16 +47,76 @@ class Block:
 
         return self.current_hash == other.current_hash
 
+    def get_merkle_root(self):
+        """Returns the Merkle root of the transactions of the block.
+
+        The root is cached and recomputed only if the transactions of the
+        block have changed.
+        """
+
+        transaction_ids = tuple(tr.transaction_id for tr in self.transactions)
+        if self.merkle_cache is None or self.merkle_cache[0] != transaction_ids:
+            self.merkle_cache = (
+                transaction_ids, merkle.compute_root(transaction_ids))
+        return self.merkle_cache[1]
+
+    def has_unique_transactions(self):
+        """Returns True if no transaction appears twice in the block.
+
+        The Merkle tree pairs the last node of an odd level with itself, so
+        a block whose last transaction is repeated has the same root (and
+        hash) as the original block and must be rejected explicitly.
+        """
+
+        transaction_ids = [tr.transaction_id for tr in self.transactions]
+        return len(set(transaction_ids)) == len(transaction_ids)
+
+    def get_merkle_proof(self, transaction_id):
+        """Returns the Merkle inclusion proof of a transaction of the block,
+        or None if the block doesn't contain the transaction."""
+
+        transaction_ids = [tr.transaction_id for tr in self.transactions]
+        if transaction_id not in transaction_ids:
+            return None
+        return merkle.compute_proof(
+            transaction_ids, transaction_ids.index(transaction_id))
+
     def get_hash(self):
-        """Computes the current hash of the block."""
+        """Computes the current hash of the block.
+
+        The transactions are included in the hash through their Merkle root,
+        so the cost of the hash doesn't depend on the capacity of the block.
+        """
 
         # We should compute current hash without using the
         # field self.current_hash.
-        block_list = [self.timestamp, [
-            tr.transaction_id for tr in self.transactions], self.nonce, self.previous_hash]
+        return compute_hash(self.timestamp, self.get_merkle_root(),
+                            self.target, self.nonce, self.previous_hash)
+
+    def get_header(self):
+        """Returns the header of the block."""
+        return BlockHeader(self.index, self.timestamp, self.get_merkle_root(),
+                           self.target, self.nonce, self.previous_hash,
+                           self.current_hash)
 
-        block_dump = json.dumps(block_list.__str__())
-        return SHA256.new(block_dump.encode("ISO-8859-2")).hexdigest()
+    def get_header_parts(self):
+        """Returns the serialized parts of the block before and after the
+        nonce.
+
+        get_hash serializes [timestamp, merkle root, target, nonce,
+        previous_hash] in every call, although only the nonce changes during
+        mining. JSON escapes each character independently, so the
+        serialization is split around the nonce and the two parts are
+        computed once per block.
+        """
+
+        head = ("[" + repr(self.timestamp) + ", " +
+                repr(self.get_merkle_root()) + ", " + repr(self.target) + ", ")
+        tail = ", " + repr(self.previous_hash) + "]"
+
+        # Drop the closing quote of the head and the opening quote of the tail.
+        return (json.dumps(head)[:-1].encode("ISO-8859-2"),
+                json.dumps(tail)[1:].encode("ISO-8859-2"))
 
     def add_transaction(self, transaction, capacity):
         """Adds a new transaction in the block."""
@@ -57,3 +126,82 @@ class Block:
             return True
 
         return False
+
+
+class BlockHeader:
+    """
+    The header of a block, i.e. the fields of the block that its hash covers
+    (the transactions through their Merkle root).
+
+    Headers are exchanged by the nodes in order to find which blocks they
+    miss, without sending the transactions.
+
+    Attributes:
+        index (int): the sequence number of the block.
+        timestamp (float): timestamp of the creation of the block.
+        merkle_root (str): the Merkle root of the transactions of the block.
+        target (int): the hash of the block must be lower than the target.
+        nonce (int): the solution of proof-of-work.
+        previous_hash (hash object): hash of the previous block in the blockchain.
+        current_hash (hash object): hash of the block.
+    """
+
+    def __init__(self, index, timestamp, merkle_root, target, nonce,
+                 previous_hash, current_hash):
+        """Inits a BlockHeader."""
+        self.index = index
+        self.timestamp = timestamp
+        self.merkle_root = merkle_root
+        self.target = target
+        self.nonce = nonce
+        self.previous_hash = previous_hash
+        self.current_hash = current_hash
+
+    @classmethod
+    def fromlist(cls, header_list):
+        """Inits a BlockHeader object given a list (see to_list)."""
+        return cls(*header_list)
+
+    def __str__(self):
+        """Returns a string representation of a BlockHeader object"""
+        return str(self.__class__) + ": " + str(self.__dict__)
+
+    def to_list(self):
+        """Converts a BlockHeader object into a list."""
+        return [self.index, self.timestamp, self.merkle_root, self.target,
+                self.nonce, self.previous_hash, self.current_hash]
+
+    def get_hash(self):
+        """Computes the hash of the block of the header (the same as
+        Block.get_hash)."""
+        return compute_hash(self.timestamp, self.merkle_root, self.target,
+                            self.nonce, self.previous_hash)
+
+    def get_work(self):
+        """Returns the work of the block, i.e. the expected number of hashes
+        that its target needs, so that the chain with the most work is the
+        chain with the most hashing behind it.
+        """
+        return get_work(self.target)
+
+
+def compute_hash(timestamp, merkle_root, target, nonce, previous_hash):
+    """Computes the hash of a block given the fields of its header."""
+
+    block_list = [timestamp, merkle_root, target, nonce, previous_hash]
+    block_dump = json.dumps(block_list.__str__())
+    return SHA256.new(block_dump.encode("ISO-8859-2")).hexdigest()
+
+
+def hash_nonce(midstate, tail, nonce):
+    """Computes the hash of a block for the given nonce.
+
+    The midstate is a SHA256 object that has already hashed the head returned
+    by Block.get_header_parts, so only the nonce and the tail are hashed. The
+    result is the digest (bytes) of the hash of Block.get_hash, which is
+    compared to the target without converting it to hex.
+    """
+
+    h = midstate.copy()
+    h.update(b"%d" % nonce + tail)
+    return h.digest()
@@ -0,0 +1,95 @@
+from threading import Lock
+
+
+class TreeNode:
+    """
+    A known block in the block tree.
+
+    Attributes:
+        header (BlockHeader): the header of the block.
+        block (Block): the block (None until its transactions are known).
+        parent (TreeNode): the previous block (None for the genesis block).
+        height (int): the height of the block.
+        work (int): the cumulative work of the chain that ends at the block.
+        valid (boolean): True if the block has been validated, False if it
+                         is invalid and None if it has not been validated yet.
+    """
+
+    def __init__(self, header, parent, work):
+        """Inits a TreeNode."""
+        self.header = header
+        self.block = None
+        self.parent = parent
+        self.height = parent.height + 1 if parent else 0
+        self.work = (parent.work if parent else 0) + work
+        self.valid = None
+
+    def __str__(self):
+        """Returns a string representation of a TreeNode object"""
+        return str(self.__class__) + ": " + str(self.__dict__)
+
+
+class BlockTree:
+    """
+    An index of all the blocks that a node knows, in any branch.
+
+    Each block keeps the cumulative work of its chain, so two chains are
+    compared by their tips in O(1), and whether it has been validated, so a
+    block is never validated twice (e.g. when the node switches back to a
+    branch that it has seen before).
+
+    Attributes:
+        nodes (dict): the TreeNode of each known block given its hash.
+        lock (Lock): a lock in order to provide mutual exclusion when blocks
+                     are added.
+    """
+
+    def __init__(self):
+        """Inits an empty BlockTree."""
+        self.nodes = {}
+        self.lock = Lock()
+
+    def __len__(self):
+        """Returns the number of the known blocks."""
+        return len(self.nodes)
+
+    def get(self, block_hash):
+        """Returns the TreeNode of a block given its hash, or None."""
+        return self.nodes.get(block_hash)
+
+    def add_header(self, header):
+        """Adds the header of a block whose hash has been validated.
+
+        Returns:
+            the TreeNode of the block, or None if its previous block is not
+            known or is invalid.
+        """
+
+        with self.lock:
+            tree_node = self.nodes.get(header.current_hash)
+            if tree_node is not None:
+                return tree_node
+            if header.previous_hash == 1:
+                parent = None
+            else:
+                parent = self.nodes.get(header.previous_hash)
+                if parent is None or parent.valid is False:
+                    return None
+            tree_node = TreeNode(header, parent, header.get_work())
+            self.nodes[header.current_hash] = tree_node
+            return tree_node
+
+    def add_block(self, block, valid=None):
+        """Adds a block (and its header, if needed).
+
+        Returns:
+            the TreeNode of the block, or None if its previous block is not
+            known or is invalid.
+        """
+
+        tree_node = self.add_header(block.get_header())
+        if tree_node is not None:
+            tree_node.block = block
+            if valid is not None:
+                tree_node.valid = valid
+        return tree_node
@@ -4,16 +4,142 @@ class Blockchain:
 
     Attributes:
         blocks (list): list that contains the validated blocks of the chain.
+        store (BlockStore): the on-disk storage of the blocks (None if the
+                            chain is kept only in memory).
+        heights (dict): the height of each block given its hash.
+        tree (BlockTree): the index of all the blocks that the node knows
+                          (None if the chain is not the chain of a node).
+        state (ChainState): the balances and the unspent outputs, which
+                            follow the blocks of the chain (None if the
+                            chain is not the chain of a node).
     """
 
-    def __init__(self):
-        """Inits a Blockchain"""
-        self.blocks = []
+    def __init__(self, store=None, tree=None, state=None):
+        """Inits a Blockchain.
+
+        If a store is given, the blocks are loaded from it. The blocks of
+        the store have already been validated, so they are not validated
+        again. If a tree is given, the blocks of the chain are added in it
+        as validated. If a state is given, the blocks of the chain are
+        applied to it.
+        """
+        self.store = store
+        self.tree = tree
+        self.state = state
+        if store is not None:
+            self.blocks = list(store.iter_blocks())
+        else:
+            self.blocks = []
+        self.heights = {
+            block.current_hash: height
+            for height, block in enumerate(self.blocks)
+        }
+        if tree is not None:
+            for block in self.blocks:
+                tree.add_block(block, valid=True)
+        if state is not None:
+            state.update([], self.blocks)
 
     def __str__(self):
         """Returns a string representation of a Blockchain object"""
         return str(self.__class__) + ": " + str(self.__dict__)
 
+    def __getstate__(self):
+        """Excludes the store, the tree and the state when a Blockchain
+        object is pickled."""
+        state = self.__dict__.copy()
+        state['store'] = None
+        state['tree'] = None
+        state['state'] = None
+        return state
+
     def add_block(self, block):
         """Adds a new block in the chain."""
+        self.heights[block.current_hash] = len(self.blocks)
         self.blocks.append(block)
+        if self.store is not None:
+            self.store.append(block)
+        if self.tree is not None:
+            self.tree.add_block(block, valid=True)
+        if self.state is not None:
+            self.state.update([], [block])
+
+    def replace(self, blocks):
+        """Replaces the blocks of the chain with the given ones.
+
+        Only the blocks after the common prefix of the two chains are
+        removed from (and added in) the store.
+        """
+
+        i = 0
+        while (i < len(blocks) and i < len(self.blocks) and
+                blocks[i].current_hash == self.blocks[i].current_hash):
+            i += 1
+
+        if self.store is not None:
+            self.store.truncate(i)
+            for block in blocks[i:]:
+                self.store.append(block)
+        for block in self.blocks[i:]:
+            self.heights.pop(block.current_hash, None)
+        for height in range(i, len(blocks)):
+            self.heights[blocks[height].current_hash] = height
+            if self.tree is not None:
+                self.tree.add_block(blocks[height], valid=True)
+        if self.state is not None:
+            self.state.update(self.blocks[i:], blocks[i:])
+        self.blocks = list(blocks)
+
+    def get_tip(self):
+        """Returns the TreeNode of the last block of the chain, or None."""
+        if not self.blocks or self.tree is None:
+            return None
+        return self.tree.get(self.blocks[-1].current_hash)
+
+    def get_branch(self, tree_node):
+        """Returns the TreeNodes of the branch of the tree that ends at the
+        given block, after its last common block with the chain."""
+
+        branch = []
+        while (tree_node is not None and
+               self.heights.get(tree_node.header.current_hash) !=
+               tree_node.height):
+            branch.append(tree_node)
+            tree_node = tree_node.parent
+        branch.reverse()
+        return branch
+
+    def get_height(self, block_hash):
+        """Returns the height of a block given its hash, or None."""
+        return self.heights.get(block_hash)
+
+    def get_locator(self):
+        """Returns the block locator of the chain.
+
+        The locator contains the hashes of the last 10 blocks and then of
+        blocks at exponentially spaced heights back to the genesis block, so
+        another node finds the last common block of the two chains with
+        O(log n) hashes.
+        """
+
+        locator = []
+        height = len(self.blocks) - 1
+        step = 1
+        while height > 0:
+            locator.append(self.blocks[height].current_hash)
+            if len(locator) >= 10:
+                step *= 2
+            height -= step
+        if self.blocks:
+            locator.append(self.blocks[0].current_hash)
+        return locator
+
+    def find_fork(self, locator):
+        """Returns the height of the first block of a locator that is in
+        the chain, or -1 if no block is."""
+
+        for block_hash in locator:
+            height = self.heights.get(block_hash)
+            if height is not None:
+                return height
+        return -1
@@ -0,0 +1,117 @@
+import math
+import time
+
+# Seconds between two blocks that the retargeting aims at. It is part of the
+# consensus, so it is the same in all the nodes.
+BLOCK_INTERVAL = 1.0
+# Number of blocks between two retargets. The target of the blocks at the
+# heights that are multiples of the window is computed from the timestamps
+# of the previous window.
+RETARGET_WINDOW = 10
+# Max factor by which the target changes in one retarget.
+MAX_ADJUSTMENT = 4
+# The easiest possible target (a hash is valid if it is lower).
+MAX_TARGET = 2 ** 256 - 1
+# Max seconds by which the timestamp of a block may be ahead of the clock
+# of the node that validates it.
+MAX_FUTURE_TIME = 60
+# Min seconds between the timestamps of two consecutive blocks.
+MIN_TIME_STEP = 0.001
+
+
+def difficulty_to_target(difficulty):
+    """Returns the target of the hashes with the given number of leading
+    (hex) zeros."""
+    return min(16 ** (64 - difficulty), MAX_TARGET)
+
+
+def target_to_difficulty(target):
+    """Returns the difficulty of a target as a (fractional) number of
+    leading zeros."""
+    return 64 - math.log(target, 16)
+
+
+def meets_target(block_hash, target):
+    """Returns True if a hash (hex) is lower than the target."""
+    return int(block_hash, 16) < target
+
+
+def get_work(target):
+    """Returns the work of a block with the given target, i.e. the expected
+    number of hashes that are needed to mine it."""
+    return 2 ** 256 // target
+
+
+def retarget(target, timespan, expected, max_target):
+    """Scales a target by the ratio of the timespan of a window to the
+    expected one.
+
+    The timespans are rounded to milliseconds and the target is scaled in
+    integers, so that all the nodes compute exactly the same target.
+    """
+
+    actual = max(int(timespan * 1000), 1)
+    expected = max(int(expected * 1000), 1)
+    actual = min(max(actual, expected // MAX_ADJUSTMENT),
+                 expected * MAX_ADJUSTMENT)
+    return max(min(target * actual // expected, max_target), 1)
+
+
+def validate_timestamp(at, height, now):
+    """Checks the timestamp of the block at the given height (greater than
+    0).
+
+    The timestamp must be later than the timestamp of the previous block
+    and at most MAX_FUTURE_TIME seconds ahead of now, so that the miners
+    can't move the timespan of a window (and the next target) at will.
+
+    Args:
+        at: a function that returns the block (or the header) of the chain
+            at a height up to the given one.
+    """
+
+    timestamp = at(height).timestamp
+    return (timestamp >= at(height - 1).timestamp + MIN_TIME_STEP and
+            timestamp <= now + MAX_FUTURE_TIME)
+
+
+def validate_target(at, height, now):
+    """Checks that the block (or header) at the given height (greater than
+    0) has a valid timestamp and the target that its previous blocks
+    require."""
+    return (validate_timestamp(at, height, now) and
+            at(height).target == get_target(at, height))
+
+
+def find_invalid_target(blocks, start=1, now=None):
+    """Returns the height of the first block of a chain (from the height
+    start) with an invalid timestamp or target, or None."""
+
+    now = time.time() if now is None else now
+    for height in range(max(start, 1), len(blocks)):
+        if not validate_target(blocks.__getitem__, height, now):
+            return height
+    return None
+
+
+def get_target(at, height):
+    """Returns the target that the block at the given height must have.
+
+    The target is the target of the previous block, except at the retarget
+    heights, where it is scaled so that the blocks of the previous window
+    would have been mined every BLOCK_INTERVAL seconds. The target is never
+    easier than the target of the genesis block, so that an idle network
+    doesn't make the next blocks trivial to mine.
+
+    Args:
+        at: a function that returns the block (or the header) of the chain
+            at a height lower than the given one.
+        height: the height of the block (greater than 0).
+    """
+
+    parent = at(height - 1)
+    if height % RETARGET_WINDOW or height < RETARGET_WINDOW:
+        return parent.target
+    first = at(height - RETARGET_WINDOW)
+    return retarget(parent.target, parent.timestamp - first.timestamp,
+                    BLOCK_INTERVAL * (RETARGET_WINDOW - 1), at(0).target)
@@ -1,12 +1,17 @@
-import requests
+import json
 import pickle
-import time
 import node
 
-from flask import Blueprint, jsonify, request, render_template
+import metrics
+import profiler
+import wire
 
-from node import Node, MINING_DIFFICULTY
+from flask import Blueprint, Response, abort, jsonify, request, render_template
+
+from node import Node, RELAYED_TO_HEADER
 from block import Block
+from blockchain import Blockchain
+from difficulty import BLOCK_INTERVAL
 from transaction import Transaction
 from transaction_output import TransactionOutput
 from node import Node
@@ -22,6 +27,17 @@ node = Node()
 n = 0
 # Define a Blueprint for the api endpoints.
 rest_api = Blueprint('rest_api', __name__)
+# Addresses from which the admin endpoints can be called.
+ADMIN_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def read_payload():
+    '''Decodes the body of a request, which is in the binary wire format or
+        in pickle format depending on its content type.'''
+    try:
+        return node.decode(request.get_data(), request.content_type)
+    except ValueError as e:
+        abort(400, description=str(e))
 
 
 ###########################################################
@@ -35,45 +51,13 @@ def get_block():
         blockchain.
 
         Input:
-            new_block: the incoming block in pickle format.
+            new_block: the incoming block in wire or pickle format.
         Returns:
             message: the outcome of the procedure.
     '''
-    new_block = pickle.loads(request.get_data())
-    node.chain_lock.acquire()
-    if node.validate_block(new_block):
-        # If the block is valid:
-        # - Add block to the current blockchain.
-        # - Remove the new_block's transactions from the unconfirmed_blocks of the node.
-        # Update previous hash and index in case of insertions in the chain
-        node.stop_mining = True
-        with node.filter_lock:
-            node.chain.blocks.append(new_block)
-            node.chain_lock.release()
-            node.filter_blocks(new_block)
-            node.stop_mining = False
-    else:
-        # If the block is not valid, check if the signature is not authentic or
-        # there is a conflict.
-        if node.validate_previous_hash(new_block):
-            node.chain_lock.release()
-            return jsonify({'message': "The signature is not authentic. The block has been modified."}), 401
-        else:
-            # Resolve conflict (multiple blockchains/branch).
-            if node.resolve_conflicts(new_block):
-                # Add block to the current blockchain
-                node.stop_mining = True
-                with node.filter_lock:
-                    node.chain.blocks.append(new_block)
-                    node.chain_lock.release()
-                    # Remove the new_block's transactions from the unconfirmed_blocks of the node.
-                    node.filter_blocks(new_block)
-                    node.stop_mining = False
-            else:
-                node.chain_lock.release()
-                return jsonify({'mesage': "Block rejected."}), 409
-
-    return jsonify({'message': "OK"})
+    new_block = read_payload()
+    message, status = node.receive_block(new_block)
+    return jsonify(message), status
 
 
 @rest_api.route('/validate_transaction', methods=['POST'])
@@ -81,15 +65,31 @@ def validate_transaction():
     '''Endpoint that gets an incoming transaction and valdiates it.
 
         Input:
-            new_transaction: the incoming transaction in pickle format.
+            new_transaction: the incoming transaction in wire or pickle
+                             format, or a list of transactions to validate
+                             as a batch.
         Returns:
             message: the outcome of the procedure.
+            results: the outcome of each transaction (only for batches).
+    '''
+    message, status = check_transaction(read_payload())
+    return jsonify(message), status
+
+
+def check_transaction(new_transaction):
+    '''Validates an incoming transaction or a list of transactions.
+
+        Returns:
+            the message and the status code of the response.
     '''
-    new_transaction = pickle.loads(request.get_data())
+    if isinstance(new_transaction, list):
+        results = node.validate_transactions(new_transaction)
+        status = 200 if all(results) else 401
+        return {'message': "OK" if status == 200 else "Invalid transactions", 'results': results}, status
     if node.validate_transaction(new_transaction):
-        return jsonify({'message': "OK"}), 200
+        return {'message': "OK"}, 200
     else:
-        return jsonify({'message': "The signature is not authentic"}), 401
+        return {'message': "The signature is not authentic"}, 401
 
 
 @rest_api.route('/get_transaction', methods=['POST'])
@@ -98,17 +98,45 @@ def get_transaction():
         block.
 
         Input:
-            new_transaction: the incoming transaction in pickle format.
+            new_transaction: the incoming transaction in wire or pickle
+                             format.
         Returns:
             message: the outcome of the procedure.
     '''
 
-    new_transaction = pickle.loads(request.get_data())
+    new_transaction = read_payload()
     node.add_transaction_to_block(new_transaction)
 
     return jsonify({'message': "OK"}), 200
 
 
+@rest_api.route('/gossip_transaction', methods=['POST'])
+def gossip_transaction():
+    '''Endpoint that gets a gossiped transaction, validates it, forwards it
+        to the nodes that don't have it yet and adds it in the block.
+
+        Input:
+            new_transaction: the incoming transaction in wire or pickle
+                             format.
+            X-Noobcash-Relayed-To (header): the ids of the nodes that already
+                                            have the transaction.
+        Returns:
+            message: the outcome of the procedure.
+    '''
+    new_transaction = read_payload()
+    relayed_to = parse_relayed_to(request.headers.get(RELAYED_TO_HEADER, ''))
+    message, status = node.receive_gossip(new_transaction, relayed_to)
+    return jsonify(message), status
+
+
+def parse_relayed_to(value):
+    '''Returns the node ids of a relayed-to header.'''
+    try:
+        return {int(node_id) for node_id in value.split(',') if node_id}
+    except ValueError:
+        abort(400, description='Invalid ' + RELAYED_TO_HEADER + ' header.')
+
+
 @rest_api.route('/register_node', methods=['POST'])
 def register_node():
     '''Endpoint that registers a new node in the network.
@@ -118,30 +146,48 @@ def register_node():
             public_key: the public key of node to enter.
             ip: the ip of the node to enter.
             port: the port of the node to enter.
+            wire_version: the version of the binary wire format that the
+                          node supports (optional).
+
+        Returns:
+            id: the id that the new node is assigned.
+    '''
+
+    return jsonify({'id': register(request.form)})
+
+
+def register(form):
+    '''Registers a new node in the network given the form of the request.
 
         Returns:
             id: the id that the new node is assigned.
     '''
 
     # Get the arguments
-    node_key = request.form.get('public_key')
-    node_ip = request.form.get('ip')
-    node_port = request.form.get('port')
+    node_key = form.get('public_key')
+    node_ip = form.get('ip')
+    node_port = form.get('port')
+    node_wire_version = int(form.get('wire_version', 0))
     node_id = len(node.ring)
 
     # Add node in the list of registered nodes.
     node.register_node_to_ring(
-        id=node_id, ip=node_ip, port=node_port, public_key=node_key, balance=0)
+        id=node_id, ip=node_ip, port=node_port, public_key=node_key, balance=0,
+        wire_version=node_wire_version)
 
     # When all nodes are registered, the bootstrap node sends them:
-    # - the current chain
-    # - the ring
+    # - the ring (first, since the chain refers to the keys of the ring)
+    # - the current chain (if they haven't downloaded it)
     # - the first transaction
     if (node_id == n - 1):
         for ring_node in node.ring:
             if ring_node["id"] != node.id:
-                node.share_chain(ring_node)
-                node.share_ring(ring_node)
+                # The node downloads the chain when it gets the ring. Nodes
+                # that don't download it get it pushed.
+                response = node.share_ring(ring_node)
+                if (response.json().get('height', 0) <
+                        len(node.chain.blocks)):
+                    node.share_chain(ring_node)
         for ring_node in node.ring:
             if ring_node["id"] != node.id:
                 node.create_transaction(
@@ -150,7 +196,7 @@ def register_node():
                     amount=100
                 )
 
-    return jsonify({'id': node_id})
+    return node_id
 
 
 @rest_api.route('/get_ring', methods=['POST'])
@@ -158,16 +204,34 @@ def get_ring():
     '''Endpoint that gets a ring (information about other nodes).
 
         Input:
-            ring: the ring in pickle format.
+            ring: the ring in json or pickle format.
         Returns:
             message: the outcome of the procedure.
+            height: the length of the chain of the node.
     '''
-    node.ring = pickle.loads(request.get_data())
+    if request.is_json:
+        set_ring(request.get_json())
+    else:
+        set_ring(pickle.loads(request.get_data()))
+    return jsonify({'message': "OK", 'height': len(node.chain.blocks)})
+
+
+def set_ring(ring):
+    '''Sets the ring of the node and updates its id based on it.
+
+        A node that has just joined the network downloads the chain from
+        the bootstrap node.
+    '''
+    node.ring = ring
+    node.update_ring()
     # Update the id of the node based on the given ring.
     for ring_node in node.ring:
         if ring_node['public_key'] == node.wallet.public_key:
             node.id = ring_node['id']
-    return jsonify({'message': "OK"})
+    if not node.chain.blocks:
+        for ring_node in node.ring:
+            if ring_node['id'] == 0 and ring_node['id'] != node.id:
+                node.download_chain(ring_node)
 
 
 @rest_api.route('/get_chain', methods=['POST'])
@@ -175,12 +239,24 @@ def get_chain():
     '''Endpoint that gets a blockchain.
 
         Input:
-            chain: the blockchain in pickle format.
+            chain: the blockchain in wire or pickle format.
         Returns:
             message: the outcome of the procedure.
     '''
-    node.chain = pickle.loads(request.get_data())
-    return jsonify({'message': "OK"})
+    message, status = set_chain(read_payload())
+    return jsonify(message), status
+
+
+def set_chain(chain):
+    '''Validates a received blockchain and replaces the chain of the node.
+
+        Returns:
+            the message and the status code of the response.
+    '''
+    if not node.validate_chain(chain):
+        return {'message': "Invalid blockchain"}, 400
+    node.chain.replace(chain.blocks)
+    return {'message': "OK"}, 200
 
 
 @rest_api.route('/send_chain', methods=['GET'])
@@ -188,11 +264,90 @@ def send_chain():
     '''Endpoint that sends a blockchain.
 
         Returns:
-            the blockchain of the node in pickle format.
+            the blockchain of the node in wire format, if the requester
+            accepts it, or in pickle format.
     '''
+    if wire.CONTENT_TYPE in request.headers.get('Accept', ''):
+        return Response(wire.encode(node.chain, node.keys),
+                        content_type=wire.CONTENT_TYPE)
     return pickle.dumps(node.chain)
 
 
+@rest_api.route('/stream_chain', methods=['GET'])
+def stream_chain():
+    '''Endpoint that sends a range of the blockchain as a stream of
+        blocks, one length-prefixed frame per block.
+
+        Input:
+            start: the height of the first block (default 0).
+            end: the height after the last block (default the length of the
+                 chain).
+        Returns:
+            the blocks in wire format, if the requester accepts it, or in
+            pickle format. The X-Chain-Height header contains the length of
+            the chain.
+    '''
+    start, end, binary = stream_options(request.args, request.headers)
+    height = len(node.chain.blocks)
+    return Response(node.stream_chain(start, end, binary),
+                    content_type=(wire.STREAM_CONTENT_TYPE if binary
+                                  else wire.PICKLE_STREAM_CONTENT_TYPE),
+                    headers={'X-Chain-Height': str(height)})
+
+
+def stream_options(args, headers):
+    '''Returns the start, the end and the format of a chain stream given
+        the arguments and the headers of the request.'''
+    try:
+        start = int(args.get('start', 0))
+        end = int(args['end']) if 'end' in args else None
+    except ValueError:
+        abort(400, description='Invalid range.')
+    return start, end, wire.STREAM_CONTENT_TYPE in headers.get('Accept', '')
+
+
+@rest_api.route('/get_headers', methods=['POST'])
+def get_headers():
+    '''Endpoint that sends the headers of the blocks that another node
+        misses, given its block locator.
+
+        Input:
+            locator: the hashes of the block locator of the requester (JSON).
+        Returns:
+            fork: the height of the last block of the locator in the chain.
+            height: the length of the chain.
+            headers: the headers after the fork point.
+    '''
+    locator = request.get_json(silent=True) or {}
+    return jsonify(node.find_headers(locator.get('locator', [])))
+
+
+@rest_api.route('/get_blocks', methods=['POST'])
+def get_blocks():
+    '''Endpoint that sends blocks of the chain given their hashes.
+
+        Input:
+            hashes: the hashes of the requested blocks (JSON).
+        Returns:
+            a blockchain with the requested blocks in wire format, if the
+            requester accepts it, or in pickle format.
+    '''
+    hashes = (request.get_json(silent=True) or {}).get('hashes', [])
+    chain = blocks_to_chain(node.find_blocks(hashes))
+    if wire.CONTENT_TYPE in request.headers.get('Accept', ''):
+        return Response(wire.encode(chain, node.keys),
+                        content_type=wire.CONTENT_TYPE)
+    return pickle.dumps(chain)
+
+
+def blocks_to_chain(blocks):
+    '''Returns an in-memory blockchain with the given blocks, in order to
+        send them.'''
+    chain = Blockchain()
+    chain.replace(blocks)
+    return chain
+
+
 ##############################################################
 ################## CLIENT/API COMMUNICATION ##################
 ##############################################################
@@ -207,24 +362,37 @@ def create_transaction():
             amount: the amount of NBCs to send.
         Returns:
             message: the outcome of the procedure.
+            transaction_id: the id of the new transaction in hex format.
+    '''
+
+    message, status = send_transaction(request.form)
+    return jsonify(message), status
+
+
+def send_transaction(form):
+    '''Creates a new transaction given the form of the request.
+
+        Returns:
+            the message and the status code of the response.
     '''
 
     # Get the arguments.
-    receiver_id = int(request.form.get('receiver'))
-    amount = int(request.form.get('amount'))
+    receiver_id = int(form.get('receiver'))
+    amount = int(form.get('amount'))
 
     # Find the address of the receiver.
-    receiver_public_key = None
-    for ring_node in node.ring:
-        if (ring_node['id'] == receiver_id):
-            receiver_public_key = ring_node['public_key']
+    receiver = node.ledger.get_by_id(receiver_id)
+    receiver_public_key = receiver.public_key if receiver else None
     if (receiver_public_key and receiver_id != node.id):
-        if node.create_transaction(receiver_public_key, receiver_id, amount):
-            return jsonify({'message': 'The transaction was successful.', 'balance': node.wallet.get_balance()}), 200
+        transaction = node.create_transaction(
+            receiver_public_key, receiver_id, amount)
+        if transaction:
+            return {'message': 'The transaction was successful.', 'balance': node.get_balance(),
+                    'transaction_id': transaction.transaction_id.encode('ISO-8859-1').hex()}, 200
         else:
-            return jsonify({'message': 'Not enough NBCs.', 'balance': node.wallet.get_balance()}), 400
+            return {'message': 'Not enough NBCs.', 'balance': node.get_balance()}, 400
     else:
-        return jsonify({'message': 'Transaction failed. Wrong receiver id.'}), 400
+        return {'message': 'Transaction failed. Wrong receiver id.'}, 400
 
 
 @rest_api.route('/api/get_balance', methods=['GET'])
@@ -234,7 +402,19 @@ def get_balance():
         Returns:
             message: the current balance.
     '''
-    return jsonify({'message': 'Current balance: ', 'balance': node.wallet.get_balance()})
+    return jsonify({'message': 'Current balance: ', 'balance': node.get_balance()})
+
+
+@rest_api.route('/api/get_balances', methods=['GET'])
+def get_balances():
+    '''Endpoint that returns the balances of all the nodes of the ring.
+
+        Returns:
+            balances: the id, the key fingerprint, the confirmed balance, the
+                      net amount of the pending transactions and the total
+                      balance of each node.
+    '''
+    return jsonify({'balances': node.ledger.get_ring_balances()})
 
 
 @rest_api.route('/api/get_transactions', methods=['GET'])
@@ -254,7 +434,55 @@ def get_my_transactions():
         Returns:
             a formatted list of transactions in pickle format.
     '''
-    return pickle.dumps([tr.to_list() for tr in node.wallet.transactions])
+    return pickle.dumps([tr.to_list() for tr in node.get_wallet_transactions()])
+
+
+@rest_api.route('/api/get_merkle_proof', methods=['GET'])
+def get_merkle_proof():
+    '''Endpoint that returns the proof that a transaction is included in
+        a block of the blockchain, so that a light client can verify it
+        without downloading the block.
+
+        Input:
+            transaction_id: the id of the transaction in hex format.
+        Returns:
+            header: the header of the block that contains the transaction.
+            proof: list of (hash, side) pairs from the transaction up to
+                   the Merkle root of the block.
+    '''
+
+    message, status = find_merkle_proof(request.args.get('transaction_id', ''))
+    return jsonify(message), status
+
+
+def find_merkle_proof(transaction_id):
+    '''Finds the block that contains a transaction (given in hex format)
+        and the Merkle inclusion proof of the transaction.
+
+        Returns:
+            the message and the status code of the response.
+    '''
+
+    try:
+        transaction_id = bytes.fromhex(transaction_id).decode('ISO-8859-1')
+    except ValueError:
+        return {'message': 'Invalid transaction id.'}, 400
+
+    for block in reversed(node.chain.blocks):
+        proof = block.get_merkle_proof(transaction_id)
+        if proof is not None:
+            header = {
+                'index': block.index,
+                'timestamp': block.timestamp,
+                'merkle_root': block.get_merkle_root(),
+                'target': block.target,
+                'nonce': block.nonce,
+                'previous_hash': block.previous_hash,
+                'current_hash': block.current_hash
+            }
+            return {'header': header, 'proof': proof}, 200
+
+    return {'message': 'Transaction not found.'}, 404
 
 
 @rest_api.route('/api/get_id', methods=['GET'])
@@ -274,23 +502,161 @@ def get_metrics():
         Returns:
             num_blocks: total number of blocks.
             capacity: the capacity of each block.
-            difficulty: the mining difficulty
+            difficulty: the difficulty of the next block (leading zeros of
+                        its target).
+            block_interval: the seconds between blocks that the retargeting
+                            aims at.
+            mined_blocks: number of blocks mined by the node.
+            mining_time: seconds spent in mining.
+            broadcast_time: seconds spent in broadcasting mined blocks.
+    '''
+
+    return jsonify(get_metrics_info())
+
+
+def get_metrics_info():
+    '''Returns the parameters of the network that get_metrics reports.'''
+    return {'num_blocks': len(node.chain.blocks), 'difficulty': round(node.get_difficulty(), 2),
+            'block_interval': BLOCK_INTERVAL, 'capacity': node.capacity,
+            'mined_blocks': node.mined_blocks, 'mining_time': node.mining_time,
+            'broadcast_time': node.broadcast_time}
+
+
+@rest_api.route('/metrics', methods=['GET'])
+def get_prometheus_metrics():
+    '''Endpoint that returns the metrics of the node (e.g. mining, peer
+        latencies, lock waits and mempool size).
+
+        Returns:
+            the metrics in the text exposition format of Prometheus.
     '''
+    return Response(metrics.REGISTRY.expose(), content_type=metrics.CONTENT_TYPE)
+
+
+##############################################################
+########################### ADMIN ############################
+##############################################################
+
 
-    return jsonify({'num_blocks': len(node.chain.blocks), 'difficulty': MINING_DIFFICULTY, 'capacity': node.capacity})
+@rest_api.before_request
+def restrict_admin():
+    '''Allows the admin endpoints (profiler and tracer) only from the host
+        of the node, since the api of the node is public.'''
+    if request.path.startswith('/admin/') and request.remote_addr not in ADMIN_ADDRESSES:
+        abort(403, description='The admin endpoints are only available from the host of the node.')
 
 
-@rest_api.route('/api/set_difficulty', methods=['POST'])
-def set_difficulty():
-    '''Endpoint that changes the mining difficulty.
+@rest_api.route('/admin/profiler/start', methods=['POST'])
+def start_profiler():
+    '''Endpoint that starts the sampling profiler of the node (the
+        previous samples are cleared).
+
         Input:
-            value: the new mining difficulty.
+            interval: seconds between two samples (default 0.005, at least
+                      0.001).
         Returns:
             message: the outcome of the procedure.
     '''
 
-    # Get the arguments.
-    value = int(request.form.get('value'))
-    node.MINING_DIFFICULTY = value
+    message, status = start_profiler_with(request.form)
+    return jsonify(message), status
+
+
+def start_profiler_with(form):
+    '''Starts the profiler given the form of the request.
+
+        Returns:
+            the message and the status code of the response.
+    '''
+
+    try:
+        interval = float(form.get('interval', profiler.SAMPLE_INTERVAL))
+    except ValueError:
+        interval = 0
+    if not interval >= profiler.MIN_SAMPLE_INTERVAL:
+        return {'message': 'Invalid interval.'}, 400
+    if not profiler.PROFILER.start(interval):
+        return {'message': 'The profiler is already running.'}, 409
+    return {'message': 'Profiler started.'}, 200
+
+
+@rest_api.route('/admin/profiler/stop', methods=['POST'])
+def stop_profiler():
+    '''Endpoint that stops the sampling profiler of the node.
+
+        Returns:
+            message: the outcome of the procedure.
+            samples: the number of samples taken.
+    '''
+
+    message, status = stop_profiler_info()
+    return jsonify(message), status
+
+
+def stop_profiler_info():
+    '''Stops the profiler and returns the message and the status code of
+        the response.'''
+    if not profiler.PROFILER.stop():
+        return {'message': 'The profiler is not running.'}, 409
+    return {'message': 'Profiler stopped.', 'samples': profiler.PROFILER.samples}, 200
+
+
+@rest_api.route('/admin/profiler', methods=['GET'])
+def get_profile():
+    '''Endpoint that downloads the samples of the profiler.
+
+        Returns:
+            the sampled stacks in folded format (one `frame;...;frame count`
+            line per stack), e.g. for flamegraph.pl or speedscope.
+    '''
+    return Response(profiler.PROFILER.export(), content_type='text/plain',
+                    headers=download_headers('profile-%s.folded' % node.id))
+
+
+@rest_api.route('/admin/trace/start', methods=['POST'])
+def start_trace():
+    '''Endpoint that starts recording the spans of add_transaction_to_block,
+        mine_block, validate_block and resolve_conflicts (the previous spans
+        are cleared).
+
+        Returns:
+            message: the outcome of the procedure.
+    '''
+    profiler.TRACER.start()
+    return jsonify({'message': 'Tracing started.'})
+
+
+@rest_api.route('/admin/trace/stop', methods=['POST'])
+def stop_trace():
+    '''Endpoint that stops recording spans.
+
+        Returns:
+            message: the outcome of the procedure.
+            spans: the number of recorded spans.
+    '''
+    profiler.TRACER.stop()
+    return jsonify({'message': 'Tracing stopped.', 'spans': len(profiler.TRACER.spans)})
+
+
+@rest_api.route('/admin/trace', methods=['GET'])
+def get_trace():
+    '''Endpoint that downloads the recorded spans.
+
+        Returns:
+            the spans in the trace event format (JSON), e.g. for Perfetto or
+            chrome://tracing. The process id of the events is the id of the
+            node.
+    '''
+    return Response(export_trace(), content_type='application/json',
+                    headers=download_headers('trace-%s.json' % node.id))
+
+
+def export_trace():
+    '''Returns the spans of the node in the trace event format (JSON).'''
+    return json.dumps(profiler.TRACER.export(
+        node.id if node.id is not None else 0, 'node %s' % node.id))
+
 
-    return jsonify({'message': 'Mining difficulty changed.'})
+def download_headers(filename):
+    '''Returns the headers of a response that is downloaded as a file.'''
+    return {'Content-Disposition': 'attachment; filename=' + filename}
@@ -0,0 +1,189 @@
+from threading import Lock
+
+from wire import fingerprint
+
+# Number of bytes of the SHA-256 hash of a public key in its short
+# fingerprint.
+FINGERPRINT_BYTES = 8
+
+
+class LedgerEntry:
+    """
+    The balances of a public key.
+
+    Attributes:
+        public_key (str): the public key (in PEM format).
+        fingerprint (str): the short fingerprint of the public key.
+        id (int): the id of the node in the ring (None if the key is not in
+                  the ring).
+        confirmed (int): the balance of the key in the blockchain.
+        pending (int): the net amount of the transactions of the key that
+                       are not in the blockchain yet.
+    """
+
+    __slots__ = ('public_key', 'fingerprint', 'id', 'confirmed', 'pending')
+
+    def __init__(self, public_key):
+        """Inits a LedgerEntry with zero balances."""
+        self.public_key = public_key
+        self.fingerprint = fingerprint(public_key)[:FINGERPRINT_BYTES].hex()
+        self.id = None
+        self.confirmed = 0
+        self.pending = 0
+
+    def get_balance(self):
+        """Returns the balance including the pending transactions."""
+        return self.confirmed + self.pending
+
+    def to_dict(self):
+        """Returns the balances of the entry in a dict."""
+        return {
+            'id': self.id,
+            'fingerprint': self.fingerprint,
+            'confirmed': self.confirmed,
+            'pending': self.pending,
+            'balance': self.get_balance()
+        }
+
+
+class Ledger:
+    """
+    The balances of the nodes, indexed by public key, by node id and by key
+    fingerprint.
+
+    The confirmed balances follow the blocks of the blockchain, which
+    updates the ledger as blocks are added and as its branch changes. The
+    pending balances follow the transactions that the node has accepted
+    but that are not in the blockchain yet. Each update is applied under
+    the lock, so readers never see a half-applied block or reorganization.
+
+    Attributes:
+        entries (dict): the LedgerEntry of each public key.
+        ids (dict): the LedgerEntry of each node id of the ring.
+        fingerprints (dict): the LedgerEntry of each key fingerprint.
+        pending (dict): the pending transactions given their id.
+        confirmed (set): the ids of the transactions in the blockchain.
+        lock (Lock): a lock in order to provide mutual exclusion between
+                     the updates of the ledger.
+    """
+
+    def __init__(self):
+        """Inits an empty Ledger."""
+        self.entries = {}
+        self.ids = {}
+        self.fingerprints = {}
+        self.pending = {}
+        self.confirmed = set()
+        self.lock = Lock()
+
+    def entry(self, public_key):
+        """Returns the entry of a public key, creating it if needed (the
+        caller holds the lock)."""
+        entry = self.entries.get(public_key)
+        if entry is None:
+            entry = LedgerEntry(public_key)
+            self.entries[public_key] = entry
+            self.fingerprints[entry.fingerprint] = entry
+        return entry
+
+    def set_ring(self, ring):
+        """Indexes the entries of the nodes of a ring by their id."""
+        with self.lock:
+            self.ids = {}
+            for entry in self.entries.values():
+                entry.id = None
+            for ring_node in ring:
+                entry = self.entry(ring_node['public_key'])
+                entry.id = ring_node['id']
+                self.ids[entry.id] = entry
+
+    def get(self, public_key):
+        """Returns the entry of a public key, or None."""
+        return self.entries.get(public_key)
+
+    def get_by_id(self, node_id):
+        """Returns the entry of the node with the given id, or None."""
+        return self.ids.get(node_id)
+
+    def get_by_fingerprint(self, key_fingerprint):
+        """Returns the entry of the given key fingerprint, or None."""
+        return self.fingerprints.get(key_fingerprint)
+
+    def get_ring_balances(self):
+        """Returns the balances of the nodes of the ring, ordered by id."""
+        with self.lock:
+            return [self.ids[node_id].to_dict() for node_id in sorted(self.ids)]
+
+    def move(self, transaction, field, sign):
+        """Moves the amount of a transaction from the sender to the receiver
+        (or back, if sign is -1) in the given balance (the caller holds the
+        lock)."""
+        amount = sign * transaction.amount
+        sender = self.entry(transaction.sender_address)
+        receiver = self.entry(transaction.receiver_address)
+        setattr(sender, field, getattr(sender, field) - amount)
+        setattr(receiver, field, getattr(receiver, field) + amount)
+
+    def add_pending(self, transaction):
+        """Adds a transaction that the node accepted.
+
+        Returns:
+            False if the transaction is already pending or confirmed.
+        """
+
+        with self.lock:
+            return self.add_pending_unlocked(transaction)
+
+    def add_pending_unlocked(self, transaction):
+        """Adds a pending transaction (the caller holds the lock)."""
+        transaction_id = transaction.transaction_id
+        if transaction_id in self.pending or transaction_id in self.confirmed:
+            return False
+        self.pending[transaction_id] = transaction
+        self.move(transaction, 'pending', 1)
+        return True
+
+    def remove_pending(self, transaction):
+        """Removes a pending transaction that will not be confirmed (e.g.
+        because a block spent its inputs).
+
+        Returns:
+            False if the transaction is not pending.
+        """
+
+        with self.lock:
+            return self.remove_pending_unlocked(transaction)
+
+    def remove_pending_unlocked(self, transaction):
+        """Removes a pending transaction (the caller holds the lock)."""
+        if self.pending.pop(transaction.transaction_id, None) is None:
+            return False
+        self.move(transaction, 'pending', -1)
+        return True
+
+    def update(self, removed, added):
+        """Removes blocks from the tip of the blockchain and adds new ones.
+
+        The transactions of the removed blocks become pending again, unless
+        they are in the added blocks.
+
+        Args:
+            removed: the removed blocks (in the order of the chain).
+            added: the added blocks (in the order of the chain).
+        """
+
+        with self.lock:
+            self.update_unlocked(removed, added)
+
+    def update_unlocked(self, removed, added):
+        """Removes and adds blocks (the caller holds the lock)."""
+        for block in reversed(removed):
+            for transaction in reversed(block.transactions):
+                self.move(transaction, 'confirmed', -1)
+                self.confirmed.discard(transaction.transaction_id)
+                self.add_pending_unlocked(transaction)
+        for block in added:
+            for transaction in block.transactions:
+                self.move(transaction, 'confirmed', 1)
+                self.confirmed.add(transaction.transaction_id)
+                self.remove_pending_unlocked(transaction)
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+from metrics import Histogram, TimedLock
+
+# The time that the transactions of a confirmed block take to be removed.
+REMOVE_BLOCK_TIME = Histogram(
+    'noobcash_mempool_remove_block_seconds',
+    'Seconds spent removing the transactions of a confirmed block from the mempool.')
+
+
+class Mempool:
+    """
+    The pending transactions of a node, that are not in the blockchain yet.
+
+    The transactions are indexed by their id and kept in the order that they
+    arrived, so confirmed transactions are removed in O(1) each and the
+    blocks are filled with the oldest transactions first. Blocks are built
+    from the mempool only when they are mined.
+
+    Attributes:
+        transactions (OrderedDict): the pending transactions given their id.
+        lock (TimedLock): a lock in order to provide mutual exclusion
+                          between changes of the mempool.
+    """
+
+    def __init__(self):
+        """Inits an empty Mempool."""
+        self.transactions = OrderedDict()
+        self.lock = TimedLock('mempool')
+
+    def __len__(self):
+        """Returns the number of the pending transactions."""
+        return len(self.transactions)
+
+    def __contains__(self, transaction_id):
+        """Returns True if the transaction with the given id is pending."""
+        return transaction_id in self.transactions
+
+    def add(self, transaction):
+        """Adds a transaction at the end of the mempool.
+
+        Returns:
+            False if the transaction is already pending.
+        """
+
+        with self.lock:
+            if transaction.transaction_id in self.transactions:
+                return False
+            self.transactions[transaction.transaction_id] = transaction
+            return True
+
+    def pop_block(self, capacity):
+        """Removes the oldest transactions that fill a block.
+
+        Returns:
+            a list of capacity transactions, or None if there are not enough
+            pending transactions.
+        """
+
+        with self.lock:
+            if len(self.transactions) < capacity:
+                return None
+            return [self.transactions.popitem(last=False)[1]
+                    for _ in range(capacity)]
+
+    def restore(self, transactions):
+        """Puts transactions back at the front of the mempool (e.g. when
+        mining them was aborted), keeping their order."""
+
+        with self.lock:
+            for transaction in reversed(transactions):
+                self.transactions[transaction.transaction_id] = transaction
+                self.transactions.move_to_end(
+                    transaction.transaction_id, last=False)
+
+    def remove_block(self, block):
+        """Removes the transactions of a confirmed block."""
+        with REMOVE_BLOCK_TIME.time():
+            self.remove(block.transactions)
+
+    def remove(self, transactions):
+        """Removes the given transactions, if they are pending."""
+        with self.lock:
+            for transaction in transactions:
+                self.transactions.pop(transaction.transaction_id, None)
+
+    def get_transactions(self):
+        """Returns a list of the pending transactions."""
+        with self.lock:
+            return list(self.transactions.values())
@@ -0,0 +1,80 @@
+import hashlib
+
+# Prefixes of the hashed data, so that a leaf can't be passed off as an
+# inner node of the tree and vice versa.
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def hash_leaf(transaction_id):
+    """Computes the hash of a leaf of the Merkle tree."""
+    return hashlib.sha256(
+        LEAF_PREFIX + transaction_id.encode('ISO-8859-1')).hexdigest()
+
+
+def hash_node(left, right):
+    """Computes the hash of an inner node given the hashes of its children."""
+    return hashlib.sha256(
+        NODE_PREFIX + (left + right).encode('ascii')).hexdigest()
+
+
+def compute_levels(transaction_ids):
+    """Computes all the levels of the Merkle tree of the given transactions.
+
+    The first level contains the hashes of the leaves and the last one the
+    root. If a level has an odd number of nodes, the last node is paired
+    with itself.
+    """
+
+    level = [hash_leaf(tr_id) for tr_id in transaction_ids]
+    if not level:
+        return [[hashlib.sha256(b'').hexdigest()]]
+
+    levels = [level]
+    while len(level) > 1:
+        if len(level) % 2:
+            level = level + [level[-1]]
+        level = [
+            hash_node(level[i], level[i + 1])
+            for i in range(0, len(level), 2)
+        ]
+        levels.append(level)
+    return levels
+
+
+def compute_root(transaction_ids):
+    """Computes the Merkle root of the given transactions."""
+    return compute_levels(transaction_ids)[-1][0]
+
+
+def compute_proof(transaction_ids, position):
+    """Computes the inclusion proof of the transaction at the given position.
+
+    Returns:
+        a list of (hash, side) pairs from the leaf up to the root, where side
+        is 'left' or 'right' depending on the side of the sibling.
+    """
+
+    proof = []
+    for level in compute_levels(transaction_ids)[:-1]:
+        if position % 2:
+            proof.append((level[position - 1], 'left'))
+        elif position + 1 < len(level):
+            proof.append((level[position + 1], 'right'))
+        else:
+            proof.append((level[position], 'right'))
+        position //= 2
+    return proof
+
+
+def verify_proof(transaction_id, proof, root):
+    """Verifies that a transaction is included in the tree with the given
+    root."""
+
+    computed_hash = hash_leaf(transaction_id)
+    for sibling, side in proof:
+        if side == 'left':
+            computed_hash = hash_node(sibling, computed_hash)
+        else:
+            computed_hash = hash_node(computed_hash, sibling)
+    return computed_hash == root
@@ -0,0 +1,336 @@
+import bisect
+import time
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from threading import Lock
+
+# Content type of the text exposition format (the Prometheus format).
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Default upper bounds (in seconds) of the buckets of a histogram.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_value(value):
+    """Returns a sample value in the text exposition format."""
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(names, values):
+    """Returns the labels of a sample in the text exposition format."""
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n')
+        pairs.append('%s="%s"' % (name, value))
+    return '{' + ','.join(pairs) + '}'
+
+
+class Registry:
+    """
+    The metrics that a node exports.
+
+    Attributes:
+        metrics (dict): the registered metrics given their name.
+        lock (Lock): a lock in order to provide mutual exclusion when
+                     metrics are registered.
+    """
+
+    def __init__(self):
+        """Inits an empty Registry."""
+        self.metrics = {}
+        self.lock = Lock()
+
+    def register(self, metric):
+        """Registers a metric. Its name must be unique."""
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError('Duplicate metric: ' + metric.name)
+            self.metrics[metric.name] = metric
+
+    def expose(self):
+        """Returns all the metrics in the text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+# The registry of the metrics of the node.
+REGISTRY = Registry()
+
+
+class Metric(ABC):
+    """
+    A metric with a value for each combination of its labels.
+
+    Attributes:
+        name (str): the name of the metric.
+        documentation (str): the description of the metric.
+        labelnames (tuple): the names of the labels.
+        children (dict): the value of each combination of label values.
+        lock (Lock): a lock in order to provide mutual exclusion in the
+                     updates of the values.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        """Inits a Metric and registers it."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """Returns the metric of the given label values."""
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('Wrong number of labels of ' + self.name)
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    @abstractmethod
+    def new_child(self):
+        """Returns the value of a new combination of label values."""
+
+    def samples(self):
+        """Returns the lines of the samples of the metric."""
+        with self.lock:
+            children = sorted(self.children.items())
+        lines = []
+        for values, child in children:
+            lines.extend(child.samples(self.name, self.labelnames, values))
+        return lines
+
+
+class CounterValue:
+    """The value of a counter for a combination of label values."""
+
+    def __init__(self):
+        """Inits a CounterValue."""
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount=1):
+        """Increases the counter."""
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, values):
+        """Returns the sample of the value."""
+        return [name + format_labels(labelnames, values) + ' ' +
+                format_value(self.value)]
+
+
+class Counter(Metric):
+    """A value that only increases, e.g. the number of mined blocks."""
+
+    type = 'counter'
+
+    def new_child(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        """Increases the counter (of a metric without labels)."""
+        self.labels().inc(amount)
+
+
+class GaugeValue:
+    """The value of a gauge for a combination of label values."""
+
+    def __init__(self):
+        """Inits a GaugeValue."""
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        """Sets the gauge."""
+        self.value = value
+
+    def set_function(self, function):
+        """Computes the value of the gauge with a function when the metrics
+        are exposed, instead of keeping it up to date."""
+        self.function = function
+
+    def samples(self, name, labelnames, values):
+        """Returns the sample of the value."""
+        value = self.function() if self.function else self.value
+        return [name + format_labels(labelnames, values) + ' ' +
+                format_value(value)]
+
+
+class Gauge(Metric):
+    """A value that may increase or decrease, e.g. the size of the
+    mempool."""
+
+    type = 'gauge'
+
+    def new_child(self):
+        return GaugeValue()
+
+    def set(self, value):
+        """Sets the gauge (of a metric without labels)."""
+        self.labels().set(value)
+
+    def set_function(self, function):
+        """Computes the gauge (of a metric without labels) with a function
+        when the metrics are exposed."""
+        self.labels().set_function(function)
+
+
+class HistogramValue:
+    """The observations of a histogram for a combination of label values."""
+
+    def __init__(self, buckets):
+        """Inits a HistogramValue."""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.lock = Lock()
+
+    def observe(self, value):
+        """Adds an observation."""
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observes the seconds that the block of the with statement takes."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time)
+
+    def samples(self, name, labelnames, values):
+        """Returns the cumulative buckets, the sum and the count."""
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + [float('inf')], counts):
+            cumulative += count
+            lines.append(name + '_bucket' +
+                         format_labels(labelnames + ('le',),
+                                       values + (format_value(bound),)) +
+                         ' ' + str(cumulative))
+        labels = format_labels(labelnames, values)
+        lines.append(name + '_sum' + labels + ' ' + format_value(total))
+        lines.append(name + '_count' + labels + ' ' + str(cumulative))
+        return lines
+
+
+class Histogram(Metric):
+    """
+    The distribution of observations, e.g. the durations of a request, in
+    buckets.
+
+    Attributes:
+        buckets (tuple): the upper bounds of the buckets (in increasing
+                         order, without +Inf).
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        """Inits a Histogram and registers it."""
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        """Adds an observation (of a metric without labels)."""
+        self.labels().observe(value)
+
+    def time(self):
+        """Observes the duration of a with statement (of a metric without
+        labels)."""
+        return self.labels().time()
+
+
+# The wait of the threads for the locks of the node.
+LOCK_WAIT = Histogram(
+    'noobcash_lock_wait_seconds',
+    'Seconds that a thread waited for a lock that was held by another thread.',
+    ['lock'])
+LOCK_ACQUISITIONS = Counter(
+    'noobcash_lock_acquisitions_total',
+    'Number of acquisitions of a lock.',
+    ['lock'])
+LOCK_CONTENTIONS = Counter(
+    'noobcash_lock_contentions_total',
+    'Number of acquisitions of a lock that had to wait.',
+    ['lock'])
+
+
+class TimedLock:
+    """
+    A lock that measures how long the threads wait for it.
+
+    An acquisition that doesn't wait only increases a counter, so the lock
+    is almost as cheap as a plain Lock when it is not contended.
+
+    Attributes:
+        lock (Lock): the underlying lock.
+        wait (HistogramValue): the wait times of the lock.
+        acquisitions (CounterValue): the acquisitions of the lock.
+        contentions (CounterValue): the acquisitions that waited.
+    """
+
+    def __init__(self, name):
+        """Inits a TimedLock with the given name in the metrics."""
+        self.lock = Lock()
+        self.wait = LOCK_WAIT.labels(name)
+        self.acquisitions = LOCK_ACQUISITIONS.labels(name)
+        self.contentions = LOCK_CONTENTIONS.labels(name)
+
+    def acquire(self, blocking=True, timeout=-1):
+        """Acquires the lock (as Lock.acquire)."""
+        self.acquisitions.inc()
+        if self.lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        self.contentions.inc()
+        start_time = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        self.wait.observe(time.perf_counter() - start_time)
+        return acquired
+
+    def release(self):
+        """Releases the lock."""
+        self.lock.release()
+
+    def locked(self):
+        """Returns True if the lock is held."""
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
@@ -0,0 +1,261 @@
+import hashlib
+import multiprocessing
+import queue
+import traceback
+
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+
+from block import hash_nonce
+from metrics import TimedLock
+
+# Number of nonces that are tried before checking if mining should stop.
+CHECK_INTERVAL = 1000
+# Seconds that the parent process waits for a result before checking
+# if mining should stop.
+POLL_INTERVAL = 0.01
+
+# Shared objects of the worker processes (set by _init_worker).
+_stop_event = None
+_results = None
+
+
+def search(header, start, step, target, should_stop):
+    """Searches for a valid nonce of a block.
+
+    The header is the pair returned by Block.get_header_parts. The nonces
+    start, start + step, start + 2 * step, ... are tried until a hash lower
+    than the target is found or should_stop returns True.
+
+    Returns:
+        (nonce, hash) of the solution or None if the search was stopped.
+    """
+
+    head, tail = header
+    midstate = hashlib.sha256(head)
+    # The digests are compared as big-endian bytes of the same length, in
+    # the same order as the integers.
+    bound = (target - 1).to_bytes(32, 'big')
+    nonce = start
+    while not should_stop():
+        for _ in range(CHECK_INTERVAL):
+            digest = hash_nonce(midstate, tail, nonce)
+            if digest <= bound:
+                return nonce, digest.hex()
+            nonce += step
+    return None
+
+
+def _init_worker(stop_event, results):
+    """Stores the shared objects in each worker process."""
+    global _stop_event, _results
+    _stop_event = stop_event
+    _results = results
+
+
+def _search_worker(round_id, header, start, step, target):
+    """Runs a search in a worker process and reports the solution."""
+    solution = search(header, start, step, target, _stop_event.is_set)
+    if solution:
+        # Notify the other workers that the block is mined.
+        _stop_event.set()
+        _results.put((round_id, solution))
+
+
+class Miner:
+    """
+    The proof-of-work engine of a node.
+
+    The nonce space is split across a pool of worker processes. Worker i
+    tries the nonces i, i + workers, i + 2 * workers, ... until one of the
+    workers finds a valid hash or mining is stopped.
+
+    Attributes:
+        workers (int): number of worker processes (1 mines in the calling
+                       thread).
+        pool (Pool): the pool of the worker processes (created on first use).
+        stop_event (Event): set when the workers should stop searching.
+        results (Queue): the solutions found by the workers.
+        round_id (int): the id of the current mining round, in order to
+                        ignore late solutions of previous rounds.
+    """
+
+    def __init__(self, workers=1):
+        """Inits a Miner."""
+        self.workers = workers
+        self.pool = None
+        self.stop_event = None
+        self.results = None
+        self.round_id = 0
+
+    def start_pool(self):
+        """Creates the pool of the worker processes."""
+        self.stop_event = multiprocessing.Event()
+        self.results = multiprocessing.Queue()
+        self.pool = multiprocessing.Pool(
+            self.workers, initializer=_init_worker,
+            initargs=(self.stop_event, self.results))
+
+    def close(self):
+        """Terminates the worker processes."""
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
+
+    def mine(self, block, should_stop):
+        """Finds a nonce for the given block (whose target is set).
+
+        Returns:
+            (nonce, hash) of the solution or None if should_stop returned
+            True before a solution was found.
+        """
+
+        # Only the nonce changes during mining, so the rest of the block
+        # is serialized once.
+        header = block.get_header_parts()
+        if self.workers <= 1:
+            return search(header, 0, 1, block.target, should_stop)
+
+        if self.pool is None:
+            self.start_pool()
+
+        self.round_id += 1
+        self.stop_event.clear()
+        tasks = [
+            self.pool.apply_async(
+                _search_worker,
+                (self.round_id, header, i, self.workers, block.target))
+            for i in range(self.workers)
+        ]
+
+        solution = None
+        while solution is None and not should_stop():
+            try:
+                round_id, found = self.results.get(timeout=POLL_INTERVAL)
+                if round_id == self.round_id:
+                    solution = found
+            except queue.Empty:
+                if all(task.ready() for task in tasks):
+                    # All workers exited without a solution, so one of
+                    # them failed. Raise its exception.
+                    for task in tasks:
+                        task.get()
+
+        # Stop the workers and wait for them, so that the next block
+        # starts with idle workers.
+        self.stop_event.set()
+        for task in tasks:
+            task.wait()
+
+        return solution
+
+
+class MinerService:
+    """
+    A long-lived thread that mines the blocks of a node.
+
+    The service takes the next block to mine from a callback (e.g. built
+    from the mempool) whenever it is notified that there is new work, so the
+    threads that add transactions never wait for mining. Mining is
+    pre-empted while the chain of the node changes (see paused).
+
+    Attributes:
+        next_block (function): returns the next block to mine or None if
+                               there is no work.
+        mine (function): mines a block and returns True if it succeeded.
+        on_mined (function): called with each mined block.
+        on_aborted (function): called with each block whose mining was
+                               pre-empted.
+        lock (TimedLock): held while a block is mined and while mining is
+                          paused.
+        work (Event): set when there may be a new block to mine.
+        resume (Event): cleared while mining is paused.
+        pauses (int): number of threads that have paused mining.
+        pause_lock (Lock): a lock in order to provide mutual exclusion in
+                           the changes of pauses.
+        stopped (boolean): True when the service should exit.
+        thread (Thread): the mining thread (started on first notification).
+    """
+
+    def __init__(self, next_block, mine, on_mined, on_aborted):
+        """Inits a MinerService."""
+        self.next_block = next_block
+        self.mine = mine
+        self.on_mined = on_mined
+        self.on_aborted = on_aborted
+        self.lock = TimedLock('miner')
+        self.work = Event()
+        self.resume = Event()
+        self.resume.set()
+        self.pauses = 0
+        self.pause_lock = Lock()
+        self.stopped = False
+        self.thread = None
+
+    def notify(self):
+        """Wakes up the service because there may be a new block to mine."""
+        if self.thread is None:
+            with self.pause_lock:
+                if self.thread is None:
+                    self.thread = Thread(
+                        target=self.run, name='miner', daemon=True)
+                    self.thread.start()
+        self.work.set()
+
+    def stop(self):
+        """Stops the service after the current block."""
+        self.stopped = True
+        self.resume.set()
+        self.work.set()
+
+    def should_stop(self):
+        """Returns True if the current mining should be pre-empted."""
+        return self.pauses > 0 or self.stopped
+
+    @contextmanager
+    def paused(self):
+        """Pre-empts the current mining and doesn't start a new one until
+        the block of the with statement exits."""
+
+        with self.pause_lock:
+            self.pauses += 1
+            self.resume.clear()
+        try:
+            with self.lock:
+                yield
+        finally:
+            with self.pause_lock:
+                self.pauses -= 1
+                if self.pauses == 0:
+                    self.resume.set()
+            # The blocks of the chain may have changed the pending work.
+            self.work.set()
+
+    def run(self):
+        """Mines blocks until the service is stopped."""
+
+        while not self.stopped:
+            self.work.wait()
+            # Cleared before the work is taken, so that a notification
+            # during mining is not lost.
+            self.work.clear()
+            while not self.stopped:
+                self.resume.wait()
+                with self.lock:
+                    block = self.next_block()
+                    if block is None:
+                        break
+                    try:
+                        mined = self.mine(block)
+                    except Exception:
+                        # The block is retried on the next notification.
+                        traceback.print_exc()
+                        self.on_aborted(block)
+                        break
+                    if not mined:
+                        self.on_aborted(block)
+                if mined:
+                    try:
+                        self.on_mined(block)
+                    except Exception:
+                        traceback.print_exc()
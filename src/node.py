@@ -1,21 +1,87 @@
+import os
 import requests
-import json
 import pickle
-import itertools
-import time
 
-from copy import deepcopy
-from collections import deque
-from threading import Lock, Thread
+from collections import OrderedDict
+from threading import Lock
+from time import perf_counter, time
 
 from blockchain import Blockchain
-from block import Block
+from block_tree import BlockTree
+from block import Block, BlockHeader
+from difficulty import (MIN_TIME_STEP, find_invalid_target, get_target,
+                        meets_target, target_to_difficulty, validate_target)
+from mempool import Mempool
+from metrics import Counter, Gauge, Histogram, TimedLock
+from miner import Miner, MinerService
+from profiler import traced
+from state import ChainState
+from storage import BlockStore
+from transport import PeerTransport
 from wallet import Wallet
 from transaction import Transaction
 from transaction_input import TransactionInput
+from verifier import SignatureVerifier, validate_block_parts
+import wire
 
-# Set default MINING_DIFFICULTY
+# Default difficulty of the genesis block (the easiest of the network).
 MINING_DIFFICULTY = 4
+# Max number of transaction ids that a node remembers for gossip.
+SEEN_TRANSACTIONS = 100000
+# Header with the ids of the nodes that already have a gossiped transaction.
+RELAYED_TO_HEADER = 'X-Noobcash-Relayed-To'
+# Max number of headers that a node sends in a response.
+MAX_HEADERS = 2000
+# Max number of blocks that a node requests at once during a sync.
+MAX_BLOCKS = 100
+# Size in bytes of the chunks in which a stream of blocks is read.
+STREAM_CHUNK = 64 * 1024
+# Keystore of the node in its data directory (if no keystore is given).
+KEYSTORE_FILE = 'wallet.pem'
+
+# The metrics of the hot paths of the node.
+MINING_TIME = Histogram(
+    'noobcash_mining_seconds',
+    'Seconds spent mining a block, by outcome (mined or aborted).',
+    ['outcome'])
+HASHES = Counter(
+    'noobcash_hashes_total',
+    'Number of hashes computed for the mined blocks.')
+HASH_RATE = Gauge(
+    'noobcash_hash_rate',
+    'Hashes per second of the last mined block.')
+BROADCAST_TIME = Histogram(
+    'noobcash_broadcast_seconds',
+    'Seconds until all the peers responded to a broadcast, by message.',
+    ['message'])
+MEMPOOL_TRANSACTIONS = Gauge(
+    'noobcash_mempool_transactions',
+    'Number of pending transactions in the mempool.')
+PENDING_BLOCKS = Gauge(
+    'noobcash_pending_blocks',
+    'Number of full blocks that wait in the mempool to be mined.')
+CHAIN_HEIGHT = Gauge(
+    'noobcash_chain_height',
+    'Number of blocks in the blockchain of the node.')
+DIFFICULTY = Gauge(
+    'noobcash_difficulty',
+    'Difficulty (leading zeros of the target) of the next block.')
+
+
+def transaction_span(node, transaction):
+    """Returns the arguments of the span of an operation on a transaction."""
+    return {'transaction_id':
+            transaction.transaction_id.encode('ISO-8859-1').hex()}
+
+
+def block_span(node, block):
+    """Returns the arguments of the span of an operation on a block."""
+    return {
+        'index': block.index,
+        'hash': block.current_hash,
+        'transactions': [transaction_span(node, transaction)['transaction_id']
+                         for transaction in block.transactions]
+    }
 
 
 class Node:
@@ -28,49 +94,99 @@ class Node:
         chain (Blockchain): the blockchain that the node has.
         wallet (Wallet): the wallet of the node.
         ring (list): list of information about other nodes
-                     (id, ip, port, public_key, balance).
-        lock (Lock): a lock in order to provide mutual exclution in mining.
-        stop_mining (boolean): True when mining should stop
-                               (when a confirmed block arrives).
-        current_block (Block): the block that the node is fills with
-                               transactions.
-        unconfirmed_blocks (deque): A queue that contains all the blocks
-                                    waiting for mining.
+                     (id, ip, port, public_key, balance, wire_version),
+                     where balance is the balance of the node when it
+                     registered.
+        state (ChainState): the balances, the unspent outputs and the
+                            transactions that the node derives from its
+                            blockchain and its pending transactions.
+        ledger (Ledger): the confirmed and the pending balances of the
+                         nodes, indexed by public key, id and fingerprint
+                         (the ledger of the state).
+        keys (KeyRegistry): the public keys of the ring, which are sent as
+                            references in the binary wire format.
+        chain_lock (TimedLock): a lock in order to provide mutual exclution in
+                           the changes of the blockchain.
+        mempool (Mempool): the transactions that are waiting for mining.
         capacity (int): max number of transactions in each block.
+        miner (Miner): the proof-of-work engine of the node.
+        miner_service (MinerService): the thread that mines the blocks of
+                                      the mempool in the background (it is
+                                      paused when a confirmed block arrives).
+        verifier (SignatureVerifier): the service that verifies the
+                                      signatures of batches of transactions.
+        transport (PeerTransport): the transport layer of the requests to
+                                   the other nodes.
+        propagation (str): how the transactions are sent to the network,
+                           'broadcast' (validated by all nodes before they
+                           are delivered) or 'gossip' (validated by each
+                           node on receipt and forwarded).
+        seen_transactions (OrderedDict): the ids of the most recent gossiped
+                                         transactions.
+        seen_lock (Lock): a lock in order to provide mutual exclusion in the
+                          duplicate suppression of the gossip.
+        difficulty (int): the number of leading zeros of the target of the
+                          genesis block, if the node is the bootstrap (the
+                          targets of the next blocks are retargeted).
+        mined_blocks (int): the number of blocks mined by the node.
+        mining_time (float): the seconds spent in mining (including the
+                             pre-empted blocks).
+        broadcast_time (float): the seconds spent in broadcasting the mined
+                                blocks.
     """
 
     def __init__(self):
         """Inits a Node."""
         self.id = None
         self.nbc = 0
-        self.chain = Blockchain()
+        self.mempool = Mempool()
+        self.state = ChainState(self.mempool)
+        self.ledger = self.state.ledger
+        self.chain = Blockchain(tree=BlockTree(), state=self.state)
         self.wallet = Wallet()
         self.ring = []
-        self.filter_lock = Lock()
-        self.chain_lock = Lock()
-        self.block_lock = Lock()
-        self.stop_mining = False
-        self.current_block = None
-        self.unconfirmed_blocks = deque()
+        self.keys = wire.KeyRegistry()
+        self.chain_lock = TimedLock('chain')
         self.capacity = None
+        self.miner = Miner()
+        self.miner_service = MinerService(
+            self.next_block, self.mine_block, self.broadcast_block,
+            self.abort_block)
+        self.verifier = SignatureVerifier()
+        self.transport = PeerTransport()
+        self.propagation = 'broadcast'
+        self.seen_transactions = OrderedDict()
+        self.seen_lock = Lock()
+        self.difficulty = MINING_DIFFICULTY
+        self.mined_blocks = 0
+        self.mining_time = 0
+        self.broadcast_time = 0
+        MEMPOOL_TRANSACTIONS.set_function(lambda: len(self.mempool))
+        PENDING_BLOCKS.set_function(
+            lambda: len(self.mempool) // self.capacity if self.capacity else 0)
+        CHAIN_HEIGHT.set_function(lambda: len(self.chain.blocks))
+        DIFFICULTY.set_function(self.get_difficulty)
 
     def __str__(self):
         """Returns a string representation of a Node object."""
         return str(self.__class__) + ": " + str(self.__dict__)
 
-    def create_new_block(self):
-        """Creates a new block for the blockchain."""
+    def create_new_block(self, transactions=()):
+        """Creates a new block for the blockchain with the given
+        transactions."""
         if len(self.chain.blocks) == 0:
             # Here, the genesis block is created.
             new_idx = 0
             previous_hash = 1
-            self.current_block = Block(new_idx, previous_hash)
+            block = Block(new_idx, previous_hash)
         else:
             # They will be updated in mining.
-            self.current_block = Block(None, None)
-        return self.current_block
+            block = Block(None, None)
+        block.transactions = list(transactions)
+        return block
 
-    def register_node_to_ring(self, id, ip, port, public_key, balance):
+    def register_node_to_ring(self, id, ip, port, public_key, balance,
+                              wire_version=0):
         """Registers a new node in the ring.
 
         This method is called only in the bootstrap node.
@@ -82,41 +198,144 @@ class Node:
                 'ip': ip,
                 'port': port,
                 'public_key': public_key,
-                'balance': balance
+                'balance': balance,
+                'wire_version': wire_version
             })
+        self.update_ring()
+
+    def open_store(self, directory, has_keystore=False):
+        """Stores the blockchain of the node in the given directory.
+
+        Unless the wallet of the node comes from a keystore, its key is kept
+        in a keystore file in the directory, so that the node keeps its
+        identity after a restart. If the directory already contains a
+        blockchain and a ring that includes the node, the state of the node
+        is restored from them without validating the blocks again.
+
+        Returns:
+            True if the state of the node was restored.
+
+        Raises:
+            ValueError: if the directory belongs to another key than the
+                        keystore of the node.
+        """
+
+        store = BlockStore(directory)
+        if not has_keystore:
+            self.wallet = Wallet.from_keystore(
+                os.path.join(directory, KEYSTORE_FILE))
+
+        self.state = ChainState(self.mempool)
+        self.ledger = self.state.ledger
+        self.chain = Blockchain(store, BlockTree(), self.state)
+        ring = store.load_state('ring') or []
+        # A key that is still being generated is a new one, so it can't be
+        # in the stored ring.
+        owner = None
+        if ring and self.wallet.key_ready.is_set():
+            owner = next((ring_node for ring_node in ring
+                          if ring_node['public_key'] == self.wallet.public_key),
+                         None)
+        if owner is not None and self.chain.blocks:
+            self.ring = ring
+            self.keys = wire.KeyRegistry(ring)
+            self.ledger.set_ring(ring)
+            self.id = owner['id']
+            return True
+        # The stored ring always includes the node that saved it.
+        if ring and owner is None and has_keystore:
+            raise ValueError(
+                'The data directory belongs to another key than the '
+                'keystore.')
+
+        # The stored blockchain can't be used without the ring, so the node
+        # will get the blockchain again from the network. The stored blocks
+        # are dropped with the state that they built, instead of being
+        # undone, so that their transactions don't turn into pending ones.
+        store.truncate(0)
+        self.state = ChainState(self.mempool)
+        self.ledger = self.state.ledger
+        self.chain = Blockchain(store, BlockTree(), self.state)
+        return False
+
+    def update_ring(self):
+        """Updates the public keys of the ring and saves the ring next to the
+        stored blockchain (if any).
+
+        This method is called whenever the ring changes.
+        """
+
+        self.keys = wire.KeyRegistry(self.ring)
+        self.ledger.set_ring(self.ring)
+        if self.chain.store is not None:
+            self.chain.store.save_state('ring', self.ring)
+
+    def peers(self):
+        """Returns the other nodes of the ring."""
+        return [ring_node for ring_node in self.ring
+                if ring_node['id'] != self.id]
+
+    def encode(self, obj, binary):
+        """Encodes an object in the binary wire format or in pickle format.
+
+        Returns:
+            the payload and the headers of the request.
+        """
+
+        if binary:
+            return (wire.encode(obj, self.keys),
+                    {'Content-Type': wire.CONTENT_TYPE})
+        return pickle.dumps(obj), {}
+
+    def payloads(self, obj):
+        """Returns a function that gives the payload of an object for a peer.
+
+        Each peer gets the binary wire format if it supports it, otherwise
+        pickle. The object is encoded once per format.
+        """
+
+        cache = {}
+
+        def payload(peer):
+            binary = peer.get('wire_version', 0) >= wire.WIRE_VERSION
+            if binary not in cache:
+                cache[binary] = self.encode(obj, binary)
+            return cache[binary]
+
+        return payload
+
+    def decode(self, data, content_type):
+        """Decodes a payload given its content type.
+
+        Raises:
+            ValueError: if a payload in the binary wire format is not valid.
+        """
+
+        if content_type == wire.CONTENT_TYPE:
+            return wire.decode(data, self.keys)
+        return pickle.loads(data)
 
     def create_transaction(self, receiver, receiver_id, amount):
         """Creates a new transaction.
 
         This method creates a new transaction after computing the input that
         the transaction should take.
-        """
-        # Fill the input of the transaction with UTXOs, by iterating through
-        # the previous transactions of the node.
-        inputs = []
-        inputs_ids = []
-        nbc_sent = 0
-        for tr in self.wallet.transactions:
-            for output in tr.transaction_outputs:
-                if (output.recipient == self.wallet.public_key and
-                        output.unspent):
-                    inputs.append(TransactionInput(tr.transaction_id))
-                    inputs_ids.append(tr.transaction_id)
-                    output.unspent = False
-                    nbc_sent += output.amount
-            if nbc_sent >= amount:
-                # Exit the loop when UTXOs exceeds the amount of
-                # the transaction.
-                break
 
-        if nbc_sent < amount:
-            # If the node don't have enough coins, the possible inputs turn
-            # into unspent again
-            for tr in self.wallet.transactions:
-                for tr_output in tr.transaction_outputs:
-                    if tr_output.transaction_id in inputs_ids:
-                        tr_output.unspent = True
-            return False
+        Returns:
+            the transaction, or None if it failed.
+        """
+        # Fill the input of the transaction with the oldest UTXOs of the
+        # node that cover the amount. If the node doesn't have enough coins,
+        # nothing is spent.
+        selected = self.state.select(self.wallet.public_key, amount)
+        if selected is None:
+            return None
+
+        inputs = [
+            TransactionInput(transaction_id, index)
+            for (transaction_id, index), _ in selected
+        ]
+        nbc_sent = sum(output.amount for _, output in selected)
 
         transaction = Transaction(
             sender_address=self.wallet.public_key,
@@ -129,151 +348,250 @@ class Node:
         )
 
         # Sign the transaction
-        transaction.sign_transaction(self.wallet.private_key)
-
-        # Broadcast the transaction to the whole network.
-        if not self.broadcast_transaction(transaction):
-            for tr in self.wallet.transactions:
-                for tr_output in tr.transaction_outputs:
-                    if tr_output.transaction_id in inputs_ids:
-                        tr_output.unspent = True
-            return False
+        self.wallet.sign_transaction(transaction)
 
-        return True
+        # Gossip the transaction or broadcast it to the whole network.
+        if self.propagation == 'gossip':
+            self.gossip_transaction(transaction)
+        elif not self.broadcast_transaction(transaction):
+            # The inputs of the transaction turn into unspent again.
+            self.state.release(selected)
+            return None
+
+        return transaction
 
+    def get_balance(self):
+        """Returns the balance of the wallet of the node, including the
+        pending transactions."""
+        return self.state.get_balance(self.wallet.public_key)
+
+    def get_wallet_transactions(self):
+        """Returns the confirmed and the pending transactions of the wallet
+        of the node."""
+        return self.state.get_transactions(self.wallet.public_key)
+
+    @traced('add_transaction_to_block', transaction_span)
     def add_transaction_to_block(self, transaction):
         """Add transaction to the block.
 
-        This method adds a transaction in the block and checks if the current
-        block is ready to be mined. Also, the wallet transactions and the
-        balance of each node are updated.
-        """
-
-        # If the node is the recipient or the sender of the transaction,
-        # it adds the transaction in its wallet.
-        if (transaction.receiver_address == self.wallet.public_key):
-            self.wallet.transactions.append(transaction)
-        if (transaction.sender_address == self.wallet.public_key):
-            self.wallet.transactions.append(transaction)
-
-        # Update the balance of the recipient and the sender.
-        for ring_node in self.ring:
-            if ring_node['public_key'] == transaction.sender_address:
-                ring_node['balance'] -= transaction.amount
-            if ring_node['public_key'] == transaction.receiver_address:
-                ring_node['balance'] += transaction.amount
-
-        # If the chain contains only the genesis block, a new block
-        # is created. In other cases, the block is created after mining.
-        if self.current_block is None:
-            self.current_block = self.create_new_block()
-
-        self.block_lock.acquire()
-        if self.current_block.add_transaction(transaction, self.capacity):
-
-            # Mining procedure includes:
-            # - add the current block in the queue of unconfirmed blocks.
-            # - wait until the thread gets the lock.
-            # - check that the queue is not empty.
-            # - mine the first block of the queue.
-            # - if mining succeeds, broadcast the mined block.
-            # - if mining fails, put the block back in the queue and wait
-            #   for the lock.
+        This method adds a transaction in the mempool and notifies the miner
+        service, which mines a block when there are enough pending
+        transactions. Also, the pending transaction is applied to the state
+        of the node (unless it is already known).
+        """
 
-            # Update previous hash and index in case of insertions in the chain
-            self.unconfirmed_blocks.append(deepcopy(self.current_block))
-            self.current_block = self.create_new_block()
-            self.block_lock.release()
-            while True:
-                with self.filter_lock:
-                    if (self.unconfirmed_blocks):
-                        mined_block = self.unconfirmed_blocks.popleft()
-                        mining_result = self.mine_block(mined_block)
-                        if (mining_result):
-                            break
-                        else:
-                            self.unconfirmed_blocks.appendleft(mined_block)
-                    else:
-                        return
-            self.broadcast_block(mined_block)
-        else:
-            self.block_lock.release()
+        if (self.state.add_pending(transaction) and
+                self.mempool.add(transaction)):
+            self.miner_service.notify()
+
+    def next_block(self):
+        """Builds the next block to mine from the oldest transactions of the
+        mempool, or returns None if there are not enough of them.
+
+        This is called by the miner service.
+        """
+
+        transactions = self.mempool.pop_block(self.capacity)
+        if transactions is None:
+            return None
+        return self.create_new_block(transactions)
+
+    def abort_block(self, block):
+        """Puts the transactions of a block whose mining was pre-empted back
+        in the mempool.
+
+        This is called by the miner service.
+        """
+
+        self.mempool.restore(block.transactions)
 
     def broadcast_transaction(self, transaction):
         """Broadcasts a transaction to the whole network.
 
         This is called each time a new transaction is created. In order to
-        send the transaction simultaneously, each request is sent by a
-        different thread. If all nodes accept the transaction, the node adds
-        it in the current block.
-        """
-        def thread_func(node, responses, endpoint):
-            if node['id'] != self.id:
-                address = 'http://' + node['ip'] + ':' + node['port']
-                response = requests.post(address + endpoint,
-                                         data=pickle.dumps(transaction))
-                responses.append(response.status_code)
-
-        threads = []
-        responses = []
-        for node in self.ring:
-            thread = Thread(target=thread_func, args=(
-                node, responses, '/validate_transaction'))
-            threads.append(thread)
-            thread.start()
+        send the transaction simultaneously, the requests are sent by the
+        transport of the node. If all nodes accept the transaction, the node
+        adds it in the current block.
+        """
+        payload = self.payloads(transaction)
+        peers = self.peers()
+
+        start_time = perf_counter()
+        futures = self.transport.broadcast(
+            'POST', peers, '/validate_transaction', payload)
+        codes = self.transport.status_codes(futures)
+        BROADCAST_TIME.labels('transaction').observe(
+            perf_counter() - start_time)
+        if any(code != 200 for code in codes):
+            return False
+
+        # The peers validate the inputs of the next transaction of the node,
+        # which spends the change of this one, against their pending
+        # transactions, so the transaction is delivered before it is added.
+        self.transport.status_codes(self.transport.broadcast(
+            'POST', peers, '/get_transaction', payload))
+
+        self.add_transaction_to_block(transaction)
+        return True
+
+    def is_seen(self, transaction):
+        """Returns True if a gossiped transaction has already been seen."""
+        with self.seen_lock:
+            return transaction.transaction_id in self.seen_transactions
 
-        for tr in threads:
-            tr.join()
+    def mark_seen(self, transaction):
+        """Marks a gossiped transaction as seen.
 
-        for res in responses:
-            if res != 200:
+        Returns:
+            False if the transaction had already been seen.
+        """
+
+        with self.seen_lock:
+            if transaction.transaction_id in self.seen_transactions:
                 return False
-        threads = []
-        responses = []
-        for node in self.ring:
-            thread = Thread(target=thread_func, args=(
-                node, responses, '/get_transaction'))
-            threads.append(thread)
-            thread.start()
+            self.seen_transactions[transaction.transaction_id] = True
+            if len(self.seen_transactions) > SEEN_TRANSACTIONS:
+                self.seen_transactions.popitem(last=False)
+            return True
+
+    def gossip_transaction(self, transaction, relayed_to=()):
+        """Forwards a transaction to the peers that don't have it yet.
+
+        The request carries the ids of the nodes that already have the
+        transaction (the ones that it was relayed to so far and the new
+        targets), so each node receives it about once. The node doesn't wait
+        for the responses, so there is no barrier in the network. It adds
+        the transaction in the current block after forwarding it.
+        """
+
+        self.mark_seen(transaction)
+        targets = [peer for peer in self.peers()
+                   if peer['id'] not in relayed_to]
+        if targets:
+            relayed = sorted(set(relayed_to).union(
+                [self.id], [peer['id'] for peer in targets]))
+            header = ','.join(str(node_id) for node_id in relayed)
+            payload = self.payloads(transaction)
+
+            def gossip_payload(peer):
+                data, headers = payload(peer)
+                return data, dict(headers, **{RELAYED_TO_HEADER: header})
+
+            self.transport.broadcast(
+                'POST', targets, '/gossip_transaction', gossip_payload)
 
         self.add_transaction_to_block(transaction)
-        return True
+
+    def receive_gossip(self, transaction, relayed_to):
+        """Validates a gossiped transaction, forwards it and adds it in the
+        block.
+
+        Transactions that the node has already seen are ignored. A
+        transaction is marked as seen only after it is validated, so an
+        invalid copy with the id of a transaction doesn't suppress it.
+
+        Returns:
+            the message and the status code of the response.
+        """
+
+        if self.is_seen(transaction):
+            return {'message': "Already seen"}, 200
+        if not self.validate_transaction(transaction):
+            return {'message': "The signature is not authentic"}, 401
+        # A valid copy may have been received during the validation.
+        if not self.mark_seen(transaction):
+            return {'message': "Already seen"}, 200
+        self.gossip_transaction(transaction, relayed_to)
+        return {'message': "OK"}, 200
 
     def validate_transaction(self, transaction):
         """Validates an incoming transaction.
 
         The validation consists of:
         - verification of the signature.
-        - check that the transaction inputs are unspent transactions.
-        - create the 2 transaction outputs and add them in UTXOs list.
+        - check that the sender is a node of the ring.
+        - check that the transaction inputs are unspent outputs of the
+          sender (after the pending transactions) that sum to the coins
+          that it sends.
+        - check that the 2 transaction outputs pay the amount to the
+          receiver and the change to the sender.
         """
 
-        if not transaction.verify_signature():
-            return False
+        return self.validate_transactions([transaction])[0]
 
-        for node in self.ring:
-            if node['public_key'] == transaction.sender_address:
-                if node['balance'] >= transaction.amount:
-                    return True
-        return False
+    def validate_transactions(self, transactions):
+        """Validates a batch of incoming transactions.
+
+        The signatures of the whole batch are verified by the verifier of
+        the node, which may split them across multiple processes.
+
+        Returns:
+            a list with the result of each transaction.
+        """
 
+        results = self.verifier.verify_batch(transactions)
+        for i, transaction in enumerate(transactions):
+            if results[i]:
+                results[i] = self.validate_inputs(transaction)
+        return results
+
+    def validate_inputs(self, transaction):
+        """Checks that the sender of a transaction is a node of the ring and
+        that the transaction spends its unspent outputs."""
+
+        entry = self.ledger.get(transaction.sender_address)
+        return (entry is not None and entry.id is not None and
+                self.state.validate_pending(transaction))
+
+    def next_target(self):
+        """Returns the target of the next block of the chain."""
+        blocks = self.chain.blocks
+        return get_target(blocks.__getitem__, len(blocks))
+
+    def get_difficulty(self):
+        """Returns the difficulty of the next block of the chain."""
+        if not self.chain.blocks:
+            return self.difficulty
+        return target_to_difficulty(self.next_target())
+
+    def validate_targets(self, blocks, start=1):
+        """Checks the timestamps and the targets of the blocks of a chain
+        from the height start."""
+        return find_invalid_target(blocks, start) is None
+
+    @traced('mine_block', block_span)
     def mine_block(self, block):
         """Implements the proof-of-work.
 
-        This methods implements the proof of work algorithm.
+        This methods implements the proof of work algorithm. The search of
+        the nonce is done by the miner of the node, which may split it across
+        multiple processes. The timestamp of the block is the start of its
+        mining, so that the retargeting follows the time between the blocks.
         """
 
-        block.nonce = 0
         block.index = self.chain.blocks[-1].index + 1
         block.previous_hash = self.chain.blocks[-1].current_hash
-        computed_hash = block.get_hash()
-        while (not computed_hash.startswith('0' * MINING_DIFFICULTY) and
-                not self.stop_mining):
-            block.nonce += 1
-            computed_hash = block.get_hash()
-        block.current_hash = computed_hash
+        # The timestamps of the chain must increase, even if the clock of
+        # the node is behind the clock of the miner of the previous block.
+        block.timestamp = max(
+            time(), self.chain.blocks[-1].timestamp + 2 * MIN_TIME_STEP)
+        block.target = self.next_target()
+        start_time = perf_counter()
+        solution = self.miner.mine(block, self.miner_service.should_stop)
+        elapsed = perf_counter() - start_time
+        self.mining_time += elapsed
+        if solution is None or self.miner_service.should_stop():
+            MINING_TIME.labels('aborted').observe(elapsed)
+            return False
 
-        return not self.stop_mining
+        block.nonce, block.current_hash = solution
+        MINING_TIME.labels('mined').observe(elapsed)
+        # The workers try the nonces in order, so about nonce + 1 hashes
+        # were computed.
+        HASHES.inc(block.nonce + 1)
+        if elapsed > 0:
+            HASH_RATE.set((block.nonce + 1) / elapsed)
+        return True
 
     def broadcast_block(self, block):
         """
@@ -283,34 +601,61 @@ class Node:
         one node accepts the block, the node adds the block in the chain.
         """
 
+        self.mined_blocks += 1
         block_accepted = False
+        start_time = perf_counter()
+        futures = self.transport.broadcast(
+            'POST', self.peers(), '/get_block', self.payloads(block))
 
-        def thread_func(node, responses):
-            if node['id'] != self.id:
-                address = 'http://' + node['ip'] + ':' + node['port']
-                response = requests.post(address + '/get_block',
-                                         data=pickle.dumps(block))
-                responses.append(response.status_code)
-
-        threads = []
-        responses = []
-        for node in self.ring:
-            thread = Thread(target=thread_func, args=(
-                node, responses))
-            threads.append(thread)
-            thread.start()
-
-        for tr in threads:
-            tr.join()
-
-        for res in responses:
+        for res in self.transport.status_codes(futures):
             if res == 200:
                 block_accepted = True
+        elapsed = perf_counter() - start_time
+        self.broadcast_time += elapsed
+        BROADCAST_TIME.labels('block').observe(elapsed)
 
         if block_accepted:
             with self.chain_lock:
                 if self.validate_block(block):
-                    self.chain.blocks.append(block)
+                    self.chain.add_block(block)
+
+    def receive_block(self, new_block):
+        """Validates an incoming block and adds it in the blockchain.
+
+        Returns:
+            the message and the status code of the response.
+        """
+
+        self.chain_lock.acquire()
+        if self.validate_block(new_block):
+            # If the block is valid:
+            # - Add block to the current blockchain.
+            # - Remove the new_block's transactions from the mempool of the node.
+            # Update previous hash and index in case of insertions in the chain
+            with self.miner_service.paused():
+                self.chain.add_block(new_block)
+                self.chain_lock.release()
+                self.mempool.remove_block(new_block)
+        else:
+            # If the block is not valid, check if the signature is not authentic or
+            # there is a conflict.
+            if self.validate_previous_hash(new_block):
+                self.chain_lock.release()
+                return {'message': "The signature is not authentic. The block has been modified."}, 401
+            else:
+                # Resolve conflict (multiple blockchains/branch).
+                if self.resolve_conflicts(new_block):
+                    # Add block to the current blockchain
+                    with self.miner_service.paused():
+                        self.chain.add_block(new_block)
+                        self.chain_lock.release()
+                        # Remove the new_block's transactions from the mempool of the node.
+                        self.mempool.remove_block(new_block)
+                else:
+                    self.chain_lock.release()
+                    return {'mesage': "Block rejected."}, 409
+
+        return {'message': "OK"}, 200
 
     def validate_previous_hash(self, block):
         """Validates the previous hash of an incoming block.
@@ -321,102 +666,143 @@ class Node:
 
         return block.previous_hash == self.chain.blocks[-1].current_hash
 
+    def validate_next_target(self, block):
+        """Checks the timestamp and the target of a block that follows the
+        last block of the chain."""
+
+        blocks = self.chain.blocks
+        height = len(blocks)
+
+        def at(h):
+            return block if h == height else blocks[h]
+
+        return validate_target(at, height, time())
+
+    @traced('validate_block', block_span)
     def validate_block(self, block):
         """Validates an incoming block.
 
             The validation consists of:
             - check that current hash is valid.
+            - check that no transaction appears twice.
+            - check that the transactions spend unspent outputs of their
+              senders.
             - validate the previous hash.
+            - check that the timestamp is later than the previous block and
+              not too far in the future.
+            - check that the target is the one that the chain requires and
+              that the hash is lower than it.
+            - verify the signatures of the transactions (as a batch).
         """
         return (self.validate_previous_hash(block) and
-                (block.current_hash == block.get_hash()))
-
-    def filter_blocks(self, mined_block):
-        """Filters the queue of the unconfirmed blocks.
-
-        This method is called each time a new block is added in the blockchain.
-        The incoming block may contains transactions that are included in the
-        unconfirmed blocks too. These 'double' transactions are removed from
-        the queue.
-        """
-        with self.block_lock:
-            total_transactions = list(itertools.chain.from_iterable(
-                [
-                    unc_block.transactions
-                    for unc_block
-                    in self.unconfirmed_blocks
-                ]))
-
-            if (self.current_block):
-                total_transactions.extend(self.current_block.transactions)
-
-            self.current_block.transactions = []
-
-            filtered_transactions = [
-                transaction
-                for transaction
-                in total_transactions
-                if (
-                    transaction
-                    not in mined_block.transactions
-                )
-            ]
+                (block.current_hash == block.get_hash()) and
+                block.has_unique_transactions() and
+                self.validate_next_target(block) and
+                meets_target(block.current_hash, block.target) and
+                self.state.validate_blocks([], [block]) and
+                self.verifier.verify_all(block.transactions))
 
-            final_idx = 0
-            if not self.unconfirmed_blocks:
-                self.current_block.transactions = deepcopy(
-                    filtered_transactions)
-                return
+    def share_ring(self, ring_node):
+        """Shares the node's ring (neighbor nodes) to a specific node.
 
-            i = 0
-            while ((i + 1) * self.capacity <= len(filtered_transactions)):
-                self.unconfirmed_blocks[i].transactions = deepcopy(
-                    filtered_transactions[i * self.capacity:(
-                        i + 1) * self.capacity])
-                i += 1
+        This function is called for every newcoming node in the blockchain.
 
-            if i * self.capacity < len(filtered_transactions):
-                self.current_block.transactions = deepcopy(
-                    filtered_transactions[i * self.capacity:])
+        Returns:
+            the response of the node.
+        """
 
-            for i in range(len(self.unconfirmed_blocks) - i):
-                self.unconfirmed_blocks.pop()
+        if ring_node.get('wire_version', 0) >= wire.WIRE_VERSION:
+            return self.transport.post(ring_node, '/get_ring', json=self.ring)
+        return self.transport.post(ring_node, '/get_ring',
+                                   data=pickle.dumps(self.ring))
 
-        return
+    def stream_chain(self, start=0, end=None, binary=False):
+        """Yields the blocks of the chain from the height start up to end
+        (exclusive) as a stream of frames, one block per frame.
 
-    def share_ring(self, ring_node):
-        """Shares the node's ring (neighbor nodes) to a specific node.
-
-        This function is called for every newcoming node in the blockchain.
+        Each block is encoded only when it is sent, so the whole chain is
+        never serialized at once.
         """
 
-        address = 'http://' + ring_node['ip'] + ':' + ring_node['port']
-        requests.post(address + '/get_ring',
-                      data=pickle.dumps(self.ring))
+        blocks = self.chain.blocks
+        for block in blocks[start:end]:
+            if binary:
+                yield wire.frame(wire.encode(block, self.keys))
+            else:
+                yield wire.frame(pickle.dumps(block))
+
+    def download_chain(self, peer):
+        """Downloads the chain of a peer as a stream of blocks and replaces
+        the chain of the node with it.
 
-    def validate_chain(self, chain):
-        """Validates all the blocks of a chain.
+        Each block is validated as soon as it arrives. If the transfer is
+        interrupted, it is resumed from the last block that was received
+        (up to the retries of the transport without progress).
 
-        This function is called every time a node receives a chain after
-        a conflict.
+        Returns:
+            True if the whole chain was downloaded and is valid.
         """
-        blocks = chain.blocks
-        for i in range(len(blocks)):
-            if i == 0:
-                if (blocks[i].previous_hash != 1 or
-                        blocks[i].current_hash != blocks[i].get_hash()):
+
+        headers = {}
+        if peer.get('wire_version', 0) >= wire.WIRE_VERSION:
+            headers['Accept'] = wire.STREAM_CONTENT_TYPE
+        blocks = []
+        previous_hash = 1
+        height = None
+        failures = 0
+        while height is None or len(blocks) < height:
+            received = len(blocks)
+            try:
+                response = self.transport.open_stream(
+                    peer, '/stream_chain?start=' + str(len(blocks)),
+                    headers=headers)
+                with response:
+                    response.raise_for_status()
+                    height = int(response.headers['X-Chain-Height'])
+                    if response.headers.get('Content-Type') == wire.STREAM_CONTENT_TYPE:
+                        content_type = wire.CONTENT_TYPE
+                    else:
+                        content_type = None
+                    for data in wire.iter_frames(
+                            response.iter_content(STREAM_CHUNK)):
+                        block = self.decode(data, content_type)
+                        if (block.previous_hash != previous_hash or
+                                not validate_block_parts(block)):
+                            return False
+                        blocks.append(block)
+                        if not self.validate_targets(blocks, len(blocks) - 1):
+                            return False
+                        previous_hash = block.current_hash
+            except (requests.exceptions.RequestException, KeyError):
+                pass
+            except ValueError:
+                # The peer sent an invalid block.
+                return False
+            if len(blocks) == received:
+                failures += 1
+                if failures > self.transport.retries:
                     return False
             else:
-                valid_current_hash = (
-                    blocks[i].current_hash == blocks[i].get_hash()
-                )
-                valid_previous_hash = (
-                    blocks[i].previous_hash == blocks[i - 1].current_hash
-                )
-                if not valid_current_hash or not valid_previous_hash:
-                    return False
+                failures = 0
+
+        if not self.state.validate_blocks(self.chain.blocks, blocks):
+            return False
+        self.chain.replace(blocks)
         return True
 
+    def validate_chain(self, chain):
+        """Validates all the blocks of a chain.
+
+        This function is called every time a node receives a whole chain
+        (e.g. when it joins the network). The blocks are validated by the
+        verifier of the node, which may split them across multiple
+        processes, and their targets and their inputs in order.
+        """
+
+        return (self.validate_targets(chain.blocks) and
+                self.state.validate_blocks(self.chain.blocks, chain.blocks) and
+                self.verifier.find_invalid_block(chain.blocks) is None)
+
     def share_chain(self, ring_node):
         """Shares the node's current blockchain to a specific node.
 
@@ -424,9 +810,181 @@ class Node:
         asked to send its chain by the ring_node.
         """
 
-        address = 'http://' + ring_node['ip'] + ':' + ring_node['port']
-        requests.post(address + '/get_chain', data=pickle.dumps(self.chain))
+        data, headers = self.payloads(self.chain)(ring_node)
+        self.transport.post(ring_node, '/get_chain',
+                            data=data, headers=headers)
+
+    def find_headers(self, locator):
+        """Finds the headers of the blocks after the last block of a locator
+        that is in the chain of the node.
+
+        Returns:
+            the height of that block (the fork point, -1 if no block of the
+            locator is in the chain), the length and the cumulative work of
+            the chain and up to MAX_HEADERS headers (as lists) after the fork
+            point.
+        """
+
+        blocks = self.chain.blocks
+        fork = self.chain.find_fork(locator)
+        tip = self.chain.get_tip()
+        return {
+            'fork': fork,
+            'height': len(blocks),
+            'work': tip.work if tip else 0,
+            'headers': [
+                block.get_header().to_list()
+                for block in blocks[fork + 1:fork + 1 + MAX_HEADERS]
+            ]
+        }
+
+    def find_blocks(self, hashes):
+        """Returns the blocks of the chain with the given hashes (the hashes
+        that are not in the chain are skipped)."""
+
+        blocks = self.chain.blocks
+        heights = [self.chain.get_height(block_hash) for block_hash in hashes]
+        return [blocks[height] for height in heights
+                if height is not None and height < len(blocks)]
+
+    def add_headers(self, headers, fork):
+        """Validates a sequence of headers that follows the block of the
+        chain at the height fork (-1 for a sequence from the genesis block)
+        and adds them in the block tree.
+
+        The validation consists of:
+        - check that the sequence doesn't replace the genesis block of the
+          chain.
+        - check that each header follows the previous one.
+        - check that the timestamp of each header is later than the previous
+          one and not too far in the future.
+        - check that the target of each header is the one that the previous
+          headers require.
+        - check that the hash of each header is valid and lower than its
+          target (only for the headers that are not in the tree yet).
+
+        Returns:
+            the TreeNode of the last header or None if a header is invalid.
+        """
+
+        tree = self.chain.tree
+        blocks = self.chain.blocks
+        if fork >= 0:
+            previous_hash = blocks[fork].current_hash
+        elif blocks:
+            # All the nodes share the genesis block, so a sequence from the
+            # genesis block would only replace it.
+            return None
+        else:
+            previous_hash = 1
+
+        def at(height):
+            if height <= fork:
+                return blocks[height]
+            return headers[height - fork - 1]
+
+        now = time()
+        tree_node = None
+        for i, header in enumerate(headers):
+            if (header.index != fork + 1 + i or
+                    header.previous_hash != previous_hash):
+                return None
+            # The work of a header is counted only after its target is
+            # checked, so a header can't claim more work than it has.
+            if header.index == 0:
+                if blocks and header.current_hash != blocks[0].current_hash:
+                    return None
+            elif not validate_target(at, header.index, now):
+                return None
+            tree_node = tree.get(header.current_hash)
+            if tree_node is None:
+                if (header.current_hash != header.get_hash() or
+                        (header.index > 0 and
+                         not meets_target(header.current_hash, header.target))):
+                    return None
+                tree_node = tree.add_header(header)
+                if tree_node is None:
+                    return None
+            previous_hash = header.current_hash
+        return tree_node
+
+    def download_headers(self, peer, response):
+        """Downloads the headers of the chain of a peer after the fork point,
+        given its response to the block locator of the node, and adds them
+        in the block tree.
+
+        Returns:
+            the TreeNode of the last block of the peer or None if the peer
+            didn't send valid headers.
+        """
+
+        fork = response['fork']
+        height = response['height']
+        if fork >= len(self.chain.blocks):
+            return None
+        headers = [BlockHeader.fromlist(h) for h in response['headers']]
+        while headers and fork + 1 + len(headers) < height:
+            more = self.transport.post(
+                peer, '/get_headers',
+                json={'locator': [headers[-1].current_hash]}).json()
+            if more['fork'] != fork + len(headers) or not more['headers']:
+                return None
+            headers.extend(BlockHeader.fromlist(h) for h in more['headers'])
+        if not headers:
+            return None
+        return self.add_headers(headers, fork)
+
+    def download_blocks(self, peer, branch):
+        """Downloads and validates the blocks of a branch of the block tree.
+
+        Only the blocks that the node doesn't have are downloaded and only
+        the blocks that have not been validated are validated.
+
+        Returns:
+            True if all the blocks of the branch are valid.
+        """
+
+        if any(tree_node.valid is False for tree_node in branch):
+            return False
+        missing = [tree_node for tree_node in branch
+                   if tree_node.block is None]
+
+        accept = {}
+        if peer.get('wire_version', 0) >= wire.WIRE_VERSION:
+            accept['Accept'] = wire.CONTENT_TYPE
+        for i in range(0, len(missing), MAX_BLOCKS):
+            batch = missing[i:i + MAX_BLOCKS]
+            response = self.transport.post(
+                peer, '/get_blocks', headers=accept,
+                json={'hashes': [tree_node.header.current_hash
+                                 for tree_node in batch]})
+            response.raise_for_status()
+            chain = self.decode(response.content,
+                                response.headers.get('Content-Type'))
+            if len(chain.blocks) != len(batch):
+                return False
+            for tree_node, block in zip(batch, chain.blocks):
+                if block.current_hash != tree_node.header.current_hash:
+                    return False
+                block.index = tree_node.header.index
+                tree_node.block = block
+
+        for tree_node in branch:
+            if tree_node.valid is None:
+                # The hash of the block covers its transactions through the
+                # Merkle root, so the block matches its validated header
+                # (unless its last transaction is repeated, which keeps the
+                # same root).
+                block = tree_node.block
+                tree_node.valid = (
+                    block.get_hash() == block.current_hash and
+                    block.has_unique_transactions() and
+                    self.verifier.verify_all(block.transactions))
+            if not tree_node.valid:
+                return False
+        return True
 
+    @traced('resolve_conflicts', block_span)
     def resolve_conflicts(self, new_block):
         """Resolves conflicts of multiple blockchains.
 
@@ -434,64 +992,65 @@ class Node:
         can't validate its previous hash.
 
         In order to resolve the conflict:
-            - broadcast a request to get the current blockchains
-              of the other nodes.
-            - validate the given blockchains.
-            - keep the longest one.
-        """
-        def thread_func(node, chains):
-            if node['id'] != self.id:
-                address = 'http://' + node['ip'] + ':' + node['port']
-                response = requests.get(address + "/send_chain")
-                new_blockchain = pickle.loads(response._content)
-                chains.append(new_blockchain)
-
-        threads = []
-        chains = []
-        for node in self.ring:
-            thread = Thread(target=thread_func, args=(
-                node, chains))
-            threads.append(thread)
-            thread.start()
-
-        for tr in threads:
-            tr.join()
-
-        selected_chain = None
-        for chain in chains:
-            if selected_chain:
-                if (self.validate_chain(chain) and
-                        (
-                            len(chain.blocks) >
-                            len(selected_chain.blocks)
-                )):
-                    selected_chain = chain
-            else:
-                if (self.validate_chain(chain)
-                        and (
-                            len(chain.blocks) >
-                            len(self.chain.blocks)
-                )):
-                    selected_chain = chain
-
-        if selected_chain:
-            self.stop_mining = True
-            with self.filter_lock:
-                i = len(selected_chain.blocks) - 1
-                while (
-                        i > 0 and
-                        ((
-                            selected_chain.blocks[i].current_hash !=
-                            self.chain.blocks[-1].current_hash
-                        ))):
-                    i -= 1
-
-                for bl in reversed(self.chain.blocks[i + 1:]):
-                    self.unconfirmed_blocks.appendleft(bl)
-
-                for bl in selected_chain.blocks[i + 1:]:
-                    self.filter_blocks(bl)
-
-                self.chain = selected_chain
-                self.stop_mining = False
+            - broadcast the block locator of the chain to the other nodes,
+              which respond with the work of their chain and the headers
+              after the last common block (the fork point).
+            - starting from the chain with the most work, validate its
+              headers and add them in the block tree.
+            - if the tip of the chain has more work than the tip of the chain
+              of the node, download and validate only the blocks of the
+              branch that the node doesn't have or hasn't validated.
+            - check that the transactions of the branch spend unspent
+              outputs after the fork point.
+            - switch the blocks of the chain after the fork point.
+        """
+
+        locator = self.chain.get_locator()
+        futures = [
+            (peer, self.transport.submit('POST', peer, '/get_headers',
+                                         json={'locator': locator}))
+            for peer in self.peers()
+        ]
+
+        responses = []
+        for peer, future in futures:
+            try:
+                response = future.result()
+                response.raise_for_status()
+                responses.append((peer, response.json()))
+            except (requests.exceptions.RequestException, ValueError):
+                # Peers that can't respond are ignored.
+                pass
+
+        responses.sort(key=lambda r: r[1].get('work', 0), reverse=True)
+        for peer, response in responses:
+            tip = self.chain.get_tip()
+            if response.get('work', 0) <= tip.work:
+                break
+            try:
+                peer_tip = self.download_headers(peer, response)
+                if peer_tip is None or peer_tip.work <= tip.work:
+                    continue
+                branch = self.chain.get_branch(peer_tip)
+                if not self.download_blocks(peer, branch):
+                    continue
+            except (requests.exceptions.RequestException, ValueError,
+                    KeyError, TypeError):
+                continue
+
+            fork = branch[0].height - 1
+            if not self.state.validate_blocks(
+                    self.chain.blocks[fork + 1:],
+                    [tree_node.block for tree_node in branch]):
+                continue
+            with self.miner_service.paused():
+                for bl in reversed(self.chain.blocks[fork + 1:]):
+                    self.mempool.restore(bl.transactions)
+
+                for tree_node in branch:
+                    self.mempool.remove_block(tree_node.block)
+
+                self.chain.replace(self.chain.blocks[:fork + 1] +
+                                   [tree_node.block for tree_node in branch])
+            break
         return self.validate_block(new_block)
@@ -0,0 +1,208 @@
+import functools
+import os
+import sys
+import threading
+import time
+
+from collections import Counter, deque
+
+# Default seconds between two samples of the profiler.
+SAMPLE_INTERVAL = 0.005
+# Min seconds between two samples, so that the profiler can't turn into a
+# busy loop over the stacks of all the threads.
+MIN_SAMPLE_INTERVAL = 0.001
+# Max number of frames of a sampled stack.
+MAX_DEPTH = 64
+# Max number of spans that the tracer keeps (the oldest are dropped).
+MAX_SPANS = 100000
+
+
+class SamplingProfiler:
+    """
+    A wall-clock profiler that samples the stacks of all the threads of
+    the node at a fixed interval.
+
+    Sampling needs no hooks in the profiled code, so the node runs at full
+    speed while the profiler is stopped, and the overhead while it runs
+    depends only on the interval. The samples are kept as folded stacks
+    (one `frame;frame;... count` line per stack), the input format of
+    flamegraph.pl and speedscope.
+
+    Attributes:
+        interval (float): seconds between two samples.
+        stacks (Counter): the number of samples of each folded stack.
+        samples (int): the number of samples taken.
+        thread (Thread): the sampling thread (None while stopped).
+        stopped (Event): set when the sampling thread should exit.
+        lock (Lock): a lock in order to provide mutual exclusion between
+                     the sampling thread and the readers of the stacks.
+    """
+
+    def __init__(self):
+        """Inits a SamplingProfiler."""
+        self.interval = SAMPLE_INTERVAL
+        self.stacks = Counter()
+        self.samples = 0
+        self.thread = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def is_running(self):
+        """Returns True if the profiler is sampling."""
+        return self.thread is not None
+
+    def start(self, interval=SAMPLE_INTERVAL):
+        """Clears the previous samples and starts sampling.
+
+        Returns:
+            False if the profiler was already running.
+        """
+
+        with self.lock:
+            if self.thread is not None:
+                return False
+            self.interval = interval
+            self.stacks = Counter()
+            self.samples = 0
+            self.stopped.clear()
+            self.thread = threading.Thread(
+                target=self.run, name='profiler', daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        """Stops sampling (the samples are kept until the next start).
+
+        Returns:
+            False if the profiler was not running.
+        """
+
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is None:
+            return False
+        self.stopped.set()
+        thread.join()
+        return True
+
+    @staticmethod
+    def fold(frame, thread_name):
+        """Returns the folded stack of a frame, from the root of the
+        thread to the frame."""
+
+        names = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            code = frame.f_code
+            names.append('%s (%s:%d)' % (code.co_name,
+                                         os.path.basename(code.co_filename),
+                                         code.co_firstlineno))
+            frame = frame.f_back
+        names.append(thread_name)
+        return ';'.join(reversed(names))
+
+    def sample(self):
+        """Takes a sample of the stacks of the other threads."""
+
+        current = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = [
+            self.fold(frame, names.get(ident, str(ident)))
+            for ident, frame in sys._current_frames().items()
+            if ident != current
+        ]
+        with self.lock:
+            self.stacks.update(stacks)
+            self.samples += 1
+
+    def run(self):
+        """Samples the threads until the profiler is stopped."""
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def export(self):
+        """Returns the samples as folded stacks (most frequent first)."""
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return ''.join('%s %d\n' % (stack, count) for stack, count in stacks)
+
+
+class Tracer:
+    """
+    Records spans (name, start, duration and arguments) of the operations
+    of the node.
+
+    The spans have wall-clock timestamps, so the traces of several nodes
+    can be merged in one timeline (e.g. to follow a transaction from the
+    node that created it to the nodes that mined it). They are exported in
+    the trace event format of Chrome, that chrome://tracing and Perfetto
+    open.
+
+    Attributes:
+        enabled (boolean): True while spans are recorded.
+        spans (deque): the recorded spans (the oldest are dropped).
+    """
+
+    def __init__(self):
+        """Inits a Tracer."""
+        self.enabled = False
+        self.spans = deque(maxlen=MAX_SPANS)
+
+    def start(self):
+        """Clears the previous spans and starts recording."""
+        self.spans.clear()
+        self.enabled = True
+
+    def stop(self):
+        """Stops recording (the spans are kept until the next start)."""
+        self.enabled = False
+
+    def add(self, name, start, duration, args=None):
+        """Records a span (start is in seconds since the epoch)."""
+        self.spans.append((name, start, duration, threading.get_ident(),
+                           args or {}))
+
+    def export(self, pid=0, process_name=None):
+        """Returns the spans in the trace event format.
+
+        Args:
+            pid: the process id of the events (e.g. the id of the node), so
+                 that the traces of several nodes can be merged.
+        """
+
+        events = [{
+            'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': start * 1e6, 'dur': duration * 1e6, 'args': args
+        } for name, start, duration, tid, args in list(self.spans)]
+        if process_name is not None:
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                           'args': {'name': process_name}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+# The profiler and the tracer of the node.
+PROFILER = SamplingProfiler()
+TRACER = Tracer()
+
+
+def traced(name, get_args=None):
+    """Decorates a function so that each call is recorded as a span while
+    the tracer is enabled.
+
+    Args:
+        get_args: a function that returns the arguments of the span (a
+                  dict) given the arguments of the call.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                TRACER.add(name, start, time.time() - start,
+                           get_args(*args, **kwargs) if get_args else None)
+        return wrapper
+    return decorator
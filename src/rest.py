@@ -5,14 +5,16 @@ import threading
 
 import config
 import endpoints
-import block
+import transport
+import wire
 
 from flask_cors import CORS
 from argparse import ArgumentParser
-from flask import Flask, jsonify, request, render_template
+from flask import Flask
 
-from block import Block
+from difficulty import difficulty_to_target
 from transaction import Transaction
+from wallet import Wallet
 from endpoints import node, rest_api
 
 # All nodes are aware of the ip and the port of the bootstrap
@@ -27,6 +29,20 @@ else:
     hostname = socket.gethostname()
     IPAddr = socket.gethostbyname(hostname)
 
+# Seconds between the checks of wait_for_server.
+SERVER_POLL_INTERVAL = 0.05
+
+
+def wait_for_server(host, port):
+    """Waits until a server accepts connections in the given address."""
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(SERVER_POLL_INTERVAL)
+
+
 # Define the flask environment and register the blueprint with the endpoints.
 app = Flask(__name__)
 app.register_blueprint(rest_api)
@@ -48,15 +64,71 @@ if __name__ == '__main__':
                           help='capacity of a block', required=True)
     optional.add_argument('-bootstrap', action='store_true',
                           help='set if the current node is the bootstrap')
+    optional.add_argument('-bootstrap_port', default=BOOTSTRAP_PORT,
+                          help='port that the bootstrap node listens on')
+    optional.add_argument('-difficulty', type=int, default=node.difficulty,
+                          help='number of leading zeros of the target of the genesis block (the easiest difficulty of the network)')
+    optional.add_argument('-workers', type=int, default=1,
+                          help='number of processes used for mining')
+    optional.add_argument('-verifiers', type=int, default=1,
+                          help='number of processes used for verifying signatures')
+    optional.add_argument('-timeout', type=float, default=transport.TIMEOUT,
+                          help='seconds to wait for a response of another node')
+    optional.add_argument('-retries', type=int, default=transport.RETRIES,
+                          help='retries of a request that failed to connect to another node')
+    optional.add_argument('-runtime', choices=['flask', 'asyncio'], default='flask',
+                          help='server of the node: the flask development server or an asyncio (ASGI) server')
+    optional.add_argument('-propagation', choices=['broadcast', 'gossip'], default='broadcast',
+                          help='how transactions are sent: validated by all nodes before delivery, or validated on receipt and gossiped')
+    optional.add_argument('-datadir',
+                          help='directory where the blockchain is stored')
+    optional.add_argument('-keystore',
+                          help='file with the private key of the node (created if it does not exist)')
 
     # Parse the given arguments.
     args = parser.parse_args()
     port = args.p
+    BOOTSTRAP_PORT = args.bootstrap_port
     endpoints.n = args.n
     node.capacity = args.capacity
+    node.difficulty = args.difficulty
+    node.miner.workers = args.workers
+    node.verifier.workers = args.verifiers
+    node.transport.timeout = args.timeout
+    node.transport.retries = args.retries
+    node.propagation = args.propagation
     is_bootstrap = args.bootstrap
 
-    if (is_bootstrap):
+    # Without a stored key, the key of the node is generated while the
+    # server starts (a node with a data directory keeps its key there).
+    if args.keystore:
+        node.wallet = Wallet.from_keystore(args.keystore)
+    elif not args.datadir:
+        node.wallet.start_key_generation()
+
+    def run_server(host, port):
+        """Listens in the specified address (ip:port)."""
+        if args.runtime == 'asyncio':
+            # The asyncio runtime needs extra packages, so it is imported
+            # only when it is selected.
+            import async_endpoints
+            async_endpoints.serve(host, port)
+        else:
+            app.run(host=host, port=port)
+
+    # If the node has stored its state, it restarts from it and doesn't
+    # enter the network again.
+    restored = False
+    if args.datadir:
+        try:
+            restored = node.open_store(args.datadir, bool(args.keystore))
+        except ValueError as e:
+            parser.error(str(e))
+
+    if restored:
+        print("Node restored from " + args.datadir)
+        run_server(IPAddr, port)
+    elif (is_bootstrap):
         """
         The bootstrap node (id = 0):
             - registers itself in the ring.
@@ -68,25 +140,25 @@ if __name__ == '__main__':
 
         node.id = 0
         node.register_node_to_ring(
-            node.id, BOOTSTRAP_IP, BOOTSTRAP_PORT, node.wallet.public_key, 100 * endpoints.n)
+            node.id, BOOTSTRAP_IP, BOOTSTRAP_PORT, node.wallet.public_key, 100 * endpoints.n,
+            wire_version=wire.WIRE_VERSION)
 
         # Defines the genesis block.
         gen_block = node.create_new_block()
         gen_block.nonce = 0
+        gen_block.target = difficulty_to_target(node.difficulty)
 
         # Adds the first and only transaction in the genesis block.
         first_transaction = Transaction(
             sender_address="0", sender_id='0', receiver_address=node.wallet.public_key, receiver_id=node.id, amount=100 * endpoints.n, transaction_inputs=None, nbc_sent=100 * endpoints.n)
         gen_block.transactions.append(first_transaction)
         gen_block.current_hash = gen_block.get_hash()
-        node.wallet.transactions.append(first_transaction)
 
         # Add the genesis block in the chain.
-        node.chain.blocks.append(gen_block)
-        node.current_block = None
+        node.chain.add_block(gen_block)
 
         # Listen in the specified address (ip:port)
-        app.run(host=BOOTSTRAP_IP, port=BOOTSTRAP_PORT)
+        run_server(BOOTSTRAP_IP, BOOTSTRAP_PORT)
     else:
         """
         The rest nodes (id = 1, .., n-1):
@@ -98,11 +170,15 @@ if __name__ == '__main__':
             ':' + BOOTSTRAP_PORT + '/register_node'
 
         def thread_function():
-            time.sleep(2)
+            # Register when the bootstrap node is up and the node can
+            # answer it.
+            wait_for_server(BOOTSTRAP_IP, int(BOOTSTRAP_PORT))
+            wait_for_server(IPAddr, port)
             response = requests.post(
                 register_address,
                 data={'public_key': node.wallet.public_key,
-                      'ip': IPAddr, 'port': port}
+                      'ip': IPAddr, 'port': port,
+                      'wire_version': wire.WIRE_VERSION}
             )
 
             if response.status_code == 200:
@@ -114,4 +190,4 @@ if __name__ == '__main__':
         req.start()
 
         # Listen in the specified address (ip:port)
-        app.run(host=IPAddr, port=port)
+        run_server(IPAddr, port)
@@ -0,0 +1,328 @@
+from collections import OrderedDict
+
+from ledger import Ledger
+from utxo import UTXOSet
+
+
+def input_keys(transaction):
+    """Returns the keys of the outputs that a transaction spends."""
+    return [(transaction_input.previous_output_id,
+             transaction_input.output_index)
+            for transaction_input in transaction.transaction_inputs or ()]
+
+
+def output_keys(transaction):
+    """Returns the keys of the outputs of a transaction."""
+    return [(transaction.transaction_id, index)
+            for index in range(len(transaction.transaction_outputs))]
+
+
+def validate_outputs(transaction):
+    """Checks that a transaction pays its amount to the receiver and the
+    rest of the coins that it sends back to the sender."""
+
+    amount = transaction.amount
+    nbc_sent = transaction.nbc_sent
+    if not 0 < amount <= nbc_sent:
+        return False
+    expected = [(transaction.receiver_address, amount)]
+    if nbc_sent > amount:
+        expected.append((transaction.sender_address, nbc_sent - amount))
+    return [(output.transaction_id, output.recipient, output.amount)
+            for output in transaction.transaction_outputs] == [
+        (transaction.transaction_id, recipient, amount)
+        for recipient, amount in expected]
+
+
+def validate_inputs(transaction, get):
+    """Checks that a transaction spends distinct unspent outputs of its
+    sender, whose sum is the coins that it sends, and that its outputs are
+    valid.
+
+    Args:
+        get: a function that returns an unspent output given its key, or
+             None.
+    """
+
+    keys = input_keys(transaction)
+    if not keys or len(set(keys)) != len(keys):
+        return False
+    total = 0
+    for key in keys:
+        output = get(key)
+        if output is None or output.recipient != transaction.sender_address:
+            return False
+        total += output.amount
+    return total == transaction.nbc_sent and validate_outputs(transaction)
+
+
+class ChainState:
+    """
+    The state that a node derives from its active chain and its pending
+    transactions: the balances, the unspent outputs and the transactions of
+    each public key.
+
+    Each applied block leaves an undo record with the outputs that it spent,
+    so the blocks of a replaced branch are undone without replaying the
+    chain and switching branches costs O(switched blocks). The transactions
+    of the undone blocks become pending again, and pending transactions
+    whose inputs are spent by a confirmed block (with their descendants)
+    are evicted, also from the mempool.
+
+    Attributes:
+        ledger (Ledger): the confirmed and the pending balances.
+        utxos (UTXOSet): the unspent outputs of the chain.
+        view (UTXOSet): the unspent outputs of the chain after the pending
+                        transactions, from which the node spends.
+        undo (dict): the outputs that each transaction of an applied block
+                     spent, as lists of (key, output) pairs (one per
+                     transaction), given the hash of the block.
+        spent_by (dict): the id of the pending transaction that spends each
+                         output, given its key.
+        reserved (dict): the outputs of the view that the node selected for
+                         its new transactions, which are not pending yet,
+                         given their keys.
+        history (dict): the confirmed transactions of each public key, in
+                        the order of the chain.
+        mempool (Mempool): the mempool of the node (may be None).
+        lock (Lock): the lock of the ledger, so that the ledger and the
+                     outputs change together.
+    """
+
+    def __init__(self, mempool=None):
+        """Inits the ChainState of an empty chain."""
+        self.ledger = Ledger()
+        self.utxos = UTXOSet()
+        self.view = UTXOSet()
+        self.undo = {}
+        self.spent_by = {}
+        self.reserved = {}
+        self.history = {}
+        self.mempool = mempool
+        self.lock = self.ledger.lock
+
+    def update(self, removed, added):
+        """Removes blocks from the tip of the chain and adds new ones.
+
+        Args:
+            removed: the removed blocks (in the order of the chain).
+            added: the added blocks (in the order of the chain).
+        """
+
+        with self.lock:
+            for block in reversed(removed):
+                self.undo_block(block)
+            for block in added:
+                self.apply_block(block)
+
+    def apply_block(self, block):
+        """Applies a block at the tip of the chain (the lock is held)."""
+
+        spent = []
+        for transaction in block.transactions:
+            transaction_id = transaction.transaction_id
+            keys = input_keys(transaction)
+            for key in keys:
+                holder = self.spent_by.get(key)
+                if holder is not None and holder != transaction_id:
+                    self.evict(holder)
+
+            spent.append(self.utxos.spend(keys))
+            self.utxos.add_transaction(transaction)
+            if transaction_id in self.ledger.pending:
+                # The view already contains the pending transaction.
+                for key in keys:
+                    self.spent_by.pop(key, None)
+            else:
+                self.spend_view(keys)
+                self.view.add_transaction(transaction)
+
+            for public_key in (transaction.sender_address,
+                               transaction.receiver_address):
+                self.history.setdefault(
+                    public_key, OrderedDict())[transaction_id] = transaction
+
+        self.undo[block.current_hash] = spent
+        self.ledger.update_unlocked([], [block])
+
+    def undo_block(self, block):
+        """Undoes the block at the tip of the chain (the lock is held).
+
+        The transactions of the block become pending, so the view doesn't
+        change.
+        """
+
+        # The transactions are undone one by one in reverse order, so an
+        # output that a later transaction of the block spent is restored
+        # before the transaction that created it removes it again.
+        spent = self.undo.pop(block.current_hash)
+        for transaction, outputs in reversed(
+                list(zip(block.transactions, spent))):
+            self.utxos.spend(output_keys(transaction))
+            self.utxos.unspend(outputs)
+            for public_key in (transaction.sender_address,
+                               transaction.receiver_address):
+                self.history.get(public_key, {}).pop(
+                    transaction.transaction_id, None)
+            for key in input_keys(transaction):
+                self.spent_by[key] = transaction.transaction_id
+        self.ledger.update_unlocked([block], [])
+
+    def add_pending(self, transaction):
+        """Adds a transaction that the node accepted.
+
+        The inputs are checked again against the view, since a transaction
+        that spends the same outputs may have been added after the
+        transaction was validated.
+
+        Returns:
+            False if the transaction is already pending or confirmed or its
+            inputs are not unspent.
+        """
+
+        with self.lock:
+            if not validate_inputs(transaction, self.get_unspent):
+                return False
+            if not self.ledger.add_pending_unlocked(transaction):
+                return False
+            keys = input_keys(transaction)
+            for key in keys:
+                self.spent_by[key] = transaction.transaction_id
+            self.spend_view(keys)
+            self.view.add_transaction(transaction)
+            return True
+
+    def validate_pending(self, transaction):
+        """Checks the inputs of an incoming transaction against the view
+        (see validate_inputs)."""
+        with self.lock:
+            return validate_inputs(transaction, self.view.get)
+
+    def validate_blocks(self, removed, added):
+        """Checks that the transactions of blocks that replace the last
+        blocks of the chain spend unspent outputs (see validate_inputs).
+
+        Only the transactions of the genesis block have no inputs.
+
+        Args:
+            removed: the replaced blocks (in the order of the chain).
+            added: the new blocks (in the order of the chain).
+        """
+
+        with self.lock:
+            # The outputs that differ from the unspent outputs of the chain
+            # (None if they are spent or don't exist).
+            changed = {}
+            for block in reversed(removed):
+                for transaction, outputs in reversed(list(zip(
+                        block.transactions, self.undo[block.current_hash]))):
+                    changed.update(dict.fromkeys(output_keys(transaction)))
+                    changed.update(outputs)
+
+            def get(key):
+                return changed[key] if key in changed else self.utxos.get(key)
+
+            for block in added:
+                for transaction in block.transactions:
+                    if (transaction.transaction_inputs is None and
+                            block.index == 0):
+                        if not validate_outputs(transaction):
+                            return False
+                    elif not validate_inputs(transaction, get):
+                        return False
+                    changed.update(dict.fromkeys(input_keys(transaction)))
+                    changed.update(zip(output_keys(transaction),
+                                       transaction.transaction_outputs))
+            return True
+
+    def get_unspent(self, key):
+        """Returns an output of the view or an output that the node
+        reserved, given its key, or None."""
+        return self.view.get(key) or self.reserved.get(key)
+
+    def select(self, public_key, amount):
+        """Reserves the oldest outputs of the view that cover an amount for a
+        new transaction of the node (see UTXOSet.select)."""
+
+        with self.lock:
+            selected = self.view.select(public_key, amount)
+            if selected is not None:
+                self.reserved.update(selected)
+            return selected
+
+    def release(self, selected):
+        """Puts back in the view the outputs that the node reserved for a
+        transaction that it didn't send."""
+
+        with self.lock:
+            self.view.unspend([(key, output) for key, output in selected
+                               if self.reserved.pop(key, None) is not None])
+
+    def spend_view(self, keys):
+        """Spends outputs of the view (the lock is held).
+
+        An output that the node reserved is already out of the view, so its
+        reservation is dropped instead and the new transaction of the node
+        that would spend it is rejected.
+        """
+        self.view.spend([key for key in keys
+                         if self.reserved.pop(key, None) is None])
+
+    def pending_output(self, key):
+        """Returns an output of a pending transaction given its key, or
+        None."""
+        transaction = self.ledger.pending.get(key[0])
+        if transaction is None:
+            return None
+        return transaction.transaction_outputs[key[1]]
+
+    def evict(self, transaction_id):
+        """Drops a pending transaction and the pending transactions that
+        spend its outputs (the lock is held)."""
+
+        # Find the descendants, so that they are evicted before their
+        # parents.
+        evicted = []
+        stack = [transaction_id]
+        while stack:
+            transaction = self.ledger.pending.get(stack.pop())
+            if transaction is None or transaction in evicted:
+                continue
+            evicted.append(transaction)
+            for key in output_keys(transaction):
+                child = self.spent_by.get(key)
+                if child is not None:
+                    stack.append(child)
+
+        for transaction in reversed(evicted):
+            self.spend_view(output_keys(transaction))
+            restored = []
+            for key in input_keys(transaction):
+                if self.spent_by.get(key) == transaction.transaction_id:
+                    del self.spent_by[key]
+                    output = self.utxos.get(key) or self.pending_output(key)
+                    if output is not None:
+                        restored.append((key, output))
+            self.view.unspend(restored)
+            self.ledger.remove_pending_unlocked(transaction)
+
+        if self.mempool is not None:
+            self.mempool.remove(evicted)
+
+    def get_balance(self, public_key):
+        """Returns the balance of a public key including the pending
+        transactions."""
+        return self.view.get_balance(public_key)
+
+    def get_transactions(self, public_key):
+        """Returns the confirmed and then the pending transactions of a
+        public key."""
+
+        with self.lock:
+            confirmed = list(self.history.get(public_key, {}).values())
+            pending = [
+                transaction for transaction in self.ledger.pending.values()
+                if public_key in (transaction.sender_address,
+                                  transaction.receiver_address)
+            ]
+        return confirmed + pending
@@ -0,0 +1,215 @@
+import mmap
+import os
+import pickle
+import struct
+
+from threading import Lock
+
+# Max size of a segment file in bytes (a block is never split across
+# segments, so a segment may exceed it by one block).
+SEGMENT_SIZE = 64 * 1024 * 1024
+# Each entry of the index: segment, offset, length and hash of a block.
+INDEX_ENTRY = struct.Struct('<IQI32s')
+INDEX_FILE = 'index.dat'
+SEGMENT_FILE = 'blocks%05d.dat'
+
+
+class BlockStore:
+    """
+    Append-only on-disk storage of the blocks of a blockchain.
+
+    The blocks are appended in segment files. An index file contains one
+    fixed-size entry per height with the position of the block in the
+    segments, so it is loaded at startup without reading the blocks.
+    Segments are memory-mapped for reads.
+
+    Attributes:
+        directory (str): the directory of the files.
+        sync (boolean): True if every append should be flushed to the disk.
+        readonly (boolean): True if the files are only read (e.g. in order
+                            to audit the store of a running node).
+        entries (list): the (segment, offset, length, hash) of each block.
+        heights (dict): the height of each block given its hash.
+        maps (dict): the memory maps of the segments that have been read.
+        lock (Lock): a lock in order to provide mutual exclusion between
+                     reads and writes of the segments.
+    """
+
+    def __init__(self, directory, sync=False, readonly=False):
+        """Inits a BlockStore and loads its index.
+
+        Raises:
+            ValueError: if the store is read-only and the directory doesn't
+                        exist.
+        """
+        self.directory = directory
+        self.sync = sync
+        self.readonly = readonly
+        self.entries = []
+        self.heights = {}
+        self.maps = {}
+        self.lock = Lock()
+        if readonly:
+            if not os.path.isdir(directory):
+                raise ValueError('No such data directory: ' + directory)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        self.load_index()
+
+    def __len__(self):
+        """Returns the number of the stored blocks."""
+        return len(self.entries)
+
+    def path(self, name):
+        """Returns the path of a file of the store."""
+        return os.path.join(self.directory, name)
+
+    def load_index(self):
+        """Loads the index and drops any partially written data (only from
+        memory, if the store is read-only)."""
+
+        index_path = self.path(INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            # A crash may leave a partial entry at the end of the index.
+            valid = len(data) - len(data) % INDEX_ENTRY.size
+            for segment, offset, length, raw_hash in INDEX_ENTRY.iter_unpack(
+                    data[:valid]):
+                self.heights[raw_hash.hex()] = len(self.entries)
+                self.entries.append((segment, offset, length, raw_hash.hex()))
+            if valid < len(data) and not self.readonly:
+                with open(index_path, 'r+b') as f:
+                    f.truncate(valid)
+
+        # Blocks appended in the segments but not in the index are dropped.
+        if not self.readonly:
+            self.truncate_segments(len(self.entries))
+
+    def truncate_segments(self, height):
+        """Removes the data of the segments from the given height and on."""
+
+        if height < len(self.entries):
+            segment, offset, _, _ = self.entries[height]
+        elif self.entries:
+            segment, offset, length, _ = self.entries[-1]
+            offset += length
+        else:
+            segment, offset = 0, 0
+
+        self.close_maps()
+        next_segment = segment + 1
+        while os.path.exists(self.path(SEGMENT_FILE % next_segment)):
+            os.remove(self.path(SEGMENT_FILE % next_segment))
+            next_segment += 1
+        segment_path = self.path(SEGMENT_FILE % segment)
+        if os.path.exists(segment_path):
+            with open(segment_path, 'r+b') as f:
+                f.truncate(offset)
+
+    def append(self, block):
+        """Appends a block at the end of the store."""
+
+        self.check_writable()
+        data = pickle.dumps(block)
+        if self.entries:
+            segment, offset, length, _ = self.entries[-1]
+            offset += length
+            if offset >= SEGMENT_SIZE:
+                segment, offset = segment + 1, 0
+        else:
+            segment, offset = 0, 0
+
+        with self.lock:
+            with open(self.path(SEGMENT_FILE % segment), 'ab') as f:
+                f.write(data)
+                self.flush(f)
+            with open(self.path(INDEX_FILE), 'ab') as f:
+                f.write(INDEX_ENTRY.pack(
+                    segment, offset, len(data),
+                    bytes.fromhex(block.current_hash)))
+                self.flush(f)
+
+            self.heights[block.current_hash] = len(self.entries)
+            self.entries.append(
+                (segment, offset, len(data), block.current_hash))
+
+    def check_writable(self):
+        """Raises ValueError if the store is read-only."""
+        if self.readonly:
+            raise ValueError('The store of ' + self.directory + ' is read-only.')
+
+    def flush(self, f):
+        """Flushes a written file to the disk, if sync is set."""
+        if self.sync:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def truncate(self, height):
+        """Removes all the blocks from the given height and on."""
+
+        self.check_writable()
+        if height >= len(self.entries):
+            return
+        with self.lock:
+            self.truncate_segments(height)
+            with open(self.path(INDEX_FILE), 'r+b') as f:
+                f.truncate(height * INDEX_ENTRY.size)
+            while len(self.entries) > height:
+                del self.heights[self.entries.pop()[3]]
+
+    def get_map(self, segment, end):
+        """Returns a memory map of a segment that covers the given offset."""
+
+        segment_map = self.maps.get(segment)
+        if segment_map is None or len(segment_map) < end:
+            if segment_map is not None:
+                segment_map.close()
+            with open(self.path(SEGMENT_FILE % segment), 'rb') as f:
+                segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = segment_map
+        return segment_map
+
+    def close_maps(self):
+        """Closes the memory maps of the segments."""
+        for segment_map in self.maps.values():
+            segment_map.close()
+        self.maps = {}
+
+    def get_block(self, height):
+        """Reads the block at the given height."""
+
+        with self.lock:
+            segment, offset, length, _ = self.entries[height]
+            segment_map = self.get_map(segment, offset + length)
+            data = segment_map[offset:offset + length]
+        return pickle.loads(data)
+
+    def get_height(self, block_hash):
+        """Returns the height of a block given its hash, or None."""
+        return self.heights.get(block_hash)
+
+    def iter_blocks(self, start=0):
+        """Reads the blocks from the given height and on."""
+        for height in range(start, len(self.entries)):
+            yield self.get_block(height)
+
+    def save_state(self, name, obj):
+        """Saves a small object of the node state (e.g. the ring) next to the
+        blocks."""
+
+        self.check_writable()
+
+        tmp_path = self.path(name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f)
+            self.flush(f)
+        os.replace(tmp_path, self.path(name))
+
+    def load_state(self, name):
+        """Loads an object saved with save_state, or None."""
+
+        if not os.path.exists(self.path(name)):
+            return None
+        with open(self.path(name), 'rb') as f:
+            return pickle.load(f)
@@ -1,17 +1,11 @@
-from collections import OrderedDict
-import binascii
-import json
-
 import Crypto
 import Crypto.Random
 from Crypto.Hash import SHA256
 from Crypto.PublicKey import RSA
 from Crypto.Signature import pss
 
-import requests
-from flask import Flask, jsonify, request, render_template
-
 from transaction_output import TransactionOutput
+from verifier import verify_parts
 
 
 class Transaction:
@@ -29,8 +23,17 @@ class Transaction:
         transaction_id (int): hash of the transaction.
         transaction_outputs (list): list of TransactionOutput.
         signature (int): signature that verifies that the owner of the wallet created the transaction.
+
+    Each attribute can be set only once (the signature when the transaction
+    is signed), so a transaction can't change after
+    it is signed and the same object is shared by the mempool, the blocks
+    and the wallet instead of being copied.
     """
 
+    __slots__ = ('sender_address', 'sender_id', 'receiver_address',
+                 'receiver_id', 'amount', 'transaction_inputs', 'nbc_sent',
+                 'transaction_id', 'transaction_outputs', 'signature')
+
     def __init__(self, sender_address, sender_id, receiver_address, receiver_id, amount, transaction_inputs, nbc_sent, transaction_id=None, transaction_outputs=None, signature=None):
         """Inits a Transaction"""
         self.sender_address = sender_address
@@ -38,6 +41,8 @@ class Transaction:
         self.receiver_address = receiver_address
         self.receiver_id = receiver_id
         self.amount = amount
+        if transaction_inputs is not None:
+            transaction_inputs = tuple(transaction_inputs)
         self.transaction_inputs = transaction_inputs
         self.nbc_sent = nbc_sent
 
@@ -49,13 +54,29 @@ class Transaction:
         if (not transaction_outputs):
             self.compute_transaction_output()
         else:
-            self.transaction_outputs = transaction_outputs
+            self.transaction_outputs = tuple(transaction_outputs)
 
         self.signature = signature
 
+    def __setattr__(self, name, value):
+        """Sets an attribute that has not been set yet."""
+        if getattr(self, name, None) is not None:
+            raise AttributeError(
+                "Can't change the " + name + " of a transaction.")
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        """Returns the attributes of the transaction for pickling."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        """Restores a pickled transaction."""
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
     def __str__(self):
         """Returns a string representation of a Transaction object"""
-        return str(self.__class__) + ": " + str(self.__dict__)
+        return str(self.__class__) + ": " + str(self.__getstate__())
 
     def __eq__(self, other):
         """Overrides the default method for comparing Transaction objects.
@@ -79,13 +100,15 @@ class Transaction:
 
         reciever_output = TransactionOutput(
             self.transaction_id, self.receiver_address, self.amount)
-        self.transaction_outputs = [reciever_output]
+        transaction_outputs = [reciever_output]
 
         if self.nbc_sent > self.amount:
             # If there is change for the transaction.
             sender_output = TransactionOutput(
                 self.transaction_id, self.sender_address, self.nbc_sent - self.amount)
-            self.transaction_outputs.append(sender_output)
+            transaction_outputs.append(sender_output)
+
+        self.transaction_outputs = tuple(transaction_outputs)
 
     def get_hash(self):
         """Computes the hash of the transaction."""
@@ -94,22 +117,28 @@ class Transaction:
         return Crypto.Random.get_random_bytes(128).decode("ISO-8859-1")
 
     def sign_transaction(self, private_key):
-        """Sign the current transaction with the given private key."""
+        """Sign the current transaction with the given private key.
+
+        The private key is either in PEM format or a PSS signer that has
+        already parsed it (see Wallet.signer), which is much faster when
+        many transactions are signed.
+        """
 
         message = self.transaction_id.encode("ISO-8859-1")
-        key = RSA.importKey(private_key.encode("ISO-8859-1"))
+        if isinstance(private_key, str):
+            key = RSA.importKey(private_key.encode("ISO-8859-1"))
+            signer = pss.new(key)
+        else:
+            signer = private_key
         h = SHA256.new(message)
-        signer = pss.new(key)
         self.signature = signer.sign(h).decode('ISO-8859-1')
 
     def verify_signature(self):
-        """Verifies the signature of a transaction."""
-
-        key = RSA.importKey(self.sender_address.encode('ISO-8859-1'))
-        h = SHA256.new(self.transaction_id.encode('ISO-8859-1'))
-        verifier = pss.new(key)
-        try:
-            verifier.verify(h, self.signature.encode('ISO-8859-1'))
-            return True
-        except (ValueError, TypeError):
-            return False
+        """Verifies the signature of a transaction.
+
+        The parsed public key of the sender is cached, so it is not imported
+        again for every transaction.
+        """
+
+        return verify_parts(
+            self.sender_address, self.transaction_id, self.signature)
@@ -5,8 +5,13 @@ class TransactionInput:
 
     Attributes:
         previous_output_id (int): id of the transaction that the coins come from.
+        output_index (int): index of the spent output in the outputs of that
+                            transaction.
     """
 
-    def __init__(self, previous_output_id):
+    __slots__ = ('previous_output_id', 'output_index')
+
+    def __init__(self, previous_output_id, output_index=None):
         """Inits a TransactionInput."""
         self.previous_output_id = previous_output_id
+        self.output_index = output_index
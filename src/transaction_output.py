@@ -7,15 +7,34 @@ class TransactionOutput:
         transaction_id (int): id of the transaction.
         recipient (int): the recipient of the transaction.
         amount (int): the amount of nbcs to be transfered.
-        unspent (boolean): false if this output has been used as input in a transaction.
+
+    An output is immutable, whether it is unspent is kept by the UTXO sets
+    of the chain state of the node.
     """
 
+    __slots__ = ('transaction_id', 'recipient', 'amount')
+
     def __init__(self, transaction_id, recipient, amount):
         """Inits a TransactionOutput."""
         self.transaction_id = transaction_id
         self.recipient = recipient
         self.amount = amount
-        self.unspent = True
+
+    def __setattr__(self, name, value):
+        """Sets an attribute that has not been set yet."""
+        if hasattr(self, name):
+            raise AttributeError(
+                "Can't change the " + name + " of a transaction output.")
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        """Returns the attributes of the output for pickling."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        """Restores a pickled output."""
+        for name in self.__slots__:
+            object.__setattr__(self, name, state[name])
 
     @classmethod
     def fromdict(cls, output_dict):
@@ -27,4 +46,4 @@ class TransactionOutput:
 
     def __str__(self):
         """Returns a string representation of a TransactionOutput object"""
-        return str(self.__dict__)
+        return str(self.__getstate__())
@@ -0,0 +1,190 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import requests
+
+from metrics import Counter, Histogram
+
+# Default number of threads that send requests to the peers.
+MAX_WORKERS = 32
+# Default seconds to wait for a peer (a peer may mine a block before it
+# responds).
+TIMEOUT = 60
+# Default number of retries of a request that failed to connect.
+RETRIES = 2
+
+# The latency of the requests to each peer (the fan-out of a broadcast is
+# one request per peer).
+PEER_REQUEST_TIME = Histogram(
+    'noobcash_peer_request_seconds',
+    'Seconds until a peer responded to a request.',
+    ['endpoint', 'peer'])
+PEER_REQUEST_FAILURES = Counter(
+    'noobcash_peer_request_failures_total',
+    'Number of requests to a peer that failed.',
+    ['endpoint', 'peer'])
+
+
+def request_metrics(endpoint, address):
+    """Returns the latency histogram and the failure counter of the
+    requests to an endpoint (without its query) of a peer address."""
+    endpoint = endpoint.split('?', 1)[0]
+    return (PEER_REQUEST_TIME.labels(endpoint, address),
+            PEER_REQUEST_FAILURES.labels(endpoint, address))
+
+
+class PeerTransport:
+    """
+    The transport layer between a node and its peers.
+
+    Each peer gets a long-lived keep-alive session, so that the TCP
+    connections are reused across requests. Requests to multiple peers
+    are sent by a bounded pool of threads instead of a new thread per
+    request.
+
+    Attributes:
+        max_workers (int): max number of requests sent at the same time.
+        executor (ThreadPoolExecutor): the threads that send the requests.
+        sessions (dict): the session of each peer address.
+        timeout (float): the default timeout of a request in seconds.
+        retries (int): the default number of retries of a request.
+        peer_options (dict): the (timeout, retries) of specific peers,
+                             given their address.
+        lock (Lock): a lock in order to provide mutual exclusion when
+                     sessions are created.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, timeout=TIMEOUT,
+                 retries=RETRIES):
+        """Inits a PeerTransport."""
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.sessions = {}
+        self.timeout = timeout
+        self.retries = retries
+        self.peer_options = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def address(peer):
+        """Returns the address of a peer of the ring."""
+        return 'http://' + peer['ip'] + ':' + str(peer['port'])
+
+    def set_peer_options(self, peer, timeout=None, retries=None):
+        """Sets the timeout and the retries of the requests to a peer."""
+        self.peer_options[self.address(peer)] = (timeout, retries)
+
+    def get_peer_options(self, address):
+        """Returns the timeout and the retries of the requests to a peer
+        address."""
+        timeout, retries = self.peer_options.get(address, (None, None))
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+        return timeout, retries
+
+    def session(self, address):
+        """Returns the session of a peer address, creating it if needed."""
+        with self.lock:
+            session = self.sessions.get(address)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.max_workers)
+                session.mount('http://', adapter)
+                self.sessions[address] = session
+            return session
+
+    def request(self, method, peer, endpoint, **kwargs):
+        """Sends a request to a peer.
+
+        Only connection errors are retried, not timeouts of requests that
+        the peer may have already processed.
+        """
+
+        address = self.address(peer)
+        timeout, retries = self.get_peer_options(address)
+        session = self.session(address)
+        latency, failures = request_metrics(endpoint, address)
+        start_time = time.perf_counter()
+        for attempt in range(retries + 1):
+            try:
+                response = session.request(method, address + endpoint,
+                                           timeout=timeout, **kwargs)
+                latency.observe(time.perf_counter() - start_time)
+                return response
+            except requests.exceptions.ConnectionError:
+                if attempt == retries:
+                    failures.inc()
+                    raise
+            except requests.exceptions.RequestException:
+                failures.inc()
+                raise
+
+    def open_stream(self, peer, endpoint, **kwargs):
+        """Sends a GET request to a peer whose response is read as it
+        arrives (with iter_content), instead of at once.
+
+        Failed requests are not retried, since the caller can resume the
+        stream from the data that it has already received.
+        """
+
+        address = self.address(peer)
+        timeout, _ = self.get_peer_options(address)
+        return self.session(address).get(
+            address + endpoint, timeout=timeout, stream=True, **kwargs)
+
+    def post(self, peer, endpoint, **kwargs):
+        """Sends a POST request to a peer."""
+        return self.request('POST', peer, endpoint, **kwargs)
+
+    def get(self, peer, endpoint, **kwargs):
+        """Sends a GET request to a peer."""
+        return self.request('GET', peer, endpoint, **kwargs)
+
+    def submit(self, method, peer, endpoint, **kwargs):
+        """Sends a request to a peer in the background.
+
+        Returns:
+            a Future with the response.
+        """
+        return self.executor.submit(
+            self.request, method, peer, endpoint, **kwargs)
+
+    def broadcast(self, method, peers, endpoint, payload=None, **kwargs):
+        """Sends a request to multiple peers in the background.
+
+        Args:
+            payload: a function that returns the (data, headers) of the
+                     request for a peer.
+        Returns:
+            a list of Futures with the responses.
+        """
+
+        futures = []
+        for peer in peers:
+            if payload:
+                data, headers = payload(peer)
+                futures.append(self.submit(method, peer, endpoint,
+                                           data=data, headers=headers,
+                                           **kwargs))
+            else:
+                futures.append(self.submit(method, peer, endpoint, **kwargs))
+        return futures
+
+    @staticmethod
+    def status_codes(futures):
+        """Waits for the given requests and returns their status codes
+        (None for the requests that failed)."""
+
+        codes = []
+        for future in futures:
+            try:
+                codes.append(future.result().status_code)
+            except requests.exceptions.RequestException:
+                codes.append(None)
+        return codes
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class UTXOSet:
+    """
+    A set of unspent transaction outputs (UTXOs).
+
+    Attributes:
+        outputs (dict): the unspent outputs keyed by
+                        (transaction_id, output index).
+        owners (dict): the keys of the unspent outputs of each owner, in the
+                       order they were added.
+        balances (dict): the running balance of each owner.
+        lock (Lock): a lock in order to provide mutual exclusion when
+                     outputs are spent.
+    """
+
+    def __init__(self):
+        """Inits a UTXOSet."""
+        self.outputs = {}
+        self.owners = {}
+        self.balances = {}
+        self.lock = Lock()
+
+    def __str__(self):
+        """Returns a string representation of a UTXOSet object."""
+        return str(self.__class__) + ": " + str(self.outputs)
+
+    def _add(self, key, output):
+        """Adds an output in the set (the lock should be held)."""
+        self.outputs[key] = output
+        self.owners.setdefault(output.recipient, OrderedDict())[key] = None
+        self.balances[output.recipient] = (
+            self.balances.get(output.recipient, 0) + output.amount)
+
+    def _remove(self, key):
+        """Removes an output from the set (the lock should be held)."""
+        output = self.outputs.pop(key)
+        del self.owners[output.recipient][key]
+        self.balances[output.recipient] -= output.amount
+        return output
+
+    def add_transaction(self, transaction, owner=None):
+        """Adds the outputs of a transaction in the set.
+
+        If owner is given, only the outputs that have owner as recipient
+        are added.
+        """
+
+        with self.lock:
+            for index, output in enumerate(transaction.transaction_outputs):
+                if owner is None or output.recipient == owner:
+                    self._add((transaction.transaction_id, index), output)
+
+    def get_balance(self, owner):
+        """Returns the sum of the unspent outputs of an owner."""
+        return self.balances.get(owner, 0)
+
+    def select(self, owner, amount):
+        """Spends the oldest outputs of an owner that cover the given amount.
+
+        Returns:
+            the list of the spent (key, output) pairs or None if the balance
+            of the owner is not enough (nothing is spent in this case).
+        """
+
+        with self.lock:
+            if self.get_balance(owner) < amount:
+                return None
+
+            selected = []
+            total = 0
+            owner_keys = self.owners.get(owner)
+            while total < amount:
+                key = next(iter(owner_keys))
+                output = self._remove(key)
+                selected.append((key, output))
+                total += output.amount
+            return selected
+
+    def spend(self, keys):
+        """Removes the outputs with the given keys from the set.
+
+        Returns:
+            the list of the removed (key, output) pairs.
+
+        Raises:
+            KeyError: if an output is not in the set (nothing is removed).
+        """
+
+        with self.lock:
+            for key in keys:
+                if key not in self.outputs:
+                    raise KeyError(key)
+            return [(key, self._remove(key)) for key in keys]
+
+    def get(self, key):
+        """Returns the unspent output with the given key, or None."""
+        return self.outputs.get(key)
+
+    def unspend(self, selected):
+        """Puts back in the set the outputs returned by select.
+
+        The outputs keep their position as the oldest outputs of the owner.
+        """
+
+        with self.lock:
+            for key, output in reversed(selected):
+                self._add(key, output)
+                self.owners[output.recipient].move_to_end(key, last=False)
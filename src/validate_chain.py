@@ -0,0 +1,85 @@
+import pickle
+import time
+
+import requests
+
+from argparse import ArgumentParser
+
+from blockchain import Blockchain
+from difficulty import find_invalid_target
+from storage import BlockStore
+from verifier import SignatureVerifier
+import wire
+
+
+# Size in bytes of the chunks in which the blocks are downloaded.
+STREAM_CHUNK = 64 * 1024
+
+
+def load_chain(datadir=None, url=None):
+    """Loads a blockchain from a data directory of a node or downloads it
+    from a running node as a stream of blocks (in pickle format, which
+    doesn't need the ring)."""
+
+    if datadir:
+        # The store of a running node may be audited, so it is only read.
+        return Blockchain(BlockStore(datadir, readonly=True))
+    chain = Blockchain()
+    with requests.get(url.rstrip('/') + '/stream_chain', stream=True) as response:
+        response.raise_for_status()
+        chain.blocks = [
+            pickle.loads(data)
+            for data in wire.iter_frames(response.iter_content(STREAM_CHUNK))
+        ]
+    return chain
+
+
+if __name__ == '__main__':
+    # Define the argument parser.
+    parser = ArgumentParser(
+        description='Validates a noobcash blockchain and reports the throughput of the validation.')
+
+    source = parser.add_argument_group('source of the blockchain (one is required)')
+    optional = parser.add_argument_group('optional_arguments')
+
+    source.add_argument('-datadir',
+                        help='data directory of a node (see -datadir of rest.py)')
+    source.add_argument('-url',
+                        help='address of a running node, e.g. http://127.0.0.1:5000')
+    optional.add_argument('-workers', type=int, default=1,
+                          help='number of processes used for validating blocks')
+
+    # Parse the given arguments.
+    args = parser.parse_args()
+    if bool(args.datadir) == bool(args.url):
+        parser.error('exactly one of -datadir and -url is required')
+
+    start_time = time.time()
+    try:
+        chain = load_chain(args.datadir, args.url)
+    except ValueError as e:
+        parser.error(str(e))
+    load_time = time.time() - start_time
+    num_blocks = len(chain.blocks)
+    num_transactions = sum(len(block.transactions) for block in chain.blocks)
+    print('Loaded %d blocks with %d transactions in %.3f s' %
+          (num_blocks, num_transactions, load_time))
+
+    verifier = SignatureVerifier(args.workers)
+    start_time = time.time()
+    # The targets depend on the previous blocks, so they are checked in
+    # order, before the blocks are split across the workers.
+    invalid = find_invalid_target(chain.blocks)
+    if invalid is None:
+        invalid = verifier.find_invalid_block(chain.blocks)
+    validation_time = time.time() - start_time
+    verifier.close()
+
+    if invalid is None:
+        print('The blockchain is valid.')
+    else:
+        print('The block at height %d is invalid.' % invalid)
+    print('Validated in %.3f s with %d worker(s): %.1f blocks/s, %.1f transactions/s' %
+          (validation_time, args.workers,
+           num_blocks / validation_time if validation_time else 0,
+           num_transactions / validation_time if validation_time else 0))
@@ -0,0 +1,165 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import pss
+
+from difficulty import meets_target
+
+# Max number of parsed public keys that each process keeps.
+KEY_CACHE_SIZE = 1024
+# Batches smaller than this are verified in the calling thread, because
+# sending them to the pool costs more than verifying them.
+MIN_POOL_BATCH = 8
+# Number of chunks per worker that a chain is split in, so that the workers
+# stay busy when some blocks are larger than others.
+CHUNKS_PER_WORKER = 4
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def get_verifier(sender_address):
+    """Returns a PSS verifier for the given public key (in PEM format).
+
+    Parsing the key is expensive, so the verifiers are cached per sender
+    address.
+    """
+
+    key = RSA.importKey(sender_address.encode('ISO-8859-1'))
+    return pss.new(key)
+
+
+def verify_parts(sender_address, transaction_id, signature):
+    """Verifies the signature of a transaction given its fields."""
+
+    try:
+        verifier = get_verifier(sender_address)
+        h = SHA256.new(transaction_id.encode('ISO-8859-1'))
+        verifier.verify(h, signature.encode('ISO-8859-1'))
+        return True
+    except (ValueError, TypeError, AttributeError, IndexError):
+        return False
+
+
+def _verify_chunk(chunk):
+    """Verifies a chunk of signatures in a worker process."""
+    return [verify_parts(*parts) for parts in chunk]
+
+
+def validate_block_parts(block):
+    """Validates a block independently of the other blocks of its chain.
+
+    The validation consists of:
+    - check that the current hash is valid.
+    - check that no transaction appears twice.
+    - check that the hash is lower than the target of the block (except for
+      the genesis block, which is not mined). Whether the target is the
+      one that the chain requires depends on the previous blocks.
+    - verify the signatures of the transactions (except for the genesis
+      block, whose only transaction is not signed).
+    """
+
+    if (block.current_hash != block.get_hash() or
+            not block.has_unique_transactions()):
+        return False
+    if block.previous_hash == 1:
+        return True
+    if not meets_target(block.current_hash, block.target):
+        return False
+    return all(
+        verify_parts(tr.sender_address, tr.transaction_id, tr.signature)
+        for tr in block.transactions)
+
+
+def _validate_chunk(chunk):
+    """Validates a chunk of blocks in a worker process."""
+    return [validate_block_parts(block) for block in chunk]
+
+
+class SignatureVerifier:
+    """
+    A service that verifies the signatures of batches of transactions and
+    validates whole chains.
+
+    Attributes:
+        workers (int): number of worker processes (1 verifies in the calling
+                       thread).
+        pool (ProcessPoolExecutor): the pool of the worker processes
+                                    (created on first use).
+    """
+
+    def __init__(self, workers=1):
+        """Inits a SignatureVerifier."""
+        self.workers = workers
+        self.pool = None
+
+    def close(self):
+        """Terminates the worker processes."""
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def verify_batch(self, transactions):
+        """Verifies the signatures of the given transactions.
+
+        Returns:
+            a list with the result of each transaction.
+        """
+
+        batch = [
+            (tr.sender_address, tr.transaction_id, tr.signature)
+            for tr in transactions
+        ]
+        if self.workers <= 1 or len(batch) < MIN_POOL_BATCH:
+            return _verify_chunk(batch)
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers)
+
+        # Split the batch in one chunk per worker.
+        chunk_size = -(-len(batch) // self.workers)
+        chunks = [
+            batch[i:i + chunk_size]
+            for i in range(0, len(batch), chunk_size)
+        ]
+        results = []
+        for chunk_results in self.pool.map(_verify_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def verify_all(self, transactions):
+        """Returns True if the signatures of all the transactions are valid."""
+        return all(self.verify_batch(transactions))
+
+    def find_invalid_block(self, blocks):
+        """Validates a sequence of blocks that starts with the genesis block.
+
+        The hashes and the signatures of the blocks are independent of each
+        other, so they are validated in parallel chunks. The links between
+        the blocks are checked last, in a single pass.
+
+        Returns:
+            the height of the first invalid block or None if all the blocks
+            are valid.
+        """
+
+        if len(blocks) < MIN_POOL_BATCH or self.workers <= 1:
+            results = _validate_chunk(blocks)
+        else:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.workers)
+            chunk_size = -(-len(blocks) // (self.workers * CHUNKS_PER_WORKER))
+            chunks = [
+                blocks[i:i + chunk_size]
+                for i in range(0, len(blocks), chunk_size)
+            ]
+            results = []
+            for chunk_results in self.pool.map(_validate_chunk, chunks):
+                results.extend(chunk_results)
+
+        previous_hash = 1
+        for height, block in enumerate(blocks):
+            if not results[height] or block.previous_hash != previous_hash:
+                return height
+            previous_hash = block.current_hash
+        return None
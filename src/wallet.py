@@ -1,18 +1,11 @@
-import binascii
+import os
 
-import Crypto
-import Crypto.Random
-from Crypto.Hash import SHA
-from Crypto.PublicKey import RSA
-from Crypto.Signature import PKCS1_v1_5
+from threading import Event, Lock, Thread
 
-import hashlib
-import json
-from time import time
-from urllib.parse import urlparse
-from uuid import uuid4
+from Crypto.PublicKey import RSA
+from Crypto.Signature import pss
 
-from json import JSONEncoder
+from verifier import get_verifier
 
 
 class Wallet:
@@ -22,33 +15,119 @@ class Wallet:
     Attributes:
         private_key (int): the private key of the node.
         public_key (int): the public key of the node (also serves as the node's address).
-        transactions (list): a list that contains the transactions of the node.
+        key (RsaKey): the parsed private key, so that it is not parsed again
+                      for each transaction.
+        signer (PSS_SigScheme): the signer of the transactions of the node.
+        verifier (PSS_SigScheme): the verifier of the signatures of the node
+                                  (shared with the verifier cache).
+        keys (tuple): the (private_key, public_key, key, signer, verifier)
+                      of the wallet, once they are set.
+        key_ready (Event): set when the keys of the wallet are set.
+        key_lock (Lock): a lock in order to generate the keys only once.
+
+    Generating a key is slow, so a new wallet generates its key when it is
+    first used, or in the background (see start_key_generation).
     """
 
-    def __init__(self):
-        """Inits a Wallet"""
-        # Generate a private key of key length of 1024 bits.
-        key = RSA.generate(1024)
+    def __init__(self, private_key=None):
+        """Inits a Wallet.
+
+        If a private key (in PEM format) is given, the wallet uses it
+        instead of generating a new one.
+        """
+        self.keys = None
+        self.key_ready = Event()
+        self.key_lock = Lock()
+        if private_key:
+            self.set_key(RSA.importKey(private_key.encode('ISO-8859-1')))
+
+    @classmethod
+    def from_keystore(cls, path):
+        """Inits a Wallet with the private key of a keystore file.
+
+        If the file doesn't exist, a new key is generated in the background
+        and saved in it.
+        """
 
-        self.private_key = key.exportKey().decode('ISO-8859-1')
+        if os.path.exists(path):
+            with open(path, 'r', encoding='ISO-8859-1') as f:
+                return cls(f.read())
+        wallet = cls()
+        wallet.start_key_generation(keystore=path)
+        return wallet
+
+    def save_keystore(self, path):
+        """Saves the private key of the wallet in a new keystore file."""
+
+        # The keystore is readable only by its owner.
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with open(fd, 'w', encoding='ISO-8859-1') as f:
+            f.write(self.private_key)
+
+    def set_key(self, key):
+        """Sets the keys of the wallet given its parsed private key."""
+
+        private_key = key.exportKey().decode('ISO-8859-1')
         # Generate the public key from the above private key.
-        self.public_key = key.publickey().exportKey().decode('ISO-8859-1')
-        self.transactions = []
+        public_key = key.publickey().exportKey().decode('ISO-8859-1')
+        self.keys = (private_key, public_key, key, pss.new(key),
+                     get_verifier(public_key))
+        self.key_ready.set()
+
+    def generate_key(self):
+        """Generates the key of the wallet, unless it is already set."""
+        with self.key_lock:
+            if not self.key_ready.is_set():
+                # Generate a private key of key length of 1024 bits.
+                self.set_key(RSA.generate(1024))
+
+    def start_key_generation(self, keystore=None):
+        """Generates the key of the wallet in the background and saves it
+        in a new keystore file, if one is given."""
+
+        def generate():
+            self.generate_key()
+            if keystore:
+                self.save_keystore(keystore)
+
+        if keystore or not self.key_ready.is_set():
+            Thread(target=generate, daemon=True).start()
+
+    def get_keys(self):
+        """Returns the keys of the wallet, after they are set."""
+        if not self.key_ready.is_set():
+            self.generate_key()
+        return self.keys
+
+    @property
+    def private_key(self):
+        """The private key of the wallet (in PEM format)."""
+        return self.get_keys()[0]
+
+    @property
+    def public_key(self):
+        """The public key of the wallet (in PEM format)."""
+        return self.get_keys()[1]
+
+    @property
+    def key(self):
+        """The parsed private key of the wallet."""
+        return self.get_keys()[2]
+
+    @property
+    def signer(self):
+        """The signer of the transactions of the wallet."""
+        return self.get_keys()[3]
+
+    @property
+    def verifier(self):
+        """The verifier of the signatures of the wallet."""
+        return self.get_keys()[4]
 
     def __str__(self):
         """Returns a string representation of a Wallet object."""
         return str(self.__class__) + ": " + str(self.__dict__)
 
-    def get_balance(self):
-        """Returns the total balance of the wallet by iterating through the
-            transaction outputs."""
-
-        # The balance of the wallet equals the sum of the UTXOs that
-        # have as recipient the current wallet.
-        total = 0
-        for tr in self.transactions:
-            for output in tr.transaction_outputs:
-                if output.unspent and output.recipient == self.public_key:
-                    total += output.amount
-
-        return total
+    def sign_transaction(self, transaction):
+        """Signs a transaction with the private key of the wallet."""
+        transaction.sign_transaction(self.signer)
@@ -0,0 +1,410 @@
+import hashlib
+import struct
+
+from block import Block
+from blockchain import Blockchain
+from transaction import Transaction
+from transaction_input import TransactionInput
+from transaction_output import TransactionOutput
+
+# Version of the binary format. Peers that don't advertise it get pickle.
+WIRE_VERSION = 1
+# Content type of the payloads in the binary format.
+CONTENT_TYPE = 'application/x-noobcash'
+# Content types of streams of blocks in the binary and in pickle format.
+STREAM_CONTENT_TYPE = 'application/x-noobcash-stream'
+PICKLE_STREAM_CONTENT_TYPE = 'application/x-pickle-stream'
+
+# Types of the encoded objects.
+TRANSACTION = 1
+BLOCK = 2
+BLOCKCHAIN = 3
+TRANSACTION_LIST = 4
+
+# Kinds of references to public keys.
+KEY_NODE = 0
+KEY_HASH = 1
+KEY_INLINE = 2
+
+# Kinds of ids (node ids are integers, except the sender of the genesis
+# transaction).
+ID_NONE = 0
+ID_INT = 1
+ID_STR = 2
+
+# Flags of the optional fields of a block.
+HAS_INDEX = 1
+HAS_NONCE = 2
+HAS_CURRENT_HASH = 4
+INT_PREVIOUS_HASH = 8
+HAS_TARGET = 16
+
+TRANSACTION_ID_SIZE = 128
+HASH_SIZE = 32
+TARGET_SIZE = 32
+NONE_COUNT = 0xFFFF
+
+HEADER = struct.Struct('<BB')
+U8 = struct.Struct('<B')
+U16 = struct.Struct('<H')
+U32 = struct.Struct('<I')
+I32 = struct.Struct('<i')
+I64 = struct.Struct('<q')
+AMOUNTS = struct.Struct('<qq')
+BLOCK_FIELDS = struct.Struct('<BqdQq')
+
+
+def fingerprint(public_key):
+    """Returns the SHA256 hash of a public key (in PEM format)."""
+    return hashlib.sha256(public_key.encode('ISO-8859-1')).digest()
+
+
+class KeyRegistry:
+    """
+    The public keys that can be referenced instead of sent inline.
+
+    Attributes:
+        ids (dict): the node id of each public key of the ring.
+        keys (dict): the public key of each node id.
+        hashes (dict): the public key of each key fingerprint.
+    """
+
+    def __init__(self, ring=()):
+        """Inits a KeyRegistry given the ring of a node."""
+        self.ids = {}
+        self.keys = {}
+        self.hashes = {}
+        for ring_node in ring:
+            self.ids[ring_node['public_key']] = ring_node['id']
+            self.keys[ring_node['id']] = ring_node['public_key']
+            self.hashes[fingerprint(ring_node['public_key'])] = (
+                ring_node['public_key'])
+
+
+class Encoder:
+    """
+    Encodes noobcash objects in the binary format.
+
+    Attributes:
+        registry (KeyRegistry): the keys that are sent as references.
+        parts (list): the encoded parts of the payload.
+    """
+
+    def __init__(self, registry):
+        """Inits an Encoder."""
+        self.registry = registry
+        self.parts = []
+
+    def key(self, public_key):
+        """Encodes a public key as a reference to a node, if possible."""
+        node_id = self.registry.ids.get(public_key)
+        if node_id is not None:
+            self.parts.append(U8.pack(KEY_NODE) + U16.pack(node_id))
+        else:
+            data = public_key.encode('ISO-8859-1')
+            self.parts.append(U8.pack(KEY_INLINE) + U16.pack(len(data)))
+            self.parts.append(data)
+
+    def node_id(self, value):
+        """Encodes a node id."""
+        if value is None:
+            self.parts.append(U8.pack(ID_NONE))
+        elif isinstance(value, str):
+            data = value.encode('ISO-8859-1')
+            self.parts.append(U8.pack(ID_STR) + U16.pack(len(data)) + data)
+        else:
+            self.parts.append(U8.pack(ID_INT) + I32.pack(value))
+
+    def transaction_id(self, value):
+        """Encodes a transaction id (fixed size)."""
+        data = value.encode('ISO-8859-1')
+        if len(data) != TRANSACTION_ID_SIZE:
+            raise ValueError('Invalid transaction id.')
+        self.parts.append(data)
+
+    def transaction(self, transaction):
+        """Encodes a transaction."""
+
+        self.key(transaction.sender_address)
+        self.node_id(transaction.sender_id)
+        self.key(transaction.receiver_address)
+        self.node_id(transaction.receiver_id)
+        self.parts.append(AMOUNTS.pack(transaction.amount, transaction.nbc_sent))
+        self.transaction_id(transaction.transaction_id)
+
+        signature = (transaction.signature or '').encode('ISO-8859-1')
+        self.parts.append(U16.pack(len(signature)))
+        self.parts.append(signature)
+
+        inputs = transaction.transaction_inputs
+        if inputs is None:
+            self.parts.append(U16.pack(NONE_COUNT))
+        else:
+            self.parts.append(U16.pack(len(inputs)))
+            for transaction_input in inputs:
+                self.transaction_id(transaction_input.previous_output_id)
+                output_index = transaction_input.output_index
+                self.parts.append(U16.pack(
+                    NONE_COUNT if output_index is None else output_index))
+
+        # The id of each output is the id of the transaction and the outputs
+        # are unspent when they are sent, so only the recipient and the
+        # amount are encoded.
+        self.parts.append(U16.pack(len(transaction.transaction_outputs)))
+        for output in transaction.transaction_outputs:
+            self.key(output.recipient)
+            self.parts.append(I64.pack(output.amount))
+
+    def block(self, block):
+        """Encodes a block."""
+
+        flags = 0
+        if block.index is not None:
+            flags |= HAS_INDEX
+        if block.nonce is not None:
+            flags |= HAS_NONCE
+        if block.current_hash is not None:
+            flags |= HAS_CURRENT_HASH
+        if block.target is not None:
+            flags |= HAS_TARGET
+        if isinstance(block.previous_hash, int):
+            flags |= INT_PREVIOUS_HASH
+            previous_hash = block.previous_hash
+        else:
+            previous_hash = 0
+
+        self.parts.append(BLOCK_FIELDS.pack(
+            flags, block.index or 0, block.timestamp, block.nonce or 0,
+            previous_hash))
+        if not flags & INT_PREVIOUS_HASH:
+            self.parts.append(bytes.fromhex(block.previous_hash))
+        if flags & HAS_CURRENT_HASH:
+            self.parts.append(bytes.fromhex(block.current_hash))
+        if flags & HAS_TARGET:
+            self.parts.append(block.target.to_bytes(TARGET_SIZE, 'big'))
+
+        self.parts.append(U32.pack(len(block.transactions)))
+        for transaction in block.transactions:
+            self.transaction(transaction)
+
+    def blockchain(self, chain):
+        """Encodes a blockchain."""
+        self.parts.append(U32.pack(len(chain.blocks)))
+        for block in chain.blocks:
+            self.block(block)
+
+
+class Decoder:
+    """
+    Decodes noobcash objects from the binary format.
+
+    The fields are read directly from a memoryview of the payload, without
+    copying it.
+
+    Attributes:
+        registry (KeyRegistry): the keys that may be referenced.
+        view (memoryview): the payload.
+        offset (int): the position of the next field.
+    """
+
+    def __init__(self, data, registry):
+        """Inits a Decoder."""
+        self.registry = registry
+        self.view = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, fmt):
+        """Reads a fixed-size field."""
+        values = fmt.unpack_from(self.view, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def read(self, size):
+        """Reads the next size bytes as a view of the payload."""
+        if self.offset + size > len(self.view):
+            raise ValueError('Truncated payload.')
+        data = self.view[self.offset:self.offset + size]
+        self.offset += size
+        return data
+
+    def string(self, size):
+        """Reads a string of the given size."""
+        return str(self.read(size), 'ISO-8859-1')
+
+    def key(self):
+        """Decodes a public key."""
+        kind, = self.unpack(U8)
+        if kind == KEY_NODE:
+            node_id, = self.unpack(U16)
+            return self.registry.keys[node_id]
+        if kind == KEY_HASH:
+            return self.registry.hashes[bytes(self.read(HASH_SIZE))]
+        if kind == KEY_INLINE:
+            size, = self.unpack(U16)
+            return self.string(size)
+        raise ValueError('Invalid key reference.')
+
+    def node_id(self):
+        """Decodes a node id."""
+        kind, = self.unpack(U8)
+        if kind == ID_NONE:
+            return None
+        if kind == ID_STR:
+            size, = self.unpack(U16)
+            return self.string(size)
+        return self.unpack(I32)[0]
+
+    def transaction(self):
+        """Decodes a transaction."""
+
+        sender_address = self.key()
+        sender_id = self.node_id()
+        receiver_address = self.key()
+        receiver_id = self.node_id()
+        amount, nbc_sent = self.unpack(AMOUNTS)
+        transaction_id = self.string(TRANSACTION_ID_SIZE)
+
+        size, = self.unpack(U16)
+        signature = self.string(size) if size else None
+
+        count, = self.unpack(U16)
+        if count == NONE_COUNT:
+            inputs = None
+        else:
+            inputs = []
+            for _ in range(count):
+                previous_output_id = self.string(TRANSACTION_ID_SIZE)
+                output_index, = self.unpack(U16)
+                inputs.append(TransactionInput(
+                    previous_output_id,
+                    None if output_index == NONE_COUNT else output_index))
+
+        count, = self.unpack(U16)
+        outputs = []
+        for _ in range(count):
+            recipient = self.key()
+            output_amount, = self.unpack(I64)
+            outputs.append(TransactionOutput(
+                transaction_id, recipient, output_amount))
+
+        return Transaction(
+            sender_address=sender_address,
+            sender_id=sender_id,
+            receiver_address=receiver_address,
+            receiver_id=receiver_id,
+            amount=amount,
+            transaction_inputs=inputs,
+            nbc_sent=nbc_sent,
+            transaction_id=transaction_id,
+            transaction_outputs=outputs,
+            signature=signature
+        )
+
+    def block(self):
+        """Decodes a block."""
+
+        flags, index, timestamp, nonce, previous_hash = self.unpack(
+            BLOCK_FIELDS)
+        if not flags & INT_PREVIOUS_HASH:
+            previous_hash = self.read(HASH_SIZE).hex()
+
+        block = Block(index if flags & HAS_INDEX else None, previous_hash)
+        block.timestamp = timestamp
+        block.nonce = nonce if flags & HAS_NONCE else None
+        if flags & HAS_CURRENT_HASH:
+            block.current_hash = self.read(HASH_SIZE).hex()
+        if flags & HAS_TARGET:
+            block.target = int.from_bytes(self.read(TARGET_SIZE), 'big')
+
+        count, = self.unpack(U32)
+        block.transactions = [self.transaction() for _ in range(count)]
+        return block
+
+    def blockchain(self):
+        """Decodes a blockchain."""
+        chain = Blockchain()
+        count, = self.unpack(U32)
+        chain.replace([self.block() for _ in range(count)])
+        return chain
+
+
+def encode(obj, registry):
+    """Encodes a Transaction, a list of transactions, a Block or a Blockchain
+    in the binary format."""
+
+    encoder = Encoder(registry)
+    if isinstance(obj, Transaction):
+        encoder.parts.append(HEADER.pack(WIRE_VERSION, TRANSACTION))
+        encoder.transaction(obj)
+    elif isinstance(obj, Block):
+        encoder.parts.append(HEADER.pack(WIRE_VERSION, BLOCK))
+        encoder.block(obj)
+    elif isinstance(obj, Blockchain):
+        encoder.parts.append(HEADER.pack(WIRE_VERSION, BLOCKCHAIN))
+        encoder.blockchain(obj)
+    elif isinstance(obj, list):
+        encoder.parts.append(HEADER.pack(WIRE_VERSION, TRANSACTION_LIST))
+        encoder.parts.append(U32.pack(len(obj)))
+        for transaction in obj:
+            encoder.transaction(transaction)
+    else:
+        raise TypeError('Can not encode ' + str(type(obj)))
+    return b''.join(encoder.parts)
+
+
+def decode(data, registry):
+    """Decodes an object encoded with encode.
+
+    Raises:
+        ValueError: if the payload is not valid.
+    """
+
+    decoder = Decoder(data, registry)
+    try:
+        version, kind = decoder.unpack(HEADER)
+        if version != WIRE_VERSION:
+            raise ValueError('Unsupported version ' + str(version) + '.')
+        if kind == TRANSACTION:
+            obj = decoder.transaction()
+        elif kind == BLOCK:
+            obj = decoder.block()
+        elif kind == BLOCKCHAIN:
+            obj = decoder.blockchain()
+        elif kind == TRANSACTION_LIST:
+            count, = decoder.unpack(U32)
+            obj = [decoder.transaction() for _ in range(count)]
+        else:
+            raise ValueError('Unknown type ' + str(kind) + '.')
+    except (struct.error, KeyError) as e:
+        raise ValueError('Invalid payload: ' + str(e))
+
+    if decoder.offset != len(decoder.view):
+        raise ValueError('Trailing data in payload.')
+    return obj
+
+
+def frame(data):
+    """Prefixes a payload with its length, so that multiple payloads can be
+    sent one after the other in a stream."""
+    return U32.pack(len(data)) + data
+
+
+def iter_frames(chunks):
+    """Yields the payloads of a stream of frames as they arrive, given the
+    stream in chunks of any size.
+
+    An incomplete frame at the end of the stream is dropped.
+    """
+
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        offset = 0
+        while len(buffer) - offset >= U32.size:
+            size, = U32.unpack_from(buffer, offset)
+            end = offset + U32.size + size
+            if end > len(buffer):
+                break
+            yield bytes(buffer[offset + U32.size:end])
+            offset = end
+        del buffer[:offset]
@@ -0,0 +1,438 @@
+import bisect
+import itertools
+import json
+import os
+import pickle
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from argparse import ArgumentParser
+
+import requests
+from texttable import Texttable
+
+# Add the source files in our path (the blocks of the nodes are unpickled).
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+import config
+import wire
+
+# Upper bounds (in seconds) of the buckets of the latency histograms.
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120]
+# Blocks that are read again in each poll of a chain, so that the blocks of
+# a branch that replaced the previous tip are seen too.
+REORG_DEPTH = 5
+# Size in bytes of the chunks in which the chains are read.
+STREAM_CHUNK = 64 * 1024
+
+
+def free_ports(count):
+    """Returns count ports that are currently free."""
+
+    sockets = []
+    for _ in range(count):
+        s = socket.socket()
+        s.bind((config.BOOTSTRAP_IP, 0))
+        sockets.append(s)
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def read_workload(path, limit=None):
+    """Reads the transactions of a text file (one `id[#] amount` per line).
+
+    Returns:
+        a list of (receiver_id, amount) pairs.
+    """
+
+    transactions = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.split()
+            if line:
+                transactions.append((int(line[0][2:]), int(line[1])))
+    return transactions[:limit]
+
+
+class Cluster:
+    """
+    A network of nodes that run locally, each in its own process.
+
+    Attributes:
+        num_nodes (int): the number of nodes.
+        urls (list): the address of each node (the bootstrap node first).
+        processes (list): the processes of the nodes.
+    """
+
+    def __init__(self, num_nodes, capacity, difficulty, extra_args=(),
+                 log_dir=None):
+        """Starts the nodes of a Cluster in free ports."""
+
+        self.num_nodes = num_nodes
+        ports = free_ports(num_nodes)
+        self.urls = ['http://%s:%d' % (config.BOOTSTRAP_IP, port)
+                     for port in ports]
+        self.processes = []
+        for i, port in enumerate(ports):
+            args = [sys.executable, 'rest.py', '-p', str(port),
+                    '-n', str(num_nodes), '-capacity', str(capacity),
+                    '-difficulty', str(difficulty),
+                    '-bootstrap_port', str(ports[0])] + list(extra_args)
+            if i == 0:
+                args.append('-bootstrap')
+            if log_dir:
+                log = open(os.path.join(log_dir, 'node%d.log' % i), 'w')
+            else:
+                log = subprocess.DEVNULL
+            self.processes.append(subprocess.Popen(
+                args, cwd=SRC, stdout=log, stderr=subprocess.STDOUT))
+
+    def get(self, i, endpoint, **kwargs):
+        """Sends a GET request to the i-th node."""
+        return requests.get(self.urls[i] + endpoint, timeout=10, **kwargs)
+
+    def post_all(self, endpoint, **kwargs):
+        """Sends a POST request to all the nodes."""
+        for url in self.urls:
+            requests.post(url + endpoint, timeout=60,
+                          **kwargs).raise_for_status()
+
+    def save_traces(self, path):
+        """Merges the traces of all the nodes in one file."""
+        events = []
+        for i in range(self.num_nodes):
+            events.extend(self.get(i, '/admin/trace').json()['traceEvents'])
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def save_profiles(self, prefix):
+        """Saves the profile of each node in a file (in folded format)."""
+        for i in range(self.num_nodes):
+            with open('%s-node%d.folded' % (prefix, i), 'w') as f:
+                f.write(self.get(i, '/admin/profiler').text)
+
+    def wait_ready(self, timeout):
+        """Waits until each node has received its initial coins.
+
+        The ids of the nodes depend on the order of their registration, so
+        the addresses are sorted by id, i.e. urls[i] is the node with id i.
+        """
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if all(self.get(i, '/api/get_balance').json()['balance'] == 100
+                       for i in range(self.num_nodes)):
+                    ids = [self.get(i, '/api/get_id').json()['message']
+                           for i in range(self.num_nodes)]
+                    self.urls = [url for _, url in sorted(zip(ids, self.urls))]
+                    return
+            except (requests.exceptions.RequestException, ValueError):
+                pass
+            for process in self.processes:
+                if process.poll() is not None:
+                    raise RuntimeError('a node exited during the startup')
+            time.sleep(0.5)
+        raise RuntimeError('the network was not ready in %d s' % timeout)
+
+    def stop(self):
+        """Terminates the nodes."""
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+
+
+class ChainObserver:
+    """
+    Polls the chain of each node and records when each transaction is first
+    seen in it.
+
+    Attributes:
+        cluster (Cluster): the observed nodes.
+        interval (float): seconds between the polls (the resolution of the
+                          measured latencies).
+        heights (list): the length of the chain of each node.
+        confirmed (list): the time that each transaction id (in hex format)
+                          was first seen in the chain of each node.
+        block_times (list): the time that each new block was first seen in
+                            the chain of the bootstrap node.
+        stopped (Event): set when the observer should exit.
+        thread (Thread): the thread that polls the nodes.
+    """
+
+    def __init__(self, cluster, interval):
+        """Inits a ChainObserver."""
+        self.cluster = cluster
+        self.interval = interval
+        self.heights = [0] * cluster.num_nodes
+        self.confirmed = [{} for _ in range(cluster.num_nodes)]
+        self.block_times = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def poll(self, i):
+        """Reads the new blocks of the i-th node."""
+
+        start = max(self.heights[i] - REORG_DEPTH, 0)
+        with self.cluster.get(i, '/stream_chain', params={'start': start},
+                              stream=True) as response:
+            response.raise_for_status()
+            blocks = [pickle.loads(data) for data in
+                      wire.iter_frames(response.iter_content(STREAM_CHUNK))]
+        now = time.time()
+        confirmed = self.confirmed[i]
+        for block in blocks:
+            for transaction in block.transactions:
+                transaction_id = transaction.transaction_id.encode(
+                    'ISO-8859-1').hex()
+                confirmed.setdefault(transaction_id, now)
+        height = start + len(blocks)
+        if i == 0:
+            self.block_times.extend([now] * (height - self.heights[i]))
+        self.heights[i] = max(self.heights[i], height)
+
+    def run(self):
+        """Polls the nodes until the observer is stopped."""
+        while not self.stopped.is_set():
+            for i in range(self.cluster.num_nodes):
+                try:
+                    self.poll(i)
+                except (requests.exceptions.RequestException, EOFError):
+                    pass
+            self.stopped.wait(self.interval)
+
+    def is_confirmed(self, transaction_id):
+        """Returns True if the transaction is in the chain of all nodes."""
+        return all(transaction_id in confirmed for confirmed in self.confirmed)
+
+    def confirmation_time(self, transaction_id):
+        """Returns the time that the last node saw the transaction."""
+        return max(confirmed[transaction_id] for confirmed in self.confirmed)
+
+
+def replay(cluster, i, workload, records):
+    """Sends the transactions of a workload from the i-th node, one after
+    the other, and records the time of each one."""
+
+    for receiver_id, amount in workload:
+        start_time = time.time()
+        try:
+            response = requests.post(
+                cluster.urls[i] + '/api/create_transaction',
+                data={'receiver': receiver_id, 'amount': amount}, timeout=60)
+            status = response.status_code
+            transaction_id = response.json().get('transaction_id')
+        except (requests.exceptions.RequestException, ValueError):
+            status, transaction_id = None, None
+        records.append({'node': i, 'start': start_time,
+                        'end': time.time(), 'status': status,
+                        'transaction_id': transaction_id})
+
+
+def summarize(values):
+    """Returns the count, the mean, the percentiles and the histogram of a
+    list of latencies."""
+
+    values = sorted(values)
+    histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+    for value in values:
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+
+    def percentile(p):
+        return values[min(int(p * len(values)), len(values) - 1)] if values else None
+
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(0.5),
+        'p90': percentile(0.9),
+        'p99': percentile(0.99),
+        'max': values[-1] if values else None,
+        'buckets': LATENCY_BUCKETS + ['inf'],
+        'histogram': histogram
+    }
+
+
+def run_benchmark(num_nodes, capacity, difficulty, run, args):
+    """Runs the workload of num_nodes nodes in a new cluster.
+
+    If a trace or a profile directory is given, the nodes are traced or
+    profiled during the run and the results are saved in it.
+
+    Returns:
+        the results of the run.
+    """
+
+    workload_dir = os.path.join(args.workloads, '%dnodes' % num_nodes)
+    workloads = [
+        read_workload(os.path.join(workload_dir, 'transactions%d.txt' % i),
+                      args.limit)
+        for i in range(num_nodes)
+    ]
+
+    cluster = Cluster(num_nodes, capacity, difficulty, args.node_args,
+                      args.logs)
+    try:
+        cluster.wait_ready(args.startup_timeout)
+        observer = ChainObserver(cluster, args.poll)
+        observer.poll(0)
+        initial_blocks = observer.heights[0]
+        observer.thread.start()
+        name = 'n%d-c%d-d%d-r%d' % (num_nodes, capacity, difficulty, run)
+        if args.trace:
+            cluster.post_all('/admin/trace/start')
+        if args.profile:
+            cluster.post_all('/admin/profiler/start')
+
+        records = []
+        threads = [threading.Thread(target=replay,
+                                    args=(cluster, i, workloads[i], records))
+                   for i in range(num_nodes)]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        submit_time = time.time() - start_time
+
+        # Wait until the accepted transactions are in all the chains. The
+        # transactions of a block that is not full are never mined, so the
+        # wait also ends when no transaction is confirmed for a while.
+        accepted = [r for r in records if r['status'] == 200]
+        deadline = time.time() + args.confirm_timeout
+        confirmed, last_progress = 0, time.time()
+        while confirmed < len(accepted) and time.time() < deadline:
+            time.sleep(args.poll)
+            now_confirmed = len([r for r in accepted
+                                 if observer.is_confirmed(r['transaction_id'])])
+            if now_confirmed > confirmed:
+                confirmed, last_progress = now_confirmed, time.time()
+            elif time.time() - last_progress > args.settle:
+                break
+        observer.stopped.set()
+        observer.thread.join()
+
+        confirmed = [r for r in accepted
+                     if observer.is_confirmed(r['transaction_id'])]
+        end_time = max([observer.confirmation_time(r['transaction_id'])
+                        for r in confirmed] or [time.time()])
+        elapsed = end_time - start_time
+        new_blocks = len([t for t in observer.block_times[initial_blocks:]
+                          if t <= end_time])
+        if args.trace:
+            cluster.post_all('/admin/trace/stop')
+            cluster.save_traces(os.path.join(args.trace, name + '.json'))
+        if args.profile:
+            cluster.post_all('/admin/profiler/stop')
+            cluster.save_profiles(os.path.join(args.profile, name))
+        metrics = [cluster.get(i, '/api/get_metrics').json()
+                   for i in range(num_nodes)]
+    finally:
+        cluster.stop()
+
+    mined_blocks = sum(m['mined_blocks'] for m in metrics)
+    return {
+        'nodes': num_nodes,
+        'capacity': capacity,
+        'difficulty': difficulty,
+        'node_args': list(args.node_args),
+        'transactions': len(records),
+        'accepted': len(accepted),
+        'confirmed': len(confirmed),
+        'pending': len(accepted) - len(confirmed),
+        'submit_time': submit_time,
+        'elapsed': elapsed,
+        'throughput': len(confirmed) / elapsed if elapsed else None,
+        'blocks': new_blocks,
+        'blocks_per_sec': new_blocks / elapsed if elapsed else None,
+        'mined_blocks': mined_blocks,
+        'mining_time': sum(m['mining_time'] for m in metrics),
+        'broadcast_time': sum(m['broadcast_time'] for m in metrics),
+        'mean_block_time': (sum(m['mining_time'] for m in metrics) /
+                            mined_blocks if mined_blocks else None),
+        'mean_broadcast_time': (sum(m['broadcast_time'] for m in metrics) /
+                                mined_blocks if mined_blocks else None),
+        'submit_latency': summarize([r['end'] - r['start'] for r in accepted]),
+        'confirm_latency': summarize(
+            [observer.confirmation_time(r['transaction_id']) - r['start']
+             for r in confirmed])
+    }
+
+
+if __name__ == "__main__":
+    # Define the argument parser.
+    parser = ArgumentParser(
+        description='Runs the transaction workloads in local networks for each combination of nodes, capacity and difficulty, and reports the throughput and the latencies.')
+
+    parser.add_argument('-nodes', type=int, nargs='+', default=[5],
+                        help='numbers of nodes (a workload is needed for each one)')
+    parser.add_argument('-capacities', type=int, nargs='+', default=[1, 5, 10],
+                        help='capacities of a block')
+    parser.add_argument('-difficulties', type=int, nargs='+', default=[4],
+                        help='mining difficulties')
+    parser.add_argument('-workloads', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'transactions'),
+        help='directory with a [N]nodes directory of transaction files for each number of nodes')
+    parser.add_argument('-limit', type=int,
+                        help='max number of transactions sent by each node')
+    parser.add_argument('-repeat', type=int, default=1,
+                        help='number of runs of each combination')
+    parser.add_argument('-poll', type=float, default=0.1,
+                        help='seconds between the polls of the chains')
+    parser.add_argument('-startup_timeout', type=float, default=120,
+                        help='seconds to wait for the network to start')
+    parser.add_argument('-confirm_timeout', type=float, default=300,
+                        help='seconds to wait for the transactions to be confirmed')
+    parser.add_argument('-settle', type=float, default=10,
+                        help='seconds without new confirmations after which the remaining transactions are counted as pending')
+    parser.add_argument('-node_args', type=shlex.split, default=[],
+                        help='extra arguments of the nodes as one quoted string, e.g. -node_args="-workers 2 -verifiers 2"')
+    parser.add_argument('-trace',
+                        help='directory for the traces of the runs (one file per run with the spans of all nodes)')
+    parser.add_argument('-profile',
+                        help='directory for the profiles of the nodes in each run (folded stacks)')
+    parser.add_argument('-logs',
+                        help='directory for the logs of the nodes')
+    parser.add_argument('-output', default='results.json',
+                        help='file where the results are written (JSON)')
+
+    # Parse the given arguments.
+    args = parser.parse_args()
+
+    results = []
+    for num_nodes, capacity, difficulty, run in itertools.product(
+            args.nodes, args.capacities, args.difficulties,
+            range(args.repeat)):
+        print('Running %d nodes, capacity %d, difficulty %d (run %d) ...' %
+              (num_nodes, capacity, difficulty, run + 1))
+        results.append(run_benchmark(num_nodes, capacity, difficulty, run, args))
+        # Write the results after each run, so they are kept if a later
+        # run fails.
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    table = Texttable()
+    table.set_deco(Texttable.HEADER)
+    table.set_max_width(0)
+    table.set_cols_dtype(['i', 'i', 'i', 'i', 'f', 'f', 'f', 'f', 'f'])
+    table.set_cols_align(["r"] * 9)
+    rows = [["Nodes", "Capacity", "Difficulty", "Confirmed", "Tx/s",
+             "Blocks/s", "Block time (s)", "p50 latency (s)",
+             "p99 latency (s)"]]
+    for result in results:
+        rows.append([result['nodes'], result['capacity'], result['difficulty'],
+                     result['confirmed'], result['throughput'] or 0,
+                     result['blocks_per_sec'] or 0,
+                     result['mean_block_time'] or 0,
+                     result['confirm_latency']['p50'] or 0,
+                     result['confirm_latency']['p99'] or 0])
+    table.add_rows(rows)
+    print(table.draw() + "\n")
+    print('Results written in ' + args.output)
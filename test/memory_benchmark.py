@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import tracemalloc
+
+from argparse import ArgumentParser
+from copy import deepcopy
+
+from Crypto.PublicKey import RSA
+from texttable import Texttable
+
+# Add the source files in our path.
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+from block import Block
+from mempool import Mempool
+from transaction import Transaction
+
+
+def create_transactions(count, num_keys):
+    """Creates count signed transactions between num_keys wallets."""
+
+    keys = []
+    for _ in range(num_keys):
+        key = RSA.generate(1024)
+        keys.append((key.exportKey().decode('ISO-8859-1'),
+                     key.publickey().exportKey().decode('ISO-8859-1')))
+
+    transactions = []
+    for i in range(count):
+        private_key, sender = keys[i % num_keys]
+        receiver = keys[(i + 1) % num_keys][1]
+        transaction = Transaction(
+            sender_address=sender, sender_id=i % num_keys,
+            receiver_address=receiver, receiver_id=(i + 1) % num_keys,
+            amount=1, transaction_inputs=[], nbc_sent=2)
+        transaction.sign_transaction(private_key)
+        transactions.append(transaction)
+    return transactions
+
+
+def deepcopy_templates(transactions, capacity):
+    """Fills blocks as before the mempool: the current block is deep-copied
+    each time it is full."""
+
+    blocks = []
+    current_block = Block(None, None)
+    for transaction in transactions:
+        current_block.transactions.append(transaction)
+        if len(current_block.transactions) == capacity:
+            blocks.append(deepcopy(current_block))
+            current_block = Block(None, None)
+    return blocks
+
+
+def mempool_templates(transactions, capacity):
+    """Fills blocks from a mempool, with references to the transactions."""
+
+    blocks = []
+    mempool = Mempool()
+    for transaction in transactions:
+        mempool.add(transaction)
+        block_transactions = mempool.pop_block(capacity)
+        if block_transactions is not None:
+            block = Block(None, None)
+            block.transactions = block_transactions
+            blocks.append(block)
+    return blocks
+
+
+def measure(method, transactions, capacity):
+    """Runs a method of block templating and returns the memory that it
+    retains and its peak memory per block (in KiB) and its time."""
+
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    start_time = time.perf_counter()
+    blocks = method(transactions, capacity)
+    elapsed = time.perf_counter() - start_time
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ((current - start) / 1024 / len(blocks),
+            (peak - start) / 1024 / len(blocks), elapsed)
+
+
+if __name__ == "__main__":
+    # Define the argument parser.
+    parser = ArgumentParser(
+        description='Measures the memory that is allocated per confirmed block when blocks are built from pending transactions.')
+
+    parser.add_argument('-blocks', type=int, default=100,
+                        help='number of blocks to build')
+    parser.add_argument('-capacity', type=int, default=10,
+                        help='capacity of a block')
+    parser.add_argument('-keys', type=int, default=5,
+                        help='number of wallets that send the transactions')
+
+    # Parse the given arguments.
+    args = parser.parse_args()
+
+    print('Signing %d transactions ...' % (args.blocks * args.capacity))
+    transactions = create_transactions(args.blocks * args.capacity, args.keys)
+
+    table = Texttable()
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['t', 'f', 'f', 'f'])
+    table.set_cols_align(["l", "r", "r", "r"])
+    rows = [["Templates", "Retained KiB/block", "Peak KiB/block", "Time (s)"]]
+    for name, method in [('deepcopy', deepcopy_templates),
+                         ('mempool', mempool_templates)]:
+        rows.append([name] + list(measure(method, transactions, args.capacity)))
+    table.add_rows(rows)
+    print(table.draw() + "\n")
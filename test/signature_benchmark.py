@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+
+from argparse import ArgumentParser
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import pss
+from texttable import Texttable
+
+# Add the source files in our path.
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+from transaction import Transaction
+from verifier import verify_parts
+from wallet import Wallet
+
+
+def create_transactions(wallet, count):
+    """Creates count unsigned transactions of a wallet."""
+    return [
+        Transaction(
+            sender_address=wallet.public_key, sender_id=0,
+            receiver_address=wallet.public_key, receiver_id=0,
+            amount=1, transaction_inputs=[], nbc_sent=1)
+        for _ in range(count)
+    ]
+
+
+def verify_uncached(transaction):
+    """Verifies a signature by parsing the public key of the sender, as
+    before the verifier cache."""
+
+    key = RSA.importKey(transaction.sender_address.encode('ISO-8859-1'))
+    h = SHA256.new(transaction.transaction_id.encode('ISO-8859-1'))
+    try:
+        pss.new(key).verify(h, transaction.signature.encode('ISO-8859-1'))
+        return True
+    except (ValueError, TypeError):
+        return False
+
+
+def rate(func, items):
+    """Calls func for each item and returns the calls per second."""
+    start_time = time.perf_counter()
+    for item in items:
+        func(item)
+    return len(items) / (time.perf_counter() - start_time)
+
+
+if __name__ == "__main__":
+    # Define the argument parser.
+    parser = ArgumentParser(
+        description='Measures the signatures and the verifications of transactions per second.')
+
+    parser.add_argument('-transactions', type=int, default=500,
+                        help='number of transactions to sign and verify')
+
+    # Parse the given arguments.
+    args = parser.parse_args()
+
+    wallet = Wallet()
+    pem_transactions = create_transactions(wallet, args.transactions)
+    signer_transactions = create_transactions(wallet, args.transactions)
+
+    # Signing with the PEM string parses the private key every time.
+    pem_signs = rate(lambda tr: tr.sign_transaction(wallet.private_key),
+                     pem_transactions)
+    signer_signs = rate(wallet.sign_transaction, signer_transactions)
+
+    uncached_verifies = rate(verify_uncached, signer_transactions)
+    cached_verifies = rate(
+        lambda tr: verify_parts(tr.sender_address, tr.transaction_id,
+                                tr.signature),
+        signer_transactions)
+
+    table = Texttable()
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['t', 'f', 'f', 'f'])
+    table.set_cols_align(["l", "r", "r", "r"])
+    table.add_rows([
+        ["Operation", "Parsed key (/s)", "Cached key (/s)", "Speedup"],
+        ["sign", pem_signs, signer_signs, signer_signs / pem_signs],
+        ["verify", uncached_verifies, cached_verifies,
+         cached_verifies / uncached_verifies],
+    ])
+    print(table.draw() + "\n")
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+
+import requests
+from texttable import Texttable
+
+# The source files of the node.
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+import config
+
+# Seconds between the requests that check if the node is up.
+POLL_INTERVAL = 0.02
+
+
+def import_time():
+    """Returns the seconds needed to import the endpoints of a node (which
+    creates the node) in a new interpreter."""
+
+    code = ('import time; start = time.perf_counter(); import endpoints; '
+            'print(time.perf_counter() - start)')
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=SRC)
+    return float(output)
+
+
+def ready_time(extra_args):
+    """Starts a bootstrap node of a network of one node and returns the
+    seconds until it answers a request."""
+
+    url = 'http://%s:%s/api/get_id' % (config.BOOTSTRAP_IP, config.BOOTSTRAP_PORT)
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, 'rest.py', '-p', config.BOOTSTRAP_PORT, '-n', '1',
+         '-capacity', '1', '-bootstrap'] + extra_args,
+        cwd=SRC, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while process.poll() is None:
+            try:
+                requests.get(url, timeout=1).raise_for_status()
+                return time.perf_counter() - start_time
+            except requests.exceptions.RequestException:
+                time.sleep(POLL_INTERVAL)
+        raise RuntimeError('the node exited with code %d' % process.returncode)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    # Define the argument parser.
+    parser = ArgumentParser(
+        description='Measures the time until a node is ready, with generated and with stored keys.')
+
+    parser.add_argument('-runs', type=int, default=5,
+                        help='number of measurements of each mode')
+
+    # Parse the given arguments.
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        keystore = os.path.join(directory, 'key.pem')
+        modes = [('generated key', []), ('keystore', ['-keystore', keystore])]
+        # Create the keystore before the measurements.
+        ready_time(modes[1][1])
+
+        imports = [import_time() for _ in range(args.runs)]
+        rows = [["Measurement", "Min (s)", "Mean (s)", "Max (s)"],
+                ["import endpoints", min(imports),
+                 sum(imports) / args.runs, max(imports)]]
+        for name, extra_args in modes:
+            times = [ready_time(extra_args) for _ in range(args.runs)]
+            rows.append(["ready (%s)" % name, min(times),
+                         sum(times) / args.runs, max(times)])
+
+    table = Texttable()
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['t', 'f', 'f', 'f'])
+    table.set_cols_align(["l", "r", "r", "r"])
+    table.add_rows(rows)
+    print(table.draw() + "\n")
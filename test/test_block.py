@@ -0,0 +1,47 @@
+import hashlib
+import os
+import sys
+
+# Add the source files in our path.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from block import Block, hash_nonce
+from difficulty import difficulty_to_target
+from miner import search
+from transaction import Transaction
+
+
+def create_block():
+    """Creates a block with a few unsigned transactions."""
+    block = Block(1, 'ab' * 32)
+    block.transactions = [
+        Transaction(sender_address='A', sender_id=0, receiver_address='B',
+                    receiver_id=1, amount=amount, transaction_inputs=None,
+                    nbc_sent=amount)
+        for amount in (1, 2, 3)
+    ]
+    block.target = difficulty_to_target(1)
+    return block
+
+
+def test_midstate_hash_equals_get_hash():
+    """Hashing the nonce and the tail after the midstate of the head gives
+    the hash of get_hash."""
+
+    block = create_block()
+    head, tail = block.get_header_parts()
+    midstate = hashlib.sha256(head)
+    for nonce in (0, 1, 9, 10, 12345, 2 ** 40):
+        block.nonce = nonce
+        assert hash_nonce(midstate, tail, nonce).hex() == block.get_hash()
+
+
+def test_search_finds_a_valid_nonce():
+    """The solution of the search is the hash of the block with its nonce
+    and is lower than the target."""
+
+    block = create_block()
+    nonce, block_hash = search(block.get_header_parts(), 0, 1, block.target,
+                               lambda: False)
+    block.nonce = nonce
+    assert block_hash == block.get_hash()
+    assert int(block_hash, 16) < block.target
@@ -0,0 +1,56 @@
+import os
+import sys
+
+# Add the source files in our path.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from block import BlockHeader
+from difficulty import (BLOCK_INTERVAL, MAX_FUTURE_TIME, RETARGET_WINDOW,
+                        difficulty_to_target, find_invalid_target, get_target)
+
+NOW = 1000000.0
+
+
+def create_chain(length, interval):
+    """Creates the headers of an honest chain whose blocks are mined every
+    interval seconds, with the targets that the chain requires."""
+
+    genesis = BlockHeader(0, NOW - length * interval, None,
+                          difficulty_to_target(4), 0, 1, None)
+    chain = [genesis]
+    for height in range(1, length):
+        chain.append(BlockHeader(height, genesis.timestamp + height * interval,
+                                 None, None, 0, None, None))
+        chain[-1].target = get_target(chain.__getitem__, height)
+    return chain
+
+
+def test_honest_chain_is_valid():
+    """The targets of an honest chain are valid and follow its block
+    interval."""
+
+    chain = create_chain(3 * RETARGET_WINDOW, BLOCK_INTERVAL / 2)
+    assert find_invalid_target(chain, now=NOW) is None
+    # The blocks were mined twice as fast as the network aims at.
+    assert (chain[RETARGET_WINDOW].target ==
+            chain[RETARGET_WINDOW - 1].target // 2)
+
+
+def test_tampered_chain_is_invalid():
+    """The first block with an easier target, a timestamp earlier than its
+    previous block or too far in the future is found."""
+
+    height = RETARGET_WINDOW + 2
+
+    chain = create_chain(3 * RETARGET_WINDOW, BLOCK_INTERVAL)
+    chain[height].target *= 2
+    assert find_invalid_target(chain, now=NOW) == height
+    # The chain is checked only from the given height.
+    assert find_invalid_target(chain, start=height + 1, now=NOW) == height + 1
+
+    chain = create_chain(3 * RETARGET_WINDOW, BLOCK_INTERVAL)
+    chain[height].timestamp = chain[height - 1].timestamp
+    assert find_invalid_target(chain, now=NOW) == height
+
+    chain = create_chain(3 * RETARGET_WINDOW, BLOCK_INTERVAL)
+    chain[-1].timestamp = NOW + MAX_FUTURE_TIME + 1
+    assert find_invalid_target(chain, now=NOW) == len(chain) - 1
@@ -0,0 +1,47 @@
+import os
+import sys
+
+# Add the source files in our path.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import merkle
+
+TRANSACTION_IDS = ['transaction %d' % i for i in range(5)]
+
+
+def test_proofs_of_all_transactions_are_valid():
+    """The proof of each transaction of trees with odd and even levels leads
+    to the root."""
+
+    for count in range(1, len(TRANSACTION_IDS) + 1):
+        transaction_ids = TRANSACTION_IDS[:count]
+        root = merkle.compute_root(transaction_ids)
+        for position, transaction_id in enumerate(transaction_ids):
+            proof = merkle.compute_proof(transaction_ids, position)
+            assert merkle.verify_proof(transaction_id, proof, root)
+
+
+def test_tampered_proofs_are_rejected():
+    """A proof is rejected for another transaction, with a changed sibling
+    or side, or against another root."""
+
+    root = merkle.compute_root(TRANSACTION_IDS)
+    proof = merkle.compute_proof(TRANSACTION_IDS, 2)
+    assert not merkle.verify_proof(TRANSACTION_IDS[3], proof, root)
+
+    sibling, side = proof[0]
+    changed_sibling = [(merkle.hash_leaf('other'), side)] + proof[1:]
+    assert not merkle.verify_proof(TRANSACTION_IDS[2], changed_sibling, root)
+    swapped_side = [(sibling, 'left' if side == 'right' else 'right')]
+    assert not merkle.verify_proof(TRANSACTION_IDS[2],
+                                   swapped_side + proof[1:], root)
+    assert not merkle.verify_proof(
+        TRANSACTION_IDS[2], proof, merkle.compute_root(TRANSACTION_IDS[:4]))
+
+
+def test_leaf_is_not_an_inner_node():
+    """An inner node can't be proven as a transaction."""
+
+    levels = merkle.compute_levels(TRANSACTION_IDS[:4])
+    root = levels[-1][0]
+    inner = levels[1][0]
+    assert not merkle.verify_proof(inner, [(levels[1][1], 'right')], root)
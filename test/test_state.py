@@ -0,0 +1,89 @@
+import os
+import sys
+
+# Add the source files in our path.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from block import Block
+from state import ChainState
+from transaction import Transaction
+from transaction_input import TransactionInput
+
+
+def create_transaction(sender, receiver, amount, inputs, nbc_sent):
+    """Creates an unsigned transaction that spends the given outputs."""
+    return Transaction(
+        sender_address=sender, sender_id=0, receiver_address=receiver,
+        receiver_id=1, amount=amount,
+        transaction_inputs=[TransactionInput(transaction_id, index)
+                            for transaction_id, index in inputs]
+        if inputs is not None else None,
+        nbc_sent=nbc_sent)
+
+
+def create_block(index, previous_hash, transactions):
+    """Creates a block with the given transactions."""
+    block = Block(index, previous_hash)
+    block.transactions = transactions
+    block.current_hash = block.get_hash()
+    return block
+
+
+def test_undo_block_with_parent_and_child():
+    """A block with a transaction and a child that spends its change is
+    undone without restoring the outputs of the block."""
+
+    state = ChainState()
+    genesis_transaction = create_transaction('0', 'A', 100, None, 100)
+    genesis = create_block(0, 1, [genesis_transaction])
+    state.update([], [genesis])
+
+    parent = create_transaction(
+        'A', 'B', 10, [(genesis_transaction.transaction_id, 0)], 100)
+    child = create_transaction(
+        'A', 'B', 20, [(parent.transaction_id, 1)], 90)
+    block = create_block(1, genesis.current_hash, [parent, child])
+
+    state.update([], [block])
+    assert state.utxos.get_balance('A') == 70
+    assert state.utxos.get_balance('B') == 30
+
+    state.update([block], [])
+    assert state.utxos.get_balance('A') == 100
+    assert state.utxos.get_balance('B') == 0
+    assert list(state.utxos.outputs) == [
+        (genesis_transaction.transaction_id, 0)]
+    assert state.ledger.get('A').confirmed == 100
+    # The transactions of the undone block are pending again.
+    assert state.get_balance('A') == 70
+    assert state.get_balance('B') == 30
+
+
+def test_pending_double_spend_is_rejected():
+    """A transaction that spends an output of a pending transaction is not
+    accepted and the inputs of a block are checked against the chain."""
+
+    state = ChainState()
+    genesis_transaction = create_transaction('0', 'A', 100, None, 100)
+    genesis = create_block(0, 1, [genesis_transaction])
+    assert state.validate_blocks([], [genesis])
+    state.update([], [genesis])
+
+    inputs = [(genesis_transaction.transaction_id, 0)]
+    to_b = create_transaction('A', 'B', 100, inputs, 100)
+    to_c = create_transaction('A', 'C', 100, inputs, 100)
+    assert state.validate_pending(to_b)
+    assert state.add_pending(to_b)
+    assert not state.validate_pending(to_c)
+    assert not state.add_pending(to_c)
+    assert state.ledger.get('A').get_balance() == 0
+    assert state.get_balance('C') == 0
+
+    # Both transactions spend the same output in a block.
+    block = create_block(1, genesis.current_hash, [to_b, to_c])
+    assert not state.validate_blocks([], [block])
+    # The sender doesn't own the output that it spends.
+    stolen = create_transaction('B', 'C', 100, inputs, 100)
+    assert not state.validate_blocks(
+        [], [create_block(1, genesis.current_hash, [stolen])])
+    assert state.validate_blocks(
+        [], [create_block(1, genesis.current_hash, [to_c])])
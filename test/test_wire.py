@@ -0,0 +1,101 @@
+import os
+import sys
+
+import pytest
+
+# Add the source files in our path.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import wire
+from block import Block
+from difficulty import difficulty_to_target
+from transaction import Transaction
+from transaction_input import TransactionInput
+
+RING = [{'id': 0, 'public_key': 'key of node 0'},
+        {'id': 1, 'public_key': 'key of node 1'}]
+
+
+def create_transaction(inputs):
+    """Creates a transaction from node 0 to node 1."""
+    return Transaction(
+        sender_address=RING[0]['public_key'], sender_id=0,
+        receiver_address=RING[1]['public_key'], receiver_id=1, amount=10,
+        transaction_inputs=inputs, nbc_sent=25, signature='signature')
+
+
+def assert_same_transaction(decoded, transaction):
+    """Checks that a decoded transaction has the fields of the original."""
+    for name in ('sender_address', 'sender_id', 'receiver_address',
+                 'receiver_id', 'amount', 'nbc_sent', 'transaction_id',
+                 'signature'):
+        assert getattr(decoded, name) == getattr(transaction, name)
+    assert ([(i.previous_output_id, i.output_index)
+             for i in decoded.transaction_inputs] ==
+            [(i.previous_output_id, i.output_index)
+             for i in transaction.transaction_inputs])
+    assert ([(o.transaction_id, o.recipient, o.amount)
+             for o in decoded.transaction_outputs] ==
+            [(o.transaction_id, o.recipient, o.amount)
+             for o in transaction.transaction_outputs])
+
+
+def test_block_round_trip():
+    """A block with keys of the ring and inline keys is decoded with the
+    same fields and the same hash."""
+
+    registry = wire.KeyRegistry(RING)
+    parent = create_transaction([TransactionInput('x' * 128, 0)])
+    child = Transaction(
+        sender_address=RING[1]['public_key'], sender_id=1,
+        receiver_address='key outside the ring', receiver_id=None, amount=5,
+        transaction_inputs=[TransactionInput(parent.transaction_id, 0)],
+        nbc_sent=10)
+    block = Block(3, 'ab' * 32)
+    block.transactions = [parent, child]
+    block.target = difficulty_to_target(2)
+    block.nonce = 42
+    block.current_hash = block.get_hash()
+
+    decoded = wire.decode(wire.encode(block, registry), registry)
+    assert (decoded.index, decoded.timestamp, decoded.target, decoded.nonce,
+            decoded.previous_hash, decoded.current_hash) == (
+        block.index, block.timestamp, block.target, block.nonce,
+        block.previous_hash, block.current_hash)
+    assert decoded.get_hash() == block.current_hash
+    for decoded_transaction, transaction in zip(decoded.transactions,
+                                                block.transactions):
+        assert_same_transaction(decoded_transaction, transaction)
+
+
+def test_frames_round_trip():
+    """Frames are split from chunks of any size."""
+
+    registry = wire.KeyRegistry(RING)
+    payloads = [
+        wire.encode(create_transaction([TransactionInput('y' * 128, i)]),
+                    registry)
+        for i in range(3)
+    ]
+    stream = b''.join(wire.frame(payload) for payload in payloads)
+    chunks = [stream[i:i + 7] for i in range(0, len(stream), 7)]
+    assert list(wire.iter_frames(chunks)) == payloads
+
+
+def test_malformed_frames_are_rejected():
+    """Truncated payloads, trailing data, unknown versions and references
+    to unknown keys raise ValueError."""
+
+    registry = wire.KeyRegistry(RING)
+    payload = wire.encode(
+        create_transaction([TransactionInput('z' * 128, 1)]), registry)
+
+    with pytest.raises(ValueError):
+        wire.decode(payload[:-1], registry)
+    with pytest.raises(ValueError):
+        wire.decode(payload + b'\x00', registry)
+    with pytest.raises(ValueError):
+        wire.decode(bytes([wire.WIRE_VERSION + 1]) + payload[1:], registry)
+    with pytest.raises(ValueError):
+        wire.decode(payload, wire.KeyRegistry())
+    # An incomplete frame at the end of the stream is dropped.
+    assert list(wire.iter_frames([wire.frame(payload)[:-1]])) == []